@@ -13,10 +13,6 @@ def get_config_path():
 
 CONFIG_FILE = get_config_path()
 
-# Hide the main Tkinter window
-root = tk.Tk()
-root.withdraw()
-
 # Load config
 def load_config():
     if os.path.exists(CONFIG_FILE):
@@ -85,6 +81,10 @@ def reset_config():
 
 # Main script logic
 def main():
+    # Hide the main Tkinter window (created here, so the functions above can be imported without a window)
+    root = tk.Tk()
+    root.withdraw()
+
     while True:
         processing_path = select_processing_location()
         supplier_path = select_supplier_file()
@@ -0,0 +1,51 @@
+import os #for creating file paths
+import sys #for checking if script is being used as exe and the exit code
+import json #for loading paths from config.json file
+import argparse #for the lookup options
+from pipeline.msg_archive import MsgArchive #for the index of the archived msg files
+from pipeline.supplier_file import clean_nip #NIPs are kept digits only
+
+# Finds the msg files (and attachments) kept in "Archive/<day>.zip" by script 2 ("msg_archive": true in config.json)
+# from the archive index, without opening the containers, and copies them out if asked to.
+#   python archive_lookup.py --file "Company_cat_01-02-2025.xlsx"   the msg file that came with that attachment
+#   python archive_lookup.py --nip 1234567890 --extract out          every file of one supplier, copied to "out"
+
+if getattr(sys, 'frozen', False):
+    base_path = os.path.dirname(sys.executable)  # Folder of the .exe
+else:
+    base_path = os.path.dirname(os.path.abspath(__file__))  # Folder of the .py
+
+CONFIG_FILE = os.path.join(base_path, "config.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finds and extracts msg files kept in the archive by script 2.")
+    parser.add_argument("--file", help="name in the archive or name of the supplier file (with or without extension)")
+    parser.add_argument("--nip", help="NIP of the supplier")
+    parser.add_argument("--extract", metavar="FOLDER", help="copy the files found to this folder")
+    args = parser.parse_args()
+    if not (args.file or args.nip):
+        parser.error("give --file or --nip")
+
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    folder = os.path.join(config.get("processing_location"), "Archive")
+    if not os.path.exists(os.path.join(folder, "index.db")):
+        print(f"❌ No archive in {folder}")
+        return 1
+
+    archive = MsgArchive(folder)
+    try:
+        found = archive.find(args.file, clean_nip(args.nip) if args.nip else None)
+        for member in found:
+            print(f"{member['name']}\t{member['archive']}\t{member['file'] or ''}\t{member['nip'] or ''}\t"
+                  f"{member['status']}\t{member['added']}")
+            if args.extract:
+                print(f"📤 Extracted to {archive.extract(member, args.extract)}")
+    finally:
+        archive.close()
+    print(f"🔚 Files found: {len(found)}")
+    return 0 if found else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
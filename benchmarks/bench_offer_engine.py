@@ -0,0 +1,58 @@
+# Micro-benchmark: per-file cost of validating an "offer" sheet and finding the "x" marks,
+# row-by-row (the way script 3 used to do it) vs. pipeline.offer_engine.evaluate_offer.
+# Run from the repository root: python benchmarks/bench_offer_engine.py
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.offer_engine import START_COL, SERVICE_COLUMNS, MAX_CATEGORIES, evaluate_offer
+
+# Previous implementation, timed against the engine (tests/test_offer_engine.py checks that they give the same answers)
+def check_errors(rows):
+    missing_x = True
+    empty_category = False
+    for row in rows:
+        for i_service, i_x in SERVICE_COLUMNS:
+            if str(row[i_x]).strip().lower() == 'x':
+                missing_x = False
+                if str(row[i_service]).strip() == '-':
+                    empty_category = True
+    return missing_x, empty_category
+
+def find_marks(rows):
+    marks = []
+    for i, (_, column) in enumerate(SERVICE_COLUMNS):
+        for idx in range(min(MAX_CATEGORIES, len(rows) - 2)):
+            if str(rows[idx + 2][column]).strip().lower() == 'x':
+                marks.append(START_COL + i + idx * 3)
+    return marks
+
+def reference(rows):
+    missing_x, empty_category = check_errors(rows)
+    return missing_x, empty_category, find_marks(rows)
+
+# Offer sheet like the supplier form: 2 header rows + 190 categories, some "x" marks in D/F/H
+def make_offer(rng, x_rate=0.1, dash_rate=0.05, rows=MAX_CATEGORIES + 2):
+    offer = [("LP", "Category", "Service type A", "Offer", "Service type B", "Offer", "Service type C", "Offer"),
+             ("Info", "Info", "Info", 'Please enter "x"', "Info", 'Please enter "x"', "Info", 'Please enter "x"')]
+    for n in range(rows - 2):
+        row = [n + 1, f"Category{n + 1}"]
+        for _ in SERVICE_COLUMNS:
+            row.append("-" if rng.random() < dash_rate else f"Service {n}")
+            row.append(rng.choice(["x", "X", " x "]) if rng.random() < x_rate else None)
+        offer.append(tuple(row))
+    return offer
+
+def main():
+    rng = random.Random(0)
+    sample = make_offer(rng)
+    number = 500
+    loop = min(timeit.repeat(lambda: reference(sample), number=number, repeat=5)) / number
+    engine = min(timeit.repeat(lambda: evaluate_offer(sample), number=number, repeat=5)) / number
+    print(f"row-by-row: {loop * 1e6:8.1f} us/file")
+    print(f"vectorized: {engine * 1e6:8.1f} us/file  ({loop / engine:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# End-to-end benchmark of both stages on synthetic data (benchmarks/synthetic_data.py):
+# for every number of supplier files (N) and master rows (M) each phase is timed separately -
+# screening (script 2), parse, validate, master load, NIP index, NIP lookup, master write/rewrite/save (per master writer),
+# file moves and invalid logging (script 3) - and the results are written as JSON.
+# With --baseline the run is compared with an earlier results file and exits with 1 if a phase got slower.
+# Run from the repository root: python benchmarks/bench_pipeline.py --files 20,100 --rows 300,1000
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import warnings
+from datetime import datetime
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy
+import pandas
+import openpyxl
+from synthetic_data import make_nips, generate_master, generate_suppliers
+from pipeline.xlsx_probe import probe_workbook
+from pipeline.supplier_file import read_supplier_file, parse_supplier_file, clean_nip
+from pipeline.offer_engine import evaluate_offer
+from pipeline.master import open_master
+from pipeline.nip_index import NipIndex, NIP_COLUMNS
+from pipeline.invalid_log import InvalidLog
+from pipeline.processing import Processing
+from pipeline.metrics import Metrics, BufferedLog
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+@contextmanager
+def timed(phases, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - start
+
+
+def run_writer(case_dir, master_template, writer, records, phases):
+    path = os.path.join(case_dir, f"master_{writer}.xlsm")
+    shutil.copyfile(master_template, path)
+    columns = {'data1': [805]}
+    for sheet, (nip_column, _) in NIP_COLUMNS.items():
+        columns[sheet] = columns.get(sheet, []) + [nip_column]
+
+    with timed(phases, f"{writer}.master_load"):
+        master = open_master(path, writer, columns)
+    with timed(phases, f"{writer}.nip_index_build"):
+        nip_index = NipIndex(path)
+        nip_index.build(master)
+
+    updates = []
+    with timed(phases, f"{writer}.nip_lookup"):
+        for record in records:
+            if record['status'] == 'ok':
+                row_data = nip_index.maps['data1'].get(record['nip'])
+                row_suppliers = nip_index.maps['data2'].get(record['nip'])
+                if row_data and row_suppliers:
+                    updates.append(record)
+    # The cell updates of script 3 (Processing.apply_record), then the same files sent again (update_row -
+    # nothing changed, so nothing is written)
+    config = {"processing_location": case_dir, "supplier_file_location": path, "master_writer": writer,
+              "offer_index": False, "change_report_file": "", "metrics_file": ""}
+    processing = Processing(config, Metrics(None), BufferedLog(os.path.join(case_dir, "log.txt")))
+    processing.log_error = processing.run_log.write  # the "no changes" lines are not printed while timing
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with timed(phases, f"{writer}.master_write"):
+        for record in updates:
+            processing.apply_record(record, master, nip_index, None, timestamp)
+    with timed(phases, f"{writer}.master_rewrite"):
+        processing.prefetch_rows(updates, master, nip_index)
+        for record in updates:
+            processing.apply_record(record, master, nip_index, None, timestamp)
+    processing.run_log.flush()
+    with timed(phases, f"{writer}.master_save"):
+        master.save()
+        nip_index.save()
+    with timed(phases, f"{writer}.nip_index_load"):
+        assert NipIndex(path).load(), "saved NIP index was not accepted"
+    return len(updates)
+
+def run_case(workdir, n, m, writers, args):
+    case_dir = os.path.join(workdir, f"n{n}_m{m}")
+    to_process = os.path.join(case_dir, "To_process")
+    phases = {}
+    started = time.perf_counter()
+
+    nips = make_nips(random.Random(args.seed), m)
+    os.makedirs(case_dir, exist_ok=True)
+    master_path = os.path.join(case_dir, "Supplier Database.xlsm")
+    generate_master(master_path, nips, args.seed)
+    manifest = generate_suppliers(to_process, n, nips, args.seed, args.no_x_rate, args.empty_category_rate,
+                                  args.bad_nip_rate, args.msg_bytes)
+    generate_seconds = time.perf_counter() - started
+    paths = [os.path.join(to_process, entry['file']) for entry in manifest]
+    bytes_read = sum(os.path.getsize(path) for path in paths)
+
+    # Script 2: sheet names + C1/C7 of every attachment
+    with timed(phases, "screening"):
+        for path in paths:
+            probe_workbook(path, 'DATA', ('C1', 'C7'))
+
+    # Script 3: one read-only pass over every file, then the checks on the values read
+    with timed(phases, "parse"):
+        contents = [read_supplier_file(path) for path in paths]
+    with timed(phases, "validate"):
+        for data_cells, offer_rows in contents:
+            clean_nip(data_cells['C7'])
+            evaluate_offer(offer_rows)
+
+    records = [parse_supplier_file(path) for path in paths]
+    counts = {"files": n, "rows": m, "bytes_read": bytes_read, "master_bytes": os.path.getsize(master_path)}
+    for writer in writers:
+        counts["updated_rows"] = run_writer(case_dir, master_path, writer, records, phases)
+
+    # Every generated file has to end up the way the manifest says
+    outcomes = {}
+    for record, entry in zip(records, manifest):
+        outcome = record['reason'] if record['status'] != 'ok' else 'ok'
+        if outcome == 'ok' and record['nip'] not in nips:
+            outcome = 'Missing/invalid NIP'
+        assert outcome == entry['expected'], f"{entry['file']}: {outcome} instead of {entry['expected']}"
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    counts["outcomes"] = outcomes
+
+    processed = os.path.join(case_dir, "Processed")
+    invalid = os.path.join(case_dir, "Invalid_files")
+    os.makedirs(os.path.join(processed, "Processed_msg"), exist_ok=True)
+    os.makedirs(invalid, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with timed(phases, "file_moves"):
+        for record, entry in zip(records, manifest):
+            ok = entry['expected'] == 'ok'
+            shutil.move(os.path.join(to_process, record['file']), os.path.join(processed if ok else invalid, record['file']))
+            msg = os.path.splitext(record['file'])[0] + ".msg"
+            if os.path.exists(os.path.join(to_process, msg)):
+                shutil.move(os.path.join(to_process, msg),
+                            os.path.join(os.path.join(processed, "Processed_msg") if ok else invalid, msg))
+    with timed(phases, "invalid_log"):
+        invalid_log = InvalidLog(os.path.join(case_dir, "invalid_log.db"), os.path.join(invalid, "0.Invalid.xlsx"))
+        for record, entry in zip(records, manifest):
+            if entry['expected'] != 'ok':
+                invalid_log.add(record['supplier_name'], entry['expected'], record['nip'], "Excel update", timestamp)
+        invalid_log.export_xlsx()
+        invalid_log.close()
+
+    if not args.keep:
+        shutil.rmtree(case_dir)
+    return {"files": n, "rows": m, "generate_seconds": round(generate_seconds, 4),
+            "phases": {phase: round(seconds, 6) for phase, seconds in phases.items()},
+            "per_file_ms": {phase: round(seconds * 1000 / n, 3) for phase, seconds in phases.items()},
+            "counts": counts}
+
+# Phases slower than the baseline by more than tolerance (and by at least min_seconds - short phases are noisy)
+def regressions(results, baseline, tolerance, min_seconds):
+    previous = {(case['files'], case['rows']): case['phases'] for case in baseline['cases']}
+    slower = []
+    for case in results['cases']:
+        old_phases = previous.get((case['files'], case['rows']), {})
+        for phase, seconds in case['phases'].items():
+            old = old_phases.get(phase)
+            if old and seconds > old * (1 + tolerance) and seconds - old >= min_seconds:
+                slower.append(f"N={case['files']} M={case['rows']} {phase}: {old:.3f}s -> {seconds:.3f}s")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="Times every phase of both scripts on synthetic data.")
+    parser.add_argument("--files", default="20,100", help="comma separated numbers of supplier files (N)")
+    parser.add_argument("--rows", default="300,1000", help="comma separated numbers of master rows (M)")
+    parser.add_argument("--writers", default="patch,openpyxl", help="master writers to time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-x-rate", type=float, default=0.05)
+    parser.add_argument("--empty-category-rate", type=float, default=0.05)
+    parser.add_argument("--bad-nip-rate", type=float, default=0.05)
+    parser.add_argument("--msg-bytes", type=int, default=50_000)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/pipeline_<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="ignore smaller differences")
+    parser.add_argument("--workdir", help="folder for the generated files (default: a temporary folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+    sizes = [(int(n), int(m)) for n in args.files.split(",") for m in args.rows.split(",")]
+    writers = [writer.strip() for writer in args.writers.split(",") if writer.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "packages": {"openpyxl": openpyxl.__version__, "numpy": numpy.__version__, "pandas": pandas.__version__},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "workdir", "keep")},
+        "cases": [],
+    }
+    try:
+        for n, m in sizes:
+            case = run_case(workdir, n, m, writers, args)
+            results["cases"].append(case)
+            print(f"N={n:<6} M={m:<6} " + "  ".join(f"{phase} {seconds:.3f}s" for phase, seconds in case["phases"].items()))
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS, f"pipeline_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            slower = regressions(results, json.load(f), args.tolerance, args.min_seconds)
+        for line in slower:
+            print(f"SLOWER {line}")
+        if slower:
+            sys.exit(1)
+        print("No phase slower than the baseline.")
+
+if __name__ == "__main__":
+    main()
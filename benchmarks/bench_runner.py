@@ -0,0 +1,165 @@
+# Scripts 2 + 3 run one after the other (two processes, prompts answered on stdin) against run_pipeline.py
+# (one process, no prompts), on a folder of synthetic .eml messages read through "mailbox_directory":
+#   cold start - an empty mailbox, so only the start-up and the fixed costs of each flow are left,
+#   end to end - N messages with a supplier file each, from the first message read to the master file saved.
+# Both flows start from the same Data folder and have to end with the same folders and master file.
+# Script 3 tries to open the master file when it's done - run this where that does nothing (e.g. Linux).
+# Run from the repository root: python benchmarks/bench_runner.py --messages 20,100 --rows 300
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from synthetic_data import make_nips, generate_master, generate_suppliers
+from pipeline.xlsx_probe import read_columns
+
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+SHEETS = ('DATA', 'offer', 'Supplier DATA', 'categories')
+XLSX_TYPE = ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+
+# One message per generated supplier file, a minute apart (newest first)
+def write_mailbox(folder, attachments, manifest):
+    os.makedirs(folder, exist_ok=True)
+    now = datetime.now().astimezone()
+    for i, entry in enumerate(manifest):
+        message = EmailMessage()
+        message["From"] = f"Supplier {i + 1} <supplier{i + 1}@example.com>"
+        message["Subject"] = f"Offer {i + 1}"
+        message["Date"] = format_datetime(now - timedelta(minutes=i + 1))
+        message.set_content("Please find the filled form attached.")
+        with open(os.path.join(attachments, entry['file']), "rb") as f:
+            message.add_attachment(f.read(), maintype=XLSX_TYPE[0], subtype=XLSX_TYPE[1], filename=entry['file'])
+        with open(os.path.join(folder, f"{i + 1:05d}.eml"), "wb") as f:
+            f.write(bytes(message))
+
+# Data folder (master file) and mailbox shared by both flows
+def build_case(case_dir, n, m, args):
+    nips = make_nips(random.Random(args.seed), m)
+    os.makedirs(os.path.join(case_dir, "Data"), exist_ok=True)
+    generate_master(os.path.join(case_dir, "Data", "Supplier Database.xlsm"), nips, args.seed)
+    attachments = os.path.join(case_dir, "attachments")
+    manifest = generate_suppliers(attachments, n, nips, args.seed, args.no_x_rate, args.empty_category_rate,
+                                  args.bad_nip_rate, 0, SHEETS)
+    write_mailbox(os.path.join(case_dir, "mail"), attachments, manifest)
+
+# A copy of the code and the Data folder, with config.json pointing at them
+def prepare_flow(case_dir, flow, args):
+    flow_dir = os.path.join(case_dir, flow)
+    shutil.copytree(os.path.join(case_dir, "Data"), os.path.join(flow_dir, "Data"))
+    code = os.path.join(flow_dir, "code")
+    os.makedirs(code)
+    for script in glob.glob(os.path.join(ROOT, "*.py")):
+        shutil.copy(script, code)
+    shutil.copytree(os.path.join(ROOT, "pipeline"), os.path.join(code, "pipeline"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    config = {
+        "processing_location": os.path.join(flow_dir, "Data"),
+        "supplier_file_location": os.path.join(flow_dir, "Data", "Supplier Database.xlsm"),
+        "mailbox_directory": os.path.join(case_dir, "mail"),
+        "master_writer": args.writer,
+    }
+    with open(os.path.join(code, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return flow_dir
+
+def run(code, command, answers=""):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-W", "ignore"] + command, cwd=code, input=answers, text=True,
+                            capture_output=True, encoding="utf-8")
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{command[0]} failed:\n{result.stdout}\n{result.stderr}")
+    return seconds
+
+# What a flow left behind: the files in the folders and the filled columns of the master file
+def outcome(flow_dir):
+    data = os.path.join(flow_dir, "Data")
+    files = sorted(os.path.relpath(os.path.join(path, name), data)
+                   for folder in ("To_process", "Processed", "Invalid_files")
+                   for path, _, names in os.walk(os.path.join(data, folder)) for name in names if name != "0.Invalid.xlsx")
+    master = os.path.join(data, "Supplier Database.xlsm")
+    columns = {"data1": read_columns(master, "data1", range(25, 806), min_row=3),
+               "data2": read_columns(master, "data2", range(1, 27), min_row=3)}
+    return json.loads(json.dumps({"files": files, "master": columns}, default=str))
+
+def run_case(workdir, n, m, args):
+    case_dir = os.path.join(workdir, f"n{n}_m{m}")
+    build_case(case_dir, n, m, args)
+    timings = {}
+
+    flow_dir = prepare_flow(case_dir, "scripts", args)
+    code = os.path.join(flow_dir, "code")
+    download = run(code, ["2. Downloading_from_Outlook.py"], "24\ny\n")
+    process = run(code, ["3. Processing_Excel_files.py"], "\n\n")
+    timings["scripts"] = {"download": round(download, 4), "process": round(process, 4), "total": round(download + process, 4)}
+    before = outcome(flow_dir)
+
+    flow_dir = prepare_flow(case_dir, "runner", args)
+    total = run(os.path.join(flow_dir, "code"), ["run_pipeline.py", "--hours", "24"])
+    with open(os.path.join(flow_dir, "Data", "metrics.jsonl"), encoding="utf-8") as f:
+        summary = [json.loads(line) for line in f if '"type": "run"' in line][-1]
+    timings["runner"] = {"total": round(total, 4), "startup": round(summary["phases"].get("startup", 0.0), 4),
+                         "handed_over": summary["counters"].get("handed_over", 0)}
+    after = outcome(flow_dir)
+
+    if not args.keep:
+        shutil.rmtree(case_dir)
+    return {"messages": n, "rows": m, "seconds": timings, "same_result": before == after}
+
+def main():
+    parser = argparse.ArgumentParser(description="Times scripts 2 + 3 against the single-process pipeline runner.")
+    parser.add_argument("--messages", default="0,20,100", help="comma separated numbers of messages (0 - cold start)")
+    parser.add_argument("--rows", default="300", help="comma separated numbers of master rows")
+    parser.add_argument("--writer", default="patch", help="master writer of both flows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-x-rate", type=float, default=0.05)
+    parser.add_argument("--empty-category-rate", type=float, default=0.05)
+    parser.add_argument("--bad-nip-rate", type=float, default=0.05)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/runner_<time>.json)")
+    parser.add_argument("--workdir", help="folder for the generated files (default: a temporary folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files")
+    args = parser.parse_args()
+
+    sizes = [(int(n), int(m)) for n in args.messages.split(",") for m in args.rows.split(",")]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_runner_")
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "workdir", "keep")},
+        "cases": [],
+    }
+    try:
+        for n, m in sizes:
+            case = run_case(workdir, n, m, args)
+            results["cases"].append(case)
+            scripts, runner = case["seconds"]["scripts"], case["seconds"]["runner"]
+            print(f"N={n:<6} M={m:<6} scripts {scripts['total']:.3f}s (download {scripts['download']:.3f}s, "
+                  f"process {scripts['process']:.3f}s)  runner {runner['total']:.3f}s (start-up {runner['startup']:.3f}s)"
+                  f"  same result: {case['same_result']}")
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS, f"runner_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results: {output}")
+    if not all(case["same_result"] for case in results["cases"]):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
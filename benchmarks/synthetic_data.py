@@ -0,0 +1,233 @@
+# Synthetic test data for the benchmarks: supplier workbooks like the ones sent back by suppliers
+# ("DATA" sheet with C1:C21, "offer" sheet with 190 categories and D/F/H "x" columns) with chosen rates of
+# the errors script 3 looks for, and master files with M supplier rows built from the sample master
+# (every data row is a copy of its first data row, so rows have the real styles and size; macros, tables,
+# data validations are kept).
+# Run from the repository root: python benchmarks/synthetic_data.py <output folder> --files 100 --rows 2000
+import os
+import re
+import sys
+import json
+import random
+import zipfile
+import argparse
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from pipeline.xlsx_probe import sheet_parts
+from pipeline.offer_engine import SERVICE_COLUMNS, MAX_CATEGORIES
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "Sample Supplier Database.xlsm")
+
+# Master columns filled for every generated row: {sheet: (name column, NIP column)}; data1 column 805 is left empty
+MASTER_CELLS = {'data1': ('B', 'F'), 'data2': ('A', 'H')}
+FIRST_ROW = 3
+
+# Expected outcome of script 3 for every kind of generated file
+OUTCOMES = {'ok': 'ok', 'no_x': 'no x', 'empty_category': 'empty category', 'bad_nip': 'Missing/invalid NIP'}
+
+_ROW = re.compile(rb'<row(?=[\s/>])[^>]*?(?:/>|>.*?</row>)', re.S)
+_ROW_NUMBER = re.compile(rb'\sr="(\d+)"')
+_DIMENSION = re.compile(rb'(<dimension ref="[A-Z]+\d+:[A-Z]+)\d+(")')
+_RANGE_REF = re.compile(rb'(\sref="[A-Z]+\d+:[A-Z]+)\d+(")')
+_CALC_CHAIN_TYPE = b'application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml'
+
+
+# NIPs are written the way suppliers write them ("PL 123-456-78-90", "1234567890"...), so clean_nip has work to do
+def format_nip(rng, digits):
+    style = rng.random()
+    if style < 0.5:
+        return digits
+    if style < 0.7:
+        return f"PL{digits}"
+    if style < 0.9:
+        return f"{digits[:3]}-{digits[3:6]}-{digits[6:8]}-{digits[8:]}"
+    return f"{digits[:3]} {digits[3:6]} {digits[6:]}"
+
+def make_nips(rng, count):
+    nips = set()
+    while len(nips) < count:
+        nips.add(str(rng.randrange(10 ** 9, 10 ** 10)))
+    return sorted(nips)
+
+
+# offer sheet rows: 2 header rows + 190 categories, kind decides about the errors
+def make_offer_rows(rng, kind, x_rate=0.05, dash_rate=0.05):
+    rows = [["LP", "Category", "Service type A", "Offer", "Service type B", "Offer", "Service type C", "Offer"],
+            ["Info", "Info", "Info", 'Please enter "x"', "Info", 'Please enter "x"', "Info", 'Please enter "x"']]
+    dashes = []
+    for n in range(MAX_CATEGORIES):
+        row = [n + 1, f"Category{n + 1}"]
+        for i, _ in enumerate(SERVICE_COLUMNS):
+            dash = rng.random() < dash_rate
+            row.append("-" if dash else f"Service {n * 3 + i + 1}")
+            row.append("x" if kind != 'no_x' and not dash and rng.random() < x_rate else None)
+            if dash:
+                dashes.append((n + 2, 2 + i * 2 + 1))
+        rows.append(row)
+    if kind == 'no_x':
+        return rows
+    if kind == 'empty_category':
+        if not dashes:
+            rows[2][2] = "-"
+            dashes.append((2, 3))
+        row, col = rng.choice(dashes)
+        rows[row][col] = "x"
+    elif not any(row[col] for row in rows[2:] for _, col in SERVICE_COLUMNS):
+        row = rng.choice(rows[2:])
+        row[2], row[3] = f"Service {row[0] * 3 - 2}", "x" # a correct file has at least one "x"
+    return rows
+
+# sheet_names - (DATA sheet, offer sheet); more pairs of names write the same two sheets again
+# (e.g. "Supplier DATA"/"categories" - the names script 2 looks for - so the file gets through both scripts)
+def write_supplier_workbook(path, rng, name, nip, kind='ok', sheet_names=('DATA', 'offer')):
+    data_rows = []
+    for i in range(1, 22):
+        if i == 1:
+            data_rows.append(["Name of the supplier", None, name])
+        elif i == 7:
+            data_rows.append(["NIP (Company ID)", None, nip])
+        else:
+            data_rows.append([f"Info{i}", None, f"{name} info {i}"])
+    offer_rows = make_offer_rows(rng, kind)
+    wb = Workbook(write_only=True)
+    for i, sheet_name in enumerate(sheet_names):
+        ws = wb.create_sheet(sheet_name)
+        for row in data_rows if i % 2 == 0 else offer_rows:
+            ws.append(row)
+    wb.save(path)
+
+
+# Writes n supplier files (and a .msg file of msg_bytes next to each, like script 2 does) into folder.
+# nips - NIPs that exist in the master; "bad_nip" files get a NIP that is not there.
+# Returns the manifest: one {"file", "nip", "kind", "expected"} per file.
+def generate_suppliers(folder, n, nips, seed=0, no_x_rate=0.05, empty_category_rate=0.05, bad_nip_rate=0.05,
+                       msg_bytes=0, sheet_names=('DATA', 'offer')):
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    known = set(nips)
+    manifest = []
+    for i in range(n):
+        roll = rng.random()
+        if roll < no_x_rate:
+            kind = 'no_x'
+        elif roll < no_x_rate + empty_category_rate:
+            kind = 'empty_category'
+        elif roll < no_x_rate + empty_category_rate + bad_nip_rate:
+            kind = 'bad_nip'
+        else:
+            kind = 'ok'
+        digits = nips[i % len(nips)]
+        while kind == 'bad_nip' and digits in known:
+            digits = str(rng.randrange(10 ** 9, 10 ** 10))
+        name = f"Supplier{i + 1:05d}_cat_{kind}"
+        file = f"{name}.xlsx"
+        write_supplier_workbook(os.path.join(folder, file), rng, name, format_nip(rng, digits), kind, sheet_names)
+        if msg_bytes:
+            with open(os.path.join(folder, f"{name}.msg"), "wb") as f:
+                f.write(rng.getrandbits(8 * msg_bytes).to_bytes(msg_bytes, "little"))  # rng.randbytes() needs Python 3.9
+        manifest.append({"file": file, "nip": digits, "kind": kind, "expected": OUTCOMES[kind]})
+    return manifest
+
+
+def _cell(ref, style, value):
+    s = f' s="{style.decode()}"' if style else ''
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t>{escape(value)}</t></is></c>'.encode()
+
+# Copies the template row to row number `row`, with new values in the given {column letter: text} cells
+def _clone_row(template, template_row, row, values):
+    old = str(template_row).encode()
+    new = str(row).encode()
+    xml = re.sub(rb'(\sr="[A-Z]*)' + old + rb'"', lambda m: m.group(1) + new + b'"', template)
+    for col, value in values.items():
+        ref = f"{col}{row}".encode()
+        cell = re.compile(rb'<c r="' + ref + rb'"(?:\s[^>]*?)?(?:/>|>.*?</c>)', re.S)
+        match = cell.search(xml)
+        style = re.search(rb'\ss="(\d+)"', match.group(0)[:match.group(0).find(b'>') + 1]) if match else None
+        text = b'' if value is None else _cell(ref.decode(), style.group(1) if style else None, value)
+        if match:
+            xml = xml[:match.start()] + text + xml[match.end():]
+        elif text:
+            xml = xml.replace(b'</row>', text + b'</row>') # only right for columns after the last cell of the template row
+    return xml
+
+# Writes a master file with one row per NIP in data1/data2 (rows from FIRST_ROW), everything else from the template.
+# Rows below the header of data1/data2 are replaced, so formulas there are gone and calcChain is dropped.
+def generate_master(path, nips, seed=0, template=TEMPLATE):
+    rng = random.Random(seed)
+    last_row = FIRST_ROW + len(nips) - 1
+    with zipfile.ZipFile(template) as src:
+        parts = sheet_parts(src)
+        sheets = {parts[sheet]: sheet for sheet in MASTER_CELLS}
+        # The data1 table has to cover the new rows
+        tables = set()
+        folder, name = os.path.split(parts['data1'])
+        rels = f"{folder}/_rels/{name}.rels"
+        if rels in src.namelist():
+            for target in re.findall(rb'Target="([^"]*tables/[^"]+)"', src.read(rels)):
+                tables.add(os.path.normpath(os.path.join(folder, target.decode())).replace(os.sep, '/'))
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as dst:
+            for info in src.infolist():
+                data = src.read(info)
+                if info.filename == "xl/calcChain.xml":
+                    continue
+                if info.filename == "[Content_Types].xml":
+                    data = re.sub(rb'<Override[^>]*?' + re.escape(_CALC_CHAIN_TYPE) + rb'[^>]*?/>', b'', data)
+                elif info.filename == "xl/_rels/workbook.xml.rels":
+                    data = re.sub(rb'<Relationship[^>]*?Target="(?:/xl/)?calcChain\.xml"[^>]*?/>', b'', data)
+                elif info.filename in tables:
+                    data = _RANGE_REF.sub(lambda m: m.group(1) + str(last_row).encode() + m.group(2), data)
+                elif info.filename in sheets:
+                    with dst.open(info.filename, "w", force_zip64=True) as writer:
+                        _write_sheet(writer, data, sheets[info.filename], nips, rng, last_row)
+                    continue
+                dst.writestr(info.filename, data)
+    return [FIRST_ROW + i for i in range(len(nips))]
+
+def _write_sheet(writer, data, sheet, nips, rng, last_row):
+    start = data.find(b'<sheetData')
+    end = data.find(b'</sheetData>')
+    head = _DIMENSION.sub(lambda m: m.group(1) + str(last_row).encode() + m.group(2), data[:start])
+    rows = _ROW.findall(data, start, end)
+    numbers = [int(_ROW_NUMBER.search(row[:row.find(b'>')]).group(1)) for row in rows]
+    template_row = rows[numbers.index(FIRST_ROW)]
+
+    writer.write(head + data[start:data.find(b'>', start) + 1])
+    for row, number in zip(rows, numbers):
+        if number < FIRST_ROW:
+            writer.write(row)
+    name_col, nip_col = MASTER_CELLS[sheet]
+    extra = {get_column_letter(805): None} if sheet == 'data1' else {}
+    for i, digits in enumerate(nips):
+        row = FIRST_ROW + i
+        values = {name_col: f"Supplier{i + 1:05d}", nip_col: format_nip(rng, digits), **extra}
+        writer.write(_clone_row(template_row, FIRST_ROW, row, values))
+    writer.write(data[end:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates supplier files and a master file for benchmarks.")
+    parser.add_argument("output", help="folder for the master file and the To_process folder")
+    parser.add_argument("--files", type=int, default=100, help="number of supplier files (N)")
+    parser.add_argument("--rows", type=int, default=1000, help="number of supplier rows in the master (M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-x-rate", type=float, default=0.05)
+    parser.add_argument("--empty-category-rate", type=float, default=0.05)
+    parser.add_argument("--bad-nip-rate", type=float, default=0.05)
+    parser.add_argument("--msg-bytes", type=int, default=0, help="size of the .msg file written next to each xlsx")
+    args = parser.parse_args()
+
+    nips = make_nips(random.Random(args.seed), args.rows)
+    os.makedirs(args.output, exist_ok=True)
+    generate_master(os.path.join(args.output, "Supplier Database.xlsm"), nips, args.seed)
+    manifest = generate_suppliers(os.path.join(args.output, "To_process"), args.files, nips, args.seed,
+                                  args.no_x_rate, args.empty_category_rate, args.bad_nip_rate, args.msg_bytes)
+    with open(os.path.join(args.output, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    print(f"{args.files} supplier files, {args.rows} master rows -> {args.output}")
+
+if __name__ == "__main__":
+    main()
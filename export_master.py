@@ -0,0 +1,78 @@
+import os #for creating file paths
+import sys #for checking if script is being used as exe and the exit code
+import json #for loading paths from config.json file
+import time #for measuring the length of the export
+import argparse #for the export options
+import warnings #for supressing warnings from openpyxl
+from datetime import datetime #for timestamps
+from pipeline.master_db import MasterDatabase, database_path #for the supplier rows kept by "master_writer": "sqlite"
+from pipeline.metrics import BufferedLog #for log.txt
+
+# Writes the supplier rows changed in "<master file>.db" ("master_writer": "sqlite" in config.json) into the master file.
+# Only the changed rows are rewritten, everything else in the file (macros, data validations...) is kept.
+# Meant to be scheduled (e.g. Task Scheduler) - if the master file is open in Excel, nothing is written and
+# the exit code is 1; the rows are written by the next export.
+#   python export_master.py           rows changed since the last export
+#   python export_master.py --all     every row the script ever wrote (e.g. after the master file was restored from a
+#                                     backup) - refused if the master file was changed since the last export, unless --force
+
+if getattr(sys, 'frozen', False):
+    base_path = os.path.dirname(sys.executable)  # Folder of the .exe
+else:
+    base_path = os.path.dirname(os.path.abspath(__file__))  # Folder of the .py
+
+CONFIG_FILE = os.path.join(base_path, "config.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes the supplier rows kept in the database into the master file.")
+    parser.add_argument("--all", action="store_true",
+                        help="write every row written by the script, not only the ones changed since the last export")
+    parser.add_argument("--force", action="store_true",
+                        help="with --all: write the rows even if the master file was changed since the last export")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    supplier_file = config.get("supplier_file_location")
+    run_log = BufferedLog(os.path.join(config.get("processing_location"), 'log.txt'))
+
+    def log_error(msg):
+        run_log.write(msg)
+        print(msg)
+
+    db_path = database_path(supplier_file)
+    if not os.path.exists(db_path):
+        print(f"❌ {db_path} not found - it's created by script 3 with \"master_writer\": \"sqlite\"")
+        return 1
+
+    start = time.perf_counter()
+    db = MasterDatabase(db_path, supplier_file)
+    try:
+        # Cells edited in Excel since the last export would be overwritten by the rows exported again
+        if args.all and not args.force and not db.master_exported():
+            log_error(f"❌ {datetime.now():%Y-%m-%d %H:%M:%S} {supplier_file} was changed since the last export - "
+                      f"--all would overwrite those changes in the rows written by the script (use --force to do it anyway)")
+            return 1
+        pending = db.pending_export(everything=args.all)
+        if not pending:
+            print("ℹ️ The master file is up to date.")
+            return 0
+
+        # The master file can't be open in Excel (see script 3)
+        try:
+            os.rename(supplier_file, supplier_file)
+        except OSError:
+            log_error(f"❌ {datetime.now():%Y-%m-%d %H:%M:%S} Master file is open - {pending} row(s) left for the next export")
+            return 1
+        rows = db.export(everything=args.all)
+        log_error(f"💾 {datetime.now():%Y-%m-%d %H:%M:%S} Exported {rows} row(s) to {supplier_file} "
+                  f"in {time.perf_counter() - start:.2f} sec")
+        return 0
+    finally:
+        db.close()
+        run_log.flush()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import os #for creating file paths
+import sys #for checking if script is being used as exe and the exit code
+import json #for loading paths from config.json file
+import time #for measuring the length of the split/merge
+import argparse #for the split/merge commands
+from pipeline.master_shards import ShardLayout, split_master, merge_shards #for the master file split into shards
+
+# Splits the master file into shards for "sharded_master": true in config.json, and puts it back together.
+#   python master_shards.py split --shards 8    writes "<master file> shards/*.shardNN.xlsm" (the master file is not changed)
+#   python master_shards.py merge               rebuilds the master file from the shards
+#   python master_shards.py merge --output x.xlsm   ...or writes it somewhere else
+
+if getattr(sys, 'frozen', False):
+    base_path = os.path.dirname(sys.executable)  # Folder of the .exe
+else:
+    base_path = os.path.dirname(os.path.abspath(__file__))  # Folder of the .py
+
+CONFIG_FILE = os.path.join(base_path, "config.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Splits the master file into shards or merges the shards back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split = commands.add_parser("split", help="split the master file into shards by the hash of the NIP")
+    split.add_argument("--shards", type=int, required=True, help="number of shards")
+    split.add_argument("--force", action="store_true", help="split again even if the shards already exist")
+    merge = commands.add_parser("merge", help="rebuild one master file from the shards")
+    merge.add_argument("--output", help="where to write the merged file (default: the master file)")
+    args = parser.parse_args()
+
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    supplier_file = config.get("supplier_file_location")
+    layout = ShardLayout(supplier_file)
+    start = time.perf_counter()
+
+    if args.command == "split":
+        if args.shards < 1:
+            parser.error("--shards has to be at least 1")
+        # Splitting again would drop what was written to the shards since the master file was merged
+        if layout.exists() and not args.force:
+            print(f"❌ {layout.layout_path} exists - merge the shards first and split with --force")
+            return 1
+        layout = split_master(supplier_file, args.shards)
+        print(f"✅ {len(layout)} shards written to {layout.folder}")
+    else:
+        if not layout.exists():
+            print(f"❌ {layout.layout_path} not found - the master file is not split")
+            return 1
+        target = args.output or supplier_file
+        # The master file can't be open in Excel (see script 3)
+        try:
+            if os.path.exists(target):
+                os.rename(target, target)
+        except OSError:
+            print(f"❌ Please close {target}.")
+            return 1
+        try:
+            merge_shards(layout.load(), target)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ {len(layout)} shards merged into {target}")
+    print(f"⏱️ Time taken: {time.perf_counter() - start:.2f} sec")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# Shared building blocks used by the numbered scripts in the repository root.
@@ -0,0 +1,346 @@
+import os #for creating file paths
+from datetime import datetime, timedelta #for choosing a time period for emails
+import shutil #for moving files
+import re #for regular expressions - cleaning NIP (Company ID)
+import time #for timing the screening in worker threads
+from collections import deque #for the messages waiting between the stages
+from concurrent.futures import ThreadPoolExecutor #for probing attachments while the next messages are saved
+from pipeline.mail_log import MailLog #for remembering messages already checked
+from pipeline.invalid_log import InvalidLog #for the invalid files journal shared with script 3
+from pipeline.mailbox import open_mailbox #for reading messages from Outlook (or a local stand-in folder)
+from pipeline.xlsx_probe import probe_workbook #for reading sheet names and C1/C7 straight from the xlsx zip
+from pipeline.verdict_cache import open_verdict_cache, file_digest, data_digest, SCREENING, RECORD #for the verdicts of attachments seen before
+from pipeline.supplier_file import parse_supplier_file, record_content, record_for_file #for parsing the files handed over to processing
+from pipeline.msg_archive import open_msg_archive, TO_PROCESS, INVALID #for the msg files kept in daily zip containers
+
+
+def unique_filename(folder, filename):
+    base, ext = os.path.splitext(filename)
+    counter = 1
+    unique = filename
+    while os.path.exists(os.path.join(folder, unique)):
+        unique = f"{base}_{counter}{ext}"
+        counter += 1
+    return unique
+
+
+# The download stage (script 2): reads the messages of the last hours from Outlook (or the "mailbox_directory"
+# stand-in), keeps the Excel attachments sent back by suppliers in "To_process" (with the msg file), and the ones
+# that came with other valid attachments in "Invalid_files".
+# hand_off - called with the path and the parsed record of every file moved to "To_process" (the pipeline runner
+# passes the records to the processing stage in memory); the file is parsed from the bytes already read for screening.
+class Download:
+    def __init__(self, config, metrics, hand_off=None):
+        self.config = config
+        self.metrics = metrics
+        self.hand_off = hand_off
+        base_folder = config.get("processing_location")
+        self.to_process = os.path.join(base_folder, 'To_process')
+        self.invalid_folder = os.path.join(base_folder, 'Invalid_files')
+        self.tmp_folder = os.path.join(base_folder, "tmp")
+        self.invalid_xlsx_path = os.path.join(self.invalid_folder, "0.Invalid.xlsx")
+        self.log_path = os.path.join(base_folder, "mail_log.xlsx")
+        self.log_db_path = os.path.join(base_folder, "mail_log.db")
+        self.invalid_db_path = os.path.join(base_folder, "invalid_log.db")
+        self.verdict_cache_path = os.path.join(base_folder, "verdict_cache.db")
+
+        # The messages go through three stages that overlap:
+        # - the main loop in run() saves the Excel attachments of each message to the tmp folder (the mailbox is only
+        #   used from this thread - Outlook objects belong to the thread that created them),
+        # - worker threads ("download_workers" in config.json, default 4) probe the saved files and decide how they are named,
+        # - finish_message() moves the files, saves the msg files and writes the logs, always in the order of the messages,
+        #   so unique_filename() gives the same names as when the messages were handled one by one.
+        # At most "download_queue_size" messages (default 16) wait between the stages, so the tmp folder stays small.
+        self.download_workers = max(1, int(config.get("download_workers", 4)))
+        self.download_queue_size = max(1, int(config.get("download_queue_size", 16)))
+
+        os.makedirs(self.to_process, exist_ok=True)
+        os.makedirs(self.invalid_folder, exist_ok=True)
+        os.makedirs(self.tmp_folder, exist_ok=True)
+
+    # 3. Checks if the mail is a message from supplier sending back the filled Excel form.
+    # If saved Excel contains two sheets - "DATA" and "offer" - script assumes it's a message from Supplier.
+    # Each saved attachment is probed once - sheet names plus C1 (company name) and C7 (NIP) are read
+    # straight from the zip, without loading the whole workbook.
+    # saved - (temp path, SHA-256, cached verdict or None, cached record or None, bytes or None) of every attachment;
+    # only the ones without a verdict are probed.
+    # Returns the files to keep as (temp path, file name before unique_filename, NIP, parsed record) and the new
+    # entries to cache. A record is only parsed for a file that goes to "To_process" if there is a hand_off.
+    def screen_message(self, msg, saved):
+        start = time.perf_counter()
+        valid_attachments = []
+        entries = []
+        for temp_path, digest, verdict, content, data in saved:
+            if verdict is None:
+                try:
+                    probe = probe_workbook(temp_path, 'Supplier DATA', ('C1', 'C7'))
+                    verdict = {'valid': 'Supplier DATA' in probe.sheetnames and 'categories' in probe.sheetnames,
+                               'values': probe.values}
+                    entries.append((digest, SCREENING, verdict))
+                except Exception:
+                    verdict = {'valid': False} # files that can't be read are not cached
+            if verdict['valid']:
+                valid_attachments.append((temp_path, verdict['values'], digest, content, data))
+                continue
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        files = []
+        # 4. If the message came with more attachments that meet the criteria - they go to "Invalid_files" folder,
+        # named after the name of the sender, with the NIP (Company ID) from cell C7.
+        if len(valid_attachments) > 1:
+            sender = msg.sender_name.strip() if msg.sender_name else "unknown"
+            for temp_path, cells, _, _, _ in valid_attachments:
+                nip = re.sub(r'\D', '', str(cells['C7'] or ""))
+                files.append((temp_path, f"{sender}_multiple{os.path.splitext(temp_path)[1]}", nip, None))
+        # 5. Valid messages are saved with a name of the Company from cell C1 in Supplier DATA sheet in the Excel attachment.
+        elif valid_attachments:
+            temp_path, cells, digest, content, data = valid_attachments[0]
+            name = str(cells['C1'] or "no_name").strip()
+            nip = re.sub(r'\D', '', str(cells['C7'] or ""))
+            msg_date = msg.received.strftime("%d-%m-%Y")
+            if self.hand_off and content is None:
+                content = record_content(parse_supplier_file(temp_path, data))
+                entries.append((digest, RECORD, content))
+            files.append((temp_path, f"{name}_cat_{msg_date}{os.path.splitext(temp_path)[1]}", nip, content))
+        return msg, files, time.perf_counter() - start, entries
+
+    # Saves the msg file into the archive (through the tmp folder) - returns its name in the archive
+    def archive_message(self, msg, filename, file, nip, status):
+        temp_path = os.path.join(self.tmp_folder, f"tmp_msg_{filename}")
+        try:
+            self.mailbox.save_message(msg.id, temp_path)
+            return self.msg_archive.add(temp_path, filename, file, nip, status)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def finish_message(self, screened):
+        msg, files, seconds, entries = screened
+        metrics = self.metrics
+        metrics.add_time('screening', seconds)
+        if self.verdict_cache:
+            for digest, kind, value in entries:
+                if digest:
+                    self.verdict_cache.put(digest, kind, value)
+        time_str = msg.received.strftime("%Y-%m-%d %H:%M:%S")
+
+        if not files:
+            self.mail_log.add(msg.sender_email, msg.subject, time_str)
+            return
+
+        self.total_msgs += 1
+
+        # 4a. Attachments of a message with more than one valid attachment are moved to "Invalid_files" folder
+        if len(files) > 1:
+            try:
+                sender = msg.sender_name.strip() if msg.sender_name else "unknown"
+                base_name = f"{sender}_multiple"
+
+                # 4c. The msg file is saved together with the Excel attachments - into the archive before them,
+                # so the attachments archived with it point to it, otherwise to "Invalid_files" after them.
+                msg_name = None
+                if self.msg_archive:
+                    with metrics.phase('message_save'):
+                        msg_name = self.archive_message(msg, f"{base_name}.msg", None, files[0][2], INVALID)
+
+                for file, name, nip, _ in files:
+                    try:
+                        if self.msg_archive:
+                            with metrics.phase('file_moves'):
+                                new_name = self.msg_archive.add(file, name, None, nip, INVALID, msg_name)
+                                os.remove(file)
+                            print(f"⚠️ Archived as invalid: {new_name}")
+                        else:
+                            new_name = unique_filename(self.invalid_folder, name)
+                            with metrics.phase('file_moves'):
+                                shutil.move(file, os.path.join(self.invalid_folder, new_name))
+                            metrics.add('files_moved')
+                            print(f"⚠️ Moved to Invalid_files: {new_name}")
+
+                        # 4b. Invalid messages' data is saved in the "0.Invalid.xlsx" log shared between the scripts.
+                        with metrics.phase('invalid_log'):
+                            self.invalid_log.add(os.path.splitext(new_name)[0], "More than one attachment", nip, "Outlook",
+                                                 self.execution_time)
+                    except Exception as e:
+                        print(f"❌ Error with attachment: {e}")
+                        if os.path.exists(file):
+                            os.remove(file)
+
+                if not self.msg_archive:
+                    msg_name = unique_filename(self.invalid_folder, f"{base_name}.msg")
+                    with metrics.phase('message_save'):
+                        self.mailbox.save_message(msg.id, os.path.join(self.invalid_folder, msg_name))
+                print(f"📬 Saved message as: {msg_name}")
+                self.invalid_msgs += 1
+
+            except Exception as e:
+                print(f"❌ General error handling multiple attachments: {e}")
+
+        else:
+            valid, name, nip, content = files[0]
+            try:
+                final_name = unique_filename(self.to_process, name)
+
+                # 5a. The attachment is moved to the "To_process" folder for another script to work with it.
+                with metrics.phase('file_moves'):
+                    shutil.move(valid, os.path.join(self.to_process, final_name))
+                metrics.add('files_moved')
+                print(f"✅ Moved to To_process: {final_name}")
+
+                # 5b. The msg file is saved together with the attachment (or into the archive, noted as waiting
+                # for that attachment - script 3 only changes its status when the attachment is processed).
+                if self.msg_archive:
+                    with metrics.phase('message_save'):
+                        msg_name = self.archive_message(msg, os.path.splitext(final_name)[0] + ".msg", final_name, nip,
+                                                        TO_PROCESS)
+                else:
+                    msg_name = unique_filename(self.to_process, os.path.splitext(final_name)[0] + ".msg")
+                    with metrics.phase('message_save'):
+                        self.mailbox.save_message(msg.id, os.path.join(self.to_process, msg_name))
+                print(f"📬 Saved message as: {msg_name}")
+
+                # 5c. The parsed file goes straight to the processing stage (pipeline runner only)
+                if self.hand_off:
+                    final_path = os.path.join(self.to_process, final_name)
+                    self.hand_off(final_path, record_for_file(content, final_path))
+            except Exception as e:
+                print(f"❌ Error processing valid file: {e}")
+                if os.path.exists(valid):
+                    os.remove(valid)
+
+        self.mail_log.add(msg.sender_email, msg.subject, time_str)
+
+    # Saves the Excel attachments of one message to the tmp folder (under names unique to the message) and looks up
+    # their verdicts. With a hand_off the bytes are kept in memory for parsing.
+    def save_attachments(self, seq, msg):
+        metrics = self.metrics
+        # Attachments are only listed for messages that have any and were not skipped.
+        with metrics.phase('attachment_list'):
+            attachments = self.mailbox.attachment_names(msg.id) if msg.has_attachments else []
+        saved = []
+        for index, filename in enumerate(attachments):
+            if filename.endswith(('.xlsx', '.xlsm')):
+                temp_path = os.path.join(self.tmp_folder, f"tmp_{seq}_{index}_{filename}")
+                try:
+                    with metrics.phase('attachment_save'):
+                        self.mailbox.save_attachment(msg.id, index, temp_path)
+                    metrics.add('bytes_read', os.path.getsize(temp_path))
+                    digest = verdict = content = data = None
+                    if self.hand_off:
+                        with open(temp_path, "rb") as f:
+                            data = f.read()
+                    if self.verdict_cache:
+                        with metrics.phase('cache_lookup'):
+                            digest = data_digest(data) if data is not None else file_digest(temp_path)
+                            verdict = self.verdict_cache.get(digest, SCREENING)
+                            if verdict is not None and self.hand_off:
+                                content = self.verdict_cache.get(digest, RECORD)
+                        if verdict is not None:
+                            metrics.add('cache_hits')
+                    saved.append((temp_path, digest, verdict, content, data))
+                except Exception:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+        return saved
+
+    # Checks the messages of the last `hours` and returns the summary of the run.
+    # hours None - only the messages received since the watermark of the mailbox (the newest message checked by
+    # an earlier run, kept in "mail_log.db"), with an overlap of "mail_sync_overlap_minutes" (config.json, default 60)
+    # for mail that shows up late. Messages of the overlap are skipped if they are in the mail_log, whatever skip_logged
+    # is. The first run of a mailbox checks the last "mail_first_sync_hours" (default 24).
+    def run(self, hours=None, skip_logged=True):
+        self.execution_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.total_msgs = 0
+        self.invalid_msgs = 0
+        metrics = self.metrics
+
+        # The log is kept in "mail_log.db" and checked in memory - "mail_log.xlsx" is imported the first time
+        # and the new messages are appended to it once at the end of the run, instead of re-writing it for every message.
+        self.mail_log = MailLog(self.log_db_path, self.log_path)
+
+        # Invalid files are appended to "invalid_log.db" (shared with script 3) and "0.Invalid.xlsx" is regenerated once at the end
+        self.invalid_log = InvalidLog(self.invalid_db_path, self.invalid_xlsx_path)
+
+        # Verdicts of attachments already probed are kept in "verdict_cache.db" (shared with script 3) by the SHA-256
+        # of the file - the same attachment sent again is not opened. Size in MB set by "verdict_cache_mb" (0 - off).
+        # The cache is only used from the main thread (lookups when an attachment is saved, new verdicts in finish_message).
+        self.verdict_cache = open_verdict_cache(self.config, self.verdict_cache_path)
+
+        # With "msg_archive": true the msg files (and the attachments of messages with more than one valid attachment)
+        # are written once into "Archive/<day>.zip" instead of "To_process"/"Invalid_files" - see pipeline/msg_archive.py
+        self.msg_archive = open_msg_archive(self.config)
+
+        # Connects to Outlook and reads sender, subject and time of all the Inbox messages from the chosen period in one table.
+        # If "mailbox_directory" is set in config.json, messages are read from that folder of .eml/.msg files instead.
+        self.mailbox = open_mailbox(self.config)
+        stored = self.mail_log.watermark(self.mailbox.source)
+        watermark = stored if hours is None else None
+        if hours is not None:
+            time_limit = datetime.now() - timedelta(hours=hours)
+        elif watermark:
+            time_limit = watermark[0] - timedelta(minutes=float(self.config.get("mail_sync_overlap_minutes", 60)))
+        else:
+            time_limit = datetime.now() - timedelta(hours=float(self.config.get("mail_first_sync_hours", 24)))
+        with metrics.phase('fetch'):
+            messages = self.mailbox.fetch(time_limit)
+
+        # Main loop:
+        # 1. Only messages from the chosen time period are in the table (newest first)
+        queued = set()  # messages waiting for finish_message (not in the mail_log yet)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+            for seq, msg in enumerate(messages.itertuples(index=False)):
+                key = (msg.sender_email, msg.subject, msg.received.strftime("%Y-%m-%d %H:%M:%S"))
+
+                # 2. Checks if the message is already in the mail_log (if user chose it to, and always for the messages
+                # up to the watermark - only the ones that arrived late are left of them)
+                synced = watermark is not None and msg.received <= watermark[0]
+                if synced and msg.id == watermark[1]:
+                    continue
+                if (skip_logged or synced) and (self.mail_log.is_logged(*key) or key in queued):
+                    continue
+                queued.add(key)
+
+                pending.append(executor.submit(self.screen_message, msg, self.save_attachments(seq, msg)))
+
+                # Finished messages are handled in order - the loop waits for the oldest one when the queue is full
+                while pending and (len(pending) >= self.download_queue_size or pending[0].done()):
+                    with metrics.phase('queue_wait'):
+                        screened = pending.popleft().result()
+                    self.finish_message(screened)
+
+            while pending:
+                with metrics.phase('queue_wait'):
+                    screened = pending.popleft().result()
+                self.finish_message(screened)
+
+        # Saves the checked messages in one go and appends them to "mail_log.xlsx" (kept in "mail_log.db" if it can't
+        # be written, e.g. while it's open in Excel - the next run appends them)
+        self.mail_log.flush()
+        try:
+            self.mail_log.update_xlsx()
+        except Exception as e:
+            print(f"❌ Error saving {self.log_path} (messages are kept in {self.log_db_path}): {e}")
+        # The newest message checked is the watermark of the next run (saved after the checked messages) - not after
+        # a run over the last hours that started after the watermark, the messages in between were never checked
+        if len(messages) and (hours is None or (stored is not None and time_limit <= stored[0])):
+            newest = messages.iloc[0]
+            self.mail_log.set_watermark(self.mailbox.source, newest["received"].to_pydatetime(), newest["id"])
+        self.mail_log.close()
+
+        if self.verdict_cache:
+            self.verdict_cache.close()
+        if self.msg_archive:
+            self.msg_archive.close()
+
+        # Refreshes "0.Invalid.xlsx" if any invalid files were added
+        if self.invalid_log.added:
+            try:
+                self.invalid_log.export_xlsx()
+            except Exception as e:
+                print(f"❌ Error saving {self.invalid_xlsx_path} (entries are kept in {self.invalid_db_path}): {e}")
+        self.invalid_log.close()
+
+        return {"messages": len(messages), "matching": self.total_msgs, "invalid": self.invalid_msgs,
+                "since": time_limit.strftime("%Y-%m-%d %H:%M:%S")}
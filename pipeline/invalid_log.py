@@ -0,0 +1,141 @@
+import os #for checking if the files exist
+import pickle #for the records of the rejected files (they are picklable - they come back from the worker processes)
+import sqlite3 #for the journal shared by both scripts
+import pandas as pd #for importing/exporting 0.Invalid.xlsx
+
+COLUMNS = ['File name', 'Message', 'NIP', 'Operation', 'Timestamp']
+
+def _text(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)) or value is pd.NaT:
+        return ""
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+# Journal of invalid files shared by the download and the processing script.
+# Every entry is appended to a SQLite file (one small transaction, safe when both scripts run at the same time);
+# the latest entry for each file name is kept in an indexed table, so "0.Invalid.xlsx" (one row per file name,
+# newest first) can be regenerated with export_xlsx() once per run instead of being rewritten for every entry.
+# An existing 0.Invalid.xlsx is imported when the journal is created. The last exported entry is kept too, so entries
+# added by a run that was interrupted before its export are exported by the next run.
+# Script 3 also keeps the parsed record of every file it rejects (payloads table, one per file), so the files
+# rejected only because their NIP was not in the master file can be rechecked without being parsed again.
+class InvalidLog:
+    def __init__(self, db_path, xlsx_path=None):
+        self.db_path = db_path
+        self.xlsx_path = xlsx_path
+        self.added = 0
+        is_new = not os.path.exists(db_path)
+
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, file_name TEXT NOT NULL, message TEXT, "
+                "nip TEXT, operation TEXT, timestamp TEXT)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS latest ("
+                "file_name TEXT PRIMARY KEY, message TEXT, nip TEXT, operation TEXT, timestamp TEXT, seq INTEGER)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS latest_timestamp ON latest (timestamp)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS exported (id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                "file TEXT PRIMARY KEY, nip TEXT, reason TEXT, record BLOB NOT NULL, timestamp TEXT)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS payloads_reason ON payloads (reason, nip)")
+        if is_new and xlsx_path and os.path.exists(xlsx_path):
+            self.import_xlsx(xlsx_path)
+            self.added = 0
+
+        # Journals from before the "exported" table are taken as exported
+        last = self.last_seq()
+        row = self.conn.execute("SELECT seq FROM exported").fetchone()
+        if row is None:
+            with self.conn:
+                self.conn.execute("INSERT INTO exported VALUES (0, ?)", (last,))
+        else:
+            self.added = last - row[0]
+
+    def last_seq(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+
+    def add(self, file_name, message, nip, operation, timestamp):
+        self.add_many([(file_name, message, nip, operation, timestamp)])
+
+    def add_many(self, entries):
+        rows = [tuple(_text(value) for value in entry) for entry in entries]
+        if not rows:
+            return
+        with self.conn:
+            for row in rows:
+                seq = self.conn.execute(
+                    "INSERT INTO journal (file_name, message, nip, operation, timestamp) VALUES (?, ?, ?, ?, ?)", row
+                ).lastrowid
+                # Only a newer (or equally new) entry replaces the one kept for the file name
+                self.conn.execute(
+                    "INSERT INTO latest VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(file_name) DO UPDATE SET "
+                    "message = excluded.message, nip = excluded.nip, operation = excluded.operation, "
+                    "timestamp = excluded.timestamp, seq = excluded.seq "
+                    "WHERE excluded.timestamp >= latest.timestamp", row + (seq,)
+                )
+        self.added += len(rows)
+
+    # Keeps the record of a rejected file (content - the record as parsed, see pipeline.supplier_file.record_content);
+    # a file rejected again replaces its earlier record
+    def add_payload(self, file, nip, reason, content, timestamp):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?, ?)",
+                              (file, _text(nip), reason, pickle.dumps(content), _text(timestamp)))
+
+    # {file: content} of the files rejected for reason
+    def payloads(self, reason):
+        return {file: pickle.loads(content) for file, content in
+                self.conn.execute("SELECT file, record FROM payloads WHERE reason = ? ORDER BY file", (reason,))}
+
+    def remove_payloads(self, files):
+        with self.conn:
+            self.conn.executemany("DELETE FROM payloads WHERE file = ?", [(file,) for file in files])
+
+    # Files that are not invalid any more: a "Resolved" entry is appended to the journal and the file name is removed
+    # from "latest" (so from the next export of 0.Invalid.xlsx), together with the record of the file.
+    # entries - (file, file name, nip, operation, timestamp)
+    def resolve(self, entries):
+        entries = list(entries)
+        if not entries:
+            return
+        with self.conn:
+            for file, file_name, nip, operation, timestamp in entries:
+                self.conn.execute(
+                    "INSERT INTO journal (file_name, message, nip, operation, timestamp) VALUES (?, 'Resolved', ?, ?, ?)",
+                    (_text(file_name), _text(nip), _text(operation), _text(timestamp))
+                )
+                self.conn.execute("DELETE FROM latest WHERE file_name = ?", (_text(file_name),))
+                self.conn.execute("DELETE FROM payloads WHERE file = ?", (file,))
+        self.added += len(entries)
+
+    def import_xlsx(self, xlsx_path):
+        df = pd.read_excel(xlsx_path)
+        if 'Source' in df.columns and 'Operation' not in df.columns:
+            df = df.rename(columns={'Source': 'Operation', 'Execution time': 'Timestamp'})
+        df = df.reindex(columns=COLUMNS).dropna(subset=['File name'])
+        # Oldest first, so the newest entry of each file name ends up in "latest"
+        df = df.assign(_ts=pd.to_datetime(df['Timestamp'], errors='coerce')).sort_values('_ts', kind='stable')
+        self.add_many(df[COLUMNS].itertuples(index=False, name=None))
+
+    # Regenerates the 0.Invalid.xlsx view: one row per file name (latest entry), newest first
+    def export_xlsx(self, xlsx_path=None):
+        last = self.last_seq()
+        rows = self.conn.execute(
+            "SELECT file_name, message, nip, operation, timestamp FROM latest ORDER BY timestamp DESC, seq DESC"
+        ).fetchall()
+        df = pd.DataFrame(rows, columns=COLUMNS)
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce')
+        df.to_excel(xlsx_path or self.xlsx_path, index=False)
+        with self.conn:
+            self.conn.execute("UPDATE exported SET seq = ? WHERE id = 0", (last,))
+        self.added = 0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,145 @@
+import os #for creating file paths
+import json #for the state of the last mail_log.xlsx export
+import sqlite3 #for the on-disk store behind the in-memory index
+from datetime import datetime #for the watermarks
+import pandas as pd #for importing/exporting mail_log.xlsx
+from pipeline.nip_index import file_key #for noticing a mail_log.xlsx changed since the last export
+from pipeline.xlsm_patch import WorkbookPatch #for appending the new keys to mail_log.xlsx
+
+COLUMNS = ["Email", "Subject", "Received"]
+
+# Turns any value read from mail_log.xlsx into the same text form the download script writes
+def _normalize(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+# Keeps every (email; subject; received) key of messages already checked by the script.
+# Lookups are done on an in-memory set, new keys are buffered and written to a SQLite file
+# in one transaction by flush(). The old mail_log.xlsx is imported the first time the store is created;
+# update_xlsx() appends the keys added since the last export to it and export_xlsx() regenerates it.
+# The newest message checked in each mailbox (received time and ID) is kept too - the watermark the next run
+# starts from instead of a number of hours (see pipeline.download.Download.run).
+class MailLog:
+    def __init__(self, db_path, xlsx_path=None):
+        self.db_path = db_path
+        self.xlsx_path = xlsx_path
+        self.pending = []
+        is_new = not os.path.exists(db_path)
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS mail_log ("
+            "email TEXT NOT NULL, subject TEXT NOT NULL, received TEXT NOT NULL, "
+            "UNIQUE (email, subject, received))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            "source TEXT PRIMARY KEY, received TEXT NOT NULL, msg_id TEXT, updated TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS xlsx_exports ("
+            "path TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL, rows INTEGER NOT NULL, file_key TEXT NOT NULL)"
+        )
+        if is_new and xlsx_path and os.path.exists(xlsx_path):
+            self.import_xlsx(xlsx_path)
+
+        self.keys = set(self.conn.execute("SELECT email, subject, received FROM mail_log"))
+
+    @staticmethod
+    def key(email, subject, received):
+        return (_normalize(email), _normalize(subject), _normalize(received))
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def is_logged(self, email, subject, received):
+        return self.key(email, subject, received) in self.keys
+
+    def add(self, email, subject, received):
+        key = self.key(email, subject, received)
+        if key not in self.keys:
+            self.keys.add(key)
+            self.pending.append(key)
+
+    # Writes all the keys added since the last flush in a single transaction
+    def flush(self):
+        if not self.pending:
+            return 0
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO mail_log VALUES (?, ?, ?)", self.pending)
+        written = len(self.pending)
+        self.pending = []
+        return written
+
+    # (received, message ID) of the newest message checked in the mailbox, None before its first run
+    def watermark(self, source):
+        row = self.conn.execute("SELECT received, msg_id FROM watermarks WHERE source = ?", (source,)).fetchone()
+        if row is None:
+            return None
+        return datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S"), row[1]
+
+    # Moves the watermark of the mailbox forward (never back - a run over an older period doesn't change it)
+    def set_watermark(self, source, received, msg_id):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO watermarks VALUES (?, ?, ?, ?) ON CONFLICT(source) DO UPDATE SET "
+                "received = excluded.received, msg_id = excluded.msg_id, updated = excluded.updated "
+                "WHERE excluded.received >= watermarks.received",
+                (source, received.strftime("%Y-%m-%d %H:%M:%S"), msg_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+
+    def import_xlsx(self, xlsx_path):
+        df = pd.read_excel(xlsx_path)
+        rows = [self.key(*values) for values in df.reindex(columns=COLUMNS).itertuples(index=False)]
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO mail_log VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    # Regenerates the human-readable mail_log.xlsx from the store (in the order the keys were added)
+    def export_xlsx(self, xlsx_path=None):
+        xlsx_path = xlsx_path or self.xlsx_path
+        self.flush()
+        rows = self.conn.execute("SELECT rowid, email, subject, received FROM mail_log ORDER BY rowid").fetchall()
+        pd.DataFrame([row[1:] for row in rows], columns=COLUMNS).to_excel(xlsx_path, index=False)
+        self._exported(xlsx_path, rows[-1][0] if rows else 0, len(rows))
+        return len(rows)
+
+    # Brings mail_log.xlsx up to date by appending only the keys added since the last export - the rows already
+    # in the file are streamed through as they are. The file is regenerated with export_xlsx() if it's missing or was
+    # changed (e.g. sorted in Excel) since the last export. Returns the number of rows written.
+    def update_xlsx(self, xlsx_path=None):
+        xlsx_path = xlsx_path or self.xlsx_path
+        self.flush()
+        state = self.conn.execute("SELECT last_rowid, rows, file_key FROM xlsx_exports WHERE path = ?",
+                                  (os.path.abspath(xlsx_path),)).fetchone()
+        if state is None or not os.path.exists(xlsx_path) or json.loads(state[2]) != file_key(xlsx_path, digest=False):
+            return self.export_xlsx(xlsx_path)
+
+        last_rowid, count, _ = state
+        rows = self.conn.execute("SELECT rowid, email, subject, received FROM mail_log WHERE rowid > ? ORDER BY rowid",
+                                 (last_rowid,)).fetchall()
+        if not rows:
+            return 0
+        patch = WorkbookPatch(xlsx_path)
+        sheet = next(iter(patch.parts))
+        for n, (_, *values) in enumerate(rows, start=count + 2): # row 1 is the header
+            for col, value in enumerate(values, start=1):
+                patch.set(sheet, n, col, value)
+        patch.save()
+        self._exported(xlsx_path, rows[-1][0], count + len(rows))
+        return len(rows)
+
+    def _exported(self, xlsx_path, last_rowid, rows):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO xlsx_exports VALUES (?, ?, ?, ?)",
+                              (os.path.abspath(xlsx_path), last_rowid, rows, json.dumps(file_key(xlsx_path, digest=False))))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,188 @@
+import os #for creating file paths
+import shutil #for copying message files in the local stand-in
+from collections import OrderedDict #for the recently used Outlook items
+from datetime import datetime #for message timestamps
+from email import policy #for parsing .eml files
+from email.parser import BytesParser, BytesHeaderParser
+from email.utils import parsedate_to_datetime, parseaddr
+import pandas as pd #for the columnar message table
+
+# Columns of the table returned by MailboxSource.fetch()
+COLUMNS = ["id", "sender_email", "sender_name", "subject", "received", "has_attachments"]
+
+# Common interface of the mailbox backends used by the download script.
+# fetch() returns message metadata for a date range as one table (newest first);
+# attachments are only listed and saved for the messages the caller asks about.
+# source - name of the mailbox the watermark of the download script is kept for.
+class MailboxSource:
+    source = None
+
+    def fetch(self, since, until=None):
+        raise NotImplementedError
+
+    def attachment_names(self, msg_id):
+        raise NotImplementedError
+
+    def save_attachment(self, msg_id, index, path):
+        raise NotImplementedError
+
+    def save_message(self, msg_id, path):
+        raise NotImplementedError
+
+
+def _naive(dt):
+    # Outlook and the script work on naive local time
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+def _table(rows):
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    return df.sort_values("received", ascending=False, kind="stable").reset_index(drop=True)
+
+
+# Outlook (classic) backend - reads the Inbox through a restricted Table, which returns the
+# chosen columns for many messages per COM call instead of one property per call.
+class OutlookSource(MailboxSource):
+    BATCH = 500
+    CACHED_ITEMS = 64
+
+    def __init__(self, folder_id=6):
+        import win32com.client #for connecting to Outlook
+        self.namespace = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+        self.folder = self.namespace.GetDefaultFolder(folder_id)
+        self.source = "outlook:" + self.folder.FolderPath
+        self._items = OrderedDict()
+
+    def fetch(self, since, until=None):
+        restriction = f"[ReceivedTime] >= '{since.strftime('%m/%d/%Y %I:%M %p')}'"
+        if until is not None:
+            restriction += f" AND [ReceivedTime] < '{until.strftime('%m/%d/%Y %I:%M %p')}'"
+        table = self.folder.GetTable(restriction, 0)
+        table.Columns.RemoveAll()
+        for column in ("EntryID", "SenderEmailAddress", "SenderName", "Subject", "ReceivedTime",
+                       "urn:schemas:httpmail:hasattachment"):
+            table.Columns.Add(column)
+        table.Sort("[ReceivedTime]", True)
+
+        rows = []
+        while not table.EndOfTable:
+            for entry_id, email, name, subject, received, has_att in table.GetArray(self.BATCH):
+                received = datetime(received.year, received.month, received.day,
+                                    received.hour, received.minute, received.second)
+                # Restrict works with minute precision, so the exact bounds are checked here
+                if received < since or (until is not None and received >= until):
+                    continue
+                rows.append((entry_id, email or "", name or "", subject or "", received, bool(has_att)))
+        return _table(rows)
+
+    def _item(self, msg_id):
+        # The recently used messages are kept - the download script saves a message (.msg) a few messages
+        # after its attachments were saved
+        if msg_id in self._items:
+            self._items.move_to_end(msg_id)
+        else:
+            self._items[msg_id] = self.namespace.GetItemFromID(msg_id)
+            if len(self._items) > self.CACHED_ITEMS:
+                self._items.popitem(last=False)
+        return self._items[msg_id]
+
+    def attachment_names(self, msg_id):
+        return [att.FileName for att in self._item(msg_id).Attachments]
+
+    def save_attachment(self, msg_id, index, path):
+        self._item(msg_id).Attachments.Item(index + 1).SaveAsFile(path)
+
+    def save_message(self, msg_id, path):
+        self._item(msg_id).SaveAs(path)
+
+
+# Local stand-in backend - a directory of .eml files (and .msg files when the optional
+# "extract_msg" package is installed). Lets the download stage run and be benchmarked without Outlook.
+class DirectorySource(MailboxSource):
+    def __init__(self, folder):
+        self.folder = folder
+        self.source = "directory:" + os.path.abspath(folder)
+        self._parsed = {}
+
+    def fetch(self, since, until=None):
+        rows = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            ext = os.path.splitext(name)[1].lower()
+            if ext == ".eml":
+                row = self._eml_metadata(path)
+            elif ext == ".msg":
+                row = self._msg_metadata(path)
+            else:
+                continue
+            if row is None:
+                continue
+            if row[4] < since or (until is not None and row[4] >= until):
+                continue
+            rows.append(row)
+        return _table(rows)
+
+    def _eml_metadata(self, path):
+        with open(path, "rb") as f:
+            headers = BytesHeaderParser(policy=policy.default).parse(f)
+        try:
+            received = _naive(parsedate_to_datetime(headers["Date"]))
+        except (TypeError, ValueError):
+            received = datetime.fromtimestamp(os.path.getmtime(path))
+        name, email = parseaddr(str(headers.get("From", "")))
+        has_att = headers.get_content_maintype() == "multipart"
+        return (path, email, name, str(headers.get("Subject", "")), received, has_att)
+
+    def _msg_metadata(self, path):
+        try:
+            import extract_msg #optional - only needed for .msg files in the stand-in folder
+        except ImportError:
+            return None
+        msg = extract_msg.openMsg(path)
+        try:
+            name, email = parseaddr(msg.sender or "")
+            received = msg.date
+            if isinstance(received, str):
+                received = parsedate_to_datetime(received)
+            received = _naive(received) if received else datetime.fromtimestamp(os.path.getmtime(path))
+            return (path, email, name, msg.subject or "", received, bool(msg.attachments))
+        finally:
+            msg.close()
+
+    # Returns [(file name, bytes)] for every attachment - parsed once per message
+    def _attachments(self, msg_id):
+        if msg_id not in self._parsed:
+            if msg_id.lower().endswith(".msg"):
+                import extract_msg
+                msg = extract_msg.openMsg(msg_id)
+                try:
+                    atts = [(att.longFilename or att.shortFilename or "", att.data) for att in msg.attachments]
+                finally:
+                    msg.close()
+            else:
+                with open(msg_id, "rb") as f:
+                    message = BytesParser(policy=policy.default).parse(f)
+                atts = [(part.get_filename() or "", part.get_payload(decode=True) or b"")
+                        for part in message.iter_attachments()]
+            self._parsed = {msg_id: atts}
+        return self._parsed[msg_id]
+
+    def attachment_names(self, msg_id):
+        return [name for name, _ in self._attachments(msg_id)]
+
+    def save_attachment(self, msg_id, index, path):
+        with open(path, "wb") as f:
+            f.write(self._attachments(msg_id)[index][1])
+
+    # The original message file is copied as it is (the script names it .msg either way)
+    def save_message(self, msg_id, path):
+        shutil.copyfile(msg_id, path)
+
+
+# Picks the backend from config.json - "mailbox_directory" switches to the local stand-in
+def open_mailbox(config):
+    folder = config.get("mailbox_directory")
+    if folder:
+        return DirectorySource(folder)
+    return OutlookSource()
@@ -0,0 +1,136 @@
+import openpyxl #for loading/saving the master file
+from datetime import datetime, date, time #for comparing dates with the numbers they are stored as
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.datetime import to_excel
+from pipeline.xlsx_probe import read_columns, read_rows
+from pipeline.xlsm_patch import WorkbookPatch, replace_file
+
+
+def _col(col):
+    return column_index_from_string(col) if isinstance(col, str) else col
+
+# True if a value read from the master file is the same as the one about to be written
+# (an empty cell is the same as "", a date can be read back as the number Excel stores it as)
+def same_value(old, new):
+    if old == new or (old in (None, '') and new in (None, '')):
+        return True
+    if isinstance(new, (datetime, date, time)) and isinstance(old, (int, float)) and not isinstance(old, bool):
+        return to_excel(new) == old
+    return False
+
+
+# Master file loaded completely with openpyxl (macros kept) and saved as a whole
+class OpenpyxlMaster:
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.wb = openpyxl.load_workbook(path, keep_vba=True)
+
+    # {row: value} of one column, from start_row down
+    def column(self, sheet, col, start_row=1):
+        ws = self.wb[sheet]
+        col = _col(col)
+        return {row: ws.cell(row=row, column=col).value for row in range(start_row, ws.max_row + 1)}
+
+    def get(self, sheet, row, col):
+        return self.wb[sheet].cell(row=row, column=_col(col)).value
+
+    def set(self, sheet, row, col, value):
+        self.wb[sheet].cell(row=row, column=_col(col)).value = value
+
+    # {column: value} of one row (columns as given)
+    def row(self, sheet, row, cols):
+        ws = self.wb[sheet]
+        return {col: ws.cell(row=row, column=_col(col)).value for col in cols}
+
+    # Everything is loaded already
+    def prefetch(self, sheet, rows, cols):
+        pass
+
+    def open_rows(self, sheet, rows):
+        pass
+
+    # Written next to the master file first and swapped in (checkpoints save in the middle of a run - a save that is
+    # interrupted must leave a readable master file for the update journal to replay onto)
+    def save(self):
+        replace_file(self.path, self.wb.save)
+
+
+# Master file that is never loaded as a whole: the columns the script reads are scanned
+# straight from the sheet XML, and edits are written with WorkbookPatch, which rewrites only
+# the changed rows and copies everything else (macros, data validations...) as it is.
+# columns - {sheet: [columns the script will read]} (e.g. the NIP columns)
+class PatchedMaster:
+    def __init__(self, path, columns):
+        self.path = path
+        self.patch = WorkbookPatch(path)
+        self.columns = {
+            sheet: {_col(col): values for col, values in read_columns(path, sheet, cols).items()}
+            for sheet, cols in columns.items()
+        }
+        self.rows = {}  # sheet -> {row: {column: value}} of whole rows read with prefetch()
+        self.row_columns = {}  # sheet -> columns read for those rows
+
+    def column(self, sheet, col, start_row=1):
+        values = self._values(sheet, col)
+        return {row: val for row, val in values.items() if row >= start_row}
+
+    def _values(self, sheet, col):
+        try:
+            return self.columns[sheet][_col(col)]
+        except KeyError:
+            raise KeyError(f"column {col} of {sheet} was not read from the master file") from None
+
+    def get(self, sheet, row, col):
+        return self._values(sheet, col).get(row)
+
+    def set(self, sheet, row, col, value):
+        self.patch.set(sheet, row, col, value)
+        cached = self.columns.get(sheet, {}).get(_col(col))
+        if cached is not None:
+            if value is None:
+                cached.pop(row, None)
+            else:
+                cached[row] = value
+        cached_row = self.rows.get(sheet, {}).get(row)
+        if cached_row is not None:
+            cached_row[_col(col)] = value
+
+    # Reads some rows (e.g. the rows a batch of files will overwrite) in one scan of the sheet XML,
+    # with the edits not saved yet on top
+    def prefetch(self, sheet, rows, cols):
+        cols = {_col(col) for col in cols}
+        cached = self.rows.setdefault(sheet, {})
+        if not cols <= self.row_columns.get(sheet, set()):
+            cached.clear()
+            self.row_columns[sheet] = cols
+        missing = [row for row in rows if row not in cached]
+        if not missing:
+            return
+        edits = self.patch.edits.get(self.patch.parts[sheet], {})
+        for row, values in read_rows(self.path, sheet, missing, sorted(self.row_columns[sheet])).items():
+            values.update(edits.get(row, {}))
+            cached[row] = values
+
+    # The columns are read already (a sharded master loads the shards of the rows here)
+    def open_rows(self, sheet, rows):
+        pass
+
+    # {column: value} of one row (columns as given) - read on its own if it wasn't prefetched
+    def row(self, sheet, row, cols):
+        self.prefetch(sheet, [row], cols)
+        values = self.rows[sheet][row]
+        return {col: values.get(_col(col)) for col in cols}
+
+    def save(self):
+        if self.patch:
+            self.patch.save()
+
+
+# "master_writer" in config.json: "openpyxl" (default), "patch" or "sqlite" (see pipeline/master_db.py)
+def open_master(path, writer="openpyxl", columns=None):
+    if writer == "patch":
+        return PatchedMaster(path, columns or {})
+    if writer == "sqlite":
+        from pipeline.master_db import SqliteMaster
+        return SqliteMaster(path, columns)
+    return OpenpyxlMaster(path, columns)
@@ -0,0 +1,313 @@
+import os #for the database path
+import json #for the key of the master file last read or written
+import sqlite3 #for the database kept instead of the master file
+from datetime import datetime, date, time #for cell values that are dates
+from openpyxl.utils import column_index_from_string
+from openpyxl.utils.datetime import to_excel
+from pipeline.nip_index import NipIndex, NIP_COLUMNS, file_key, master_unchanged
+from pipeline.xlsm_patch import WorkbookPatch
+from pipeline.xlsx_probe import read_columns, read_rows
+from pipeline.supplier_file import DATA_MAPPING
+
+OFFER_COLUMNS = range(25, 805)  # "x" columns of data1
+FILE_COLUMN = 805  # name of the file each row was last filled from
+NIP_COLUMN = {sheet: column_index_from_string(column) for sheet, (column, _) in NIP_COLUMNS.items()}
+FIELD_COLUMNS = sorted(column_index_from_string(col) for col in DATA_MAPPING.values())  # data2 columns filled from "DATA"
+READ, WRITTEN = "read", "written"  # keys of the master file kept in the database
+
+
+def _col(col):
+    return column_index_from_string(col) if isinstance(col, str) else col
+
+# Dates are kept as Excel serial numbers - the way the master file stores them
+# (pipeline.master.same_value takes a date and its number as the same value)
+def _stored(value):
+    if isinstance(value, (datetime, date, time)):
+        return to_excel(value)
+    return value
+
+def _marks(text):
+    return {int(col) for col in text.split()} if text else set()
+
+
+# The supplier rows of the master file kept in SQLite ("<master file>.db", WAL) - "master_writer": "sqlite".
+# data1 and data2 rows keep their row numbers from the master file: data1 has the NIP, the "x" columns
+# (as a list of column numbers) and column 805; data2 has the NIP and the columns filled from the "DATA" sheet.
+# Every saved change raises the version of the row; export() writes the rows whose version is newer than
+# the one last written to the master file, so the .xlsm is only an export that can be made any time later.
+# The database is created from the master file the first time (only the columns above are read).
+# The master file stays the place where suppliers are added: the key (size, modification time, SHA-256) of the master
+# file last read or exported is kept, and when the file changed since, the NIP columns are read again (sync_master) -
+# new NIPs and new rows get into the database, the rows the script fills are left as they are in the database.
+# The key of the master file last imported or exported is kept as well (see export(everything=True)).
+class MasterDatabase:
+    def __init__(self, db_path, master_path):
+        self.db_path = db_path
+        self.master_path = master_path
+        is_new = not os.path.exists(db_path)
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS data1 ("
+                "row INTEGER PRIMARY KEY, nip TEXT, file TEXT, marks TEXT NOT NULL DEFAULT '', "
+                "version INTEGER NOT NULL DEFAULT 0, exported INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS data2 ("
+                "row INTEGER PRIMARY KEY, nip TEXT, version INTEGER NOT NULL DEFAULT 0, exported INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS data2_fields ("
+                "row INTEGER NOT NULL, col INTEGER NOT NULL, value, PRIMARY KEY (row, col)) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS data1_nip ON data1 (nip)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS data2_nip ON data2 (nip)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS data1_export ON data1 (row) WHERE version > exported")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS data2_export ON data2 (row) WHERE version > exported")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS master_keys (name TEXT PRIMARY KEY, key TEXT)")
+        if is_new:
+            self.import_master()
+            self.save_master_key(WRITTEN)
+        elif os.path.exists(master_path) and not master_unchanged(master_path, self.master_key()):
+            self.sync_master()
+            self.save_master_key()
+
+    # file_key of the master file when it was last read (READ) or last imported/exported (WRITTEN), {} if unknown
+    def master_key(self, name=READ):
+        row = self.conn.execute("SELECT key FROM master_keys WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    # Notes the current master file as read (and as imported/exported with WRITTEN)
+    def save_master_key(self, name=READ):
+        key = json.dumps(file_key(self.master_path))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO master_keys VALUES (?, ?)",
+                                  [(READ, key)] + ([(WRITTEN, key)] if name == WRITTEN else []))
+
+    # False if the master file was changed outside of the script since it was last imported or exported
+    def master_exported(self):
+        return master_unchanged(self.master_path, self.master_key(WRITTEN))
+
+    # Reads the supplier rows of the master file into empty tables
+    def import_master(self):
+        (_, start1), (_, start2) = NIP_COLUMNS['data1'], NIP_COLUMNS['data2']
+        data1 = read_columns(self.master_path, 'data1', [NIP_COLUMN['data1'], FILE_COLUMN, *OFFER_COLUMNS], start1)
+        data2 = read_columns(self.master_path, 'data2', [NIP_COLUMN['data2'], *FIELD_COLUMNS], start2)
+        rows1 = {}
+        for col in OFFER_COLUMNS:
+            for row, value in data1[col].items():
+                if str(value).strip().lower() == 'x':
+                    rows1.setdefault(row, []).append(str(col))
+        all_rows1 = set(rows1) | set(data1[NIP_COLUMN['data1']]) | set(data1[FILE_COLUMN])
+        all_rows2 = set().union(*(data2[col] for col in data2))
+        with self.conn:
+            self.conn.executemany("INSERT INTO data1 (row, nip, file, marks) VALUES (?, ?, ?, ?)", [
+                (row, _text(data1[NIP_COLUMN['data1']].get(row)), _text(data1[FILE_COLUMN].get(row)),
+                 " ".join(rows1.get(row, []))) for row in sorted(all_rows1)])
+            self.conn.executemany("INSERT INTO data2 (row, nip) VALUES (?, ?)", [
+                (row, _text(data2[NIP_COLUMN['data2']].get(row))) for row in sorted(all_rows2)])
+            self.conn.executemany("INSERT INTO data2_fields VALUES (?, ?, ?)", [
+                (row, col, value) for col in FIELD_COLUMNS for row, value in data2[col].items()])
+
+    # The master file was changed outside of the script (suppliers added in Excel): the NIP columns are read again
+    # and the NIPs of the database follow them; rows that are new to the database are read in full (only those rows).
+    # Returns the number of rows added or changed.
+    def sync_master(self):
+        changed = 0
+        for sheet, (_, start_row) in NIP_COLUMNS.items():
+            column = NIP_COLUMN[sheet]
+            nips = {row: _text(value) for row, value in
+                    read_columns(self.master_path, sheet, [column], start_row)[column].items()}
+            known = dict(self.conn.execute(f"SELECT row, nip FROM {sheet}"))
+            new_rows = sorted(set(nips) - set(known))
+            renamed = [(nips.get(row), row) for row, nip in known.items() if nips.get(row) != nip]
+            values = read_rows(self.master_path, sheet, new_rows,
+                               [FILE_COLUMN, *OFFER_COLUMNS] if sheet == 'data1' else FIELD_COLUMNS)
+            with self.conn:
+                self.conn.executemany(f"UPDATE {sheet} SET nip = ? WHERE row = ?", renamed)
+                if sheet == 'data1':
+                    self.conn.executemany("INSERT INTO data1 (row, nip, file, marks) VALUES (?, ?, ?, ?)", [
+                        (row, nips[row], _text(values[row].get(FILE_COLUMN)),
+                         " ".join(str(col) for col in OFFER_COLUMNS
+                                  if str(values[row].get(col, "")).strip().lower() == 'x')) for row in new_rows])
+                else:
+                    self.conn.executemany("INSERT INTO data2 (row, nip) VALUES (?, ?)",
+                                          [(row, nips[row]) for row in new_rows])
+                    self.conn.executemany("INSERT INTO data2_fields VALUES (?, ?, ?)", [
+                        (row, col, value) for row in new_rows for col, value in values[row].items()])
+            changed += len(new_rows) + len(renamed)
+        return changed
+
+    # Writes the rows changed since the last export into the master file (with WorkbookPatch - only those rows
+    # are rewritten) and notes them as exported. Returns the number of rows written.
+    # everything - every row the script ever wrote, not only the ones changed since the last export (rows never
+    # written by the script are left alone, so cells edited by hand in them are kept)
+    def export(self, target=None, everything=False):
+        if not master_unchanged(self.master_path, self.master_key()):
+            self.sync_master()
+            self.save_master_key()
+        if everything:
+            with self.conn:
+                self.conn.execute("UPDATE data1 SET exported = -1 WHERE version > 0")
+                self.conn.execute("UPDATE data2 SET exported = -1 WHERE version > 0")
+        rows1 = self.conn.execute("SELECT row, file, marks, version FROM data1 WHERE version > exported").fetchall()
+        rows2 = self.conn.execute("SELECT row, version FROM data2 WHERE version > exported").fetchall()
+        if not rows1 and not rows2:
+            return 0
+        fields = {}
+        for row, col, value in self.conn.execute(
+                "SELECT f.row, f.col, f.value FROM data2_fields f JOIN data2 d ON d.row = f.row WHERE d.version > d.exported"):
+            fields.setdefault(row, {})[col] = value
+        patch = WorkbookPatch(self.master_path)
+        for row, file, marks, _ in rows1:
+            marks = _marks(marks)
+            for col in OFFER_COLUMNS:
+                patch.set('data1', row, col, 'x' if col in marks else None)
+            patch.set('data1', row, FILE_COLUMN, file)
+        for row, _ in rows2:
+            values = fields.get(row, {})
+            for col in FIELD_COLUMNS:
+                patch.set('data2', row, col, values.get(col))
+        patch.save(target)
+        if target is None or os.path.abspath(target) == os.path.abspath(self.master_path):
+            self.save_master_key(WRITTEN)
+        # Rows changed again while the file was written stay newer than what was exported
+        with self.conn:
+            self.conn.executemany("UPDATE data1 SET exported = ? WHERE row = ?", [(version, row) for row, _, _, version in rows1])
+            self.conn.executemany("UPDATE data2 SET exported = ? WHERE row = ?", [(version, row) for row, version in rows2])
+        return len(rows1) + len(rows2)
+
+    # Number of rows not exported yet (everything - of the rows the script ever wrote)
+    def pending_export(self, everything=False):
+        condition = "version > 0" if everything else "version > exported"
+        return sum(self.conn.execute(f"SELECT COUNT(*) FROM {sheet} WHERE {condition}").fetchone()[0]
+                   for sheet in ('data1', 'data2'))
+
+    def close(self):
+        self.conn.close()
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+# Master "file" on top of the database, with the interface of pipeline.master: rows are read when used
+# (or in bulk with prefetch/open_rows), edits are kept in memory and save() writes them in one transaction.
+# columns is not used - every supported column can be read (data1: NIP, "x" columns, 805; data2: NIP, "DATA" columns).
+class SqliteMaster:
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.db = MasterDatabase(database_path(path), path)
+        self.conn = self.db.conn
+        self.rows = {'data1': {}, 'data2': {}}  # sheet -> {row: {"nip", "file", "marks"} / {"nip", "fields"}}
+        self.dirty = {'data1': set(), 'data2': set()}
+
+    def _load(self, sheet, rows):
+        cached = self.rows[sheet]
+        missing = [row for row in rows if row not in cached]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            marks = ", ".join("?" * len(chunk))
+            if sheet == 'data1':
+                for row, nip, file, text in self.conn.execute(
+                        f"SELECT row, nip, file, marks FROM data1 WHERE row IN ({marks})", chunk):
+                    cached[row] = {"nip": nip, "file": file, "marks": _marks(text)}
+            else:
+                for row, nip in self.conn.execute(f"SELECT row, nip FROM data2 WHERE row IN ({marks})", chunk):
+                    cached[row] = {"nip": nip, "fields": {}}
+                for row, col, value in self.conn.execute(
+                        f"SELECT row, col, value FROM data2_fields WHERE row IN ({marks})", chunk):
+                    cached[row]["fields"][col] = value
+        for row in missing:
+            cached.setdefault(row, {"nip": None, "file": None, "marks": set()} if sheet == 'data1'
+                              else {"nip": None, "fields": {}})
+
+    def _row(self, sheet, row):
+        if row not in self.rows[sheet]:
+            self._load(sheet, [row])
+        return self.rows[sheet][row]
+
+    # The NIP column is read straight from its table (it is never edited), other columns through the loaded rows
+    def column(self, sheet, col, start_row=1):
+        col = _col(col)
+        if col == NIP_COLUMN[sheet]:
+            return dict(self.conn.execute(f"SELECT row, nip FROM {sheet} WHERE row >= ? ORDER BY row", (start_row,)))
+        rows = [row for (row,) in self.conn.execute(f"SELECT row FROM {sheet} WHERE row >= ? ORDER BY row", (start_row,))]
+        self._load(sheet, rows)
+        return {row: self.get(sheet, row, col) for row in rows}
+
+    def get(self, sheet, row, col):
+        col = _col(col)
+        values = self._row(sheet, row)
+        if col == NIP_COLUMN[sheet]:
+            return values["nip"]
+        if sheet == 'data2':
+            return values["fields"].get(col)
+        if col == FILE_COLUMN:
+            return values["file"]
+        if col in OFFER_COLUMNS:
+            return 'x' if col in values["marks"] else None
+        raise KeyError(f"column {col} of data1 is not kept in the database")
+
+    def set(self, sheet, row, col, value):
+        col = _col(col)
+        values = self._row(sheet, row)
+        if col == NIP_COLUMN[sheet]:
+            raise KeyError(f"the NIP column of {sheet} is not written by the script")
+        if sheet == 'data2':
+            values["fields"][col] = _stored(value)
+        elif col == FILE_COLUMN:
+            values["file"] = value
+        elif col in OFFER_COLUMNS:
+            if value is None:
+                values["marks"].discard(col)
+            else:
+                values["marks"].add(col)
+        else:
+            raise KeyError(f"column {col} of data1 is not kept in the database")
+        self.dirty[sheet].add(row)
+
+    def row(self, sheet, row, cols):
+        return {col: self.get(sheet, row, col) for col in cols}
+
+    def prefetch(self, sheet, rows, cols):
+        self._load(sheet, rows)
+
+    def open_rows(self, sheet, rows):
+        self._load(sheet, rows)
+
+    # Writes the changed rows in one transaction (each gets a new version for the export)
+    def save(self):
+        if not any(self.dirty.values()):
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO data1 (row, nip, file, marks, version) VALUES (?, ?, ?, ?, 1) ON CONFLICT(row) DO UPDATE SET "
+                "file = excluded.file, marks = excluded.marks, version = data1.version + 1",
+                [(row, values["nip"], values["file"], " ".join(map(str, sorted(values["marks"]))))
+                 for row in self.dirty['data1'] for values in [self.rows['data1'][row]]])
+            rows2 = sorted(self.dirty['data2'])
+            self.conn.executemany(
+                "INSERT INTO data2 (row, nip, version) VALUES (?, ?, 1) ON CONFLICT(row) DO UPDATE SET "
+                "version = data2.version + 1", [(row, self.rows['data2'][row]["nip"]) for row in rows2])
+            self.conn.executemany("DELETE FROM data2_fields WHERE row = ?", [(row,) for row in rows2])
+            self.conn.executemany("INSERT INTO data2_fields VALUES (?, ?, ?)", [
+                (row, col, value) for row in rows2 for col, value in self.rows['data2'][row]["fields"].items()
+                if value is not None])
+        self.dirty = {'data1': set(), 'data2': set()}
+
+
+# NIP -> row maps read from the indexed NIP columns of the database each time - nothing is saved next to the master
+class DatabaseNipIndex(NipIndex):
+    def load(self):
+        return False
+
+    def save(self):
+        return None
+
+
+# "<master file>.db" next to the master file
+def database_path(master_path):
+    return master_path + ".db"
@@ -0,0 +1,341 @@
+import os #for the shard file paths
+import re #for finding rows and cells in the sheet XML
+import json #for the layout file
+import zlib #for the hash routing NIPs to shards
+import zipfile #for reading/writing the xlsm packages
+from xml.sax.saxutils import escape
+from xml.etree.ElementTree import fromstring #for comparing the cell styles of the shards
+from pipeline.master import open_master
+from pipeline.nip_index import NipIndex, NIP_COLUMNS, file_key
+from pipeline.supplier_file import clean_nip
+from pipeline.xlsx_probe import sheet_parts, read_columns, shared_strings
+from pipeline.xlsm_patch import replace_file
+
+_ROW = re.compile(rb'<row(?=[\s/>])[^>]*?(?:/>|>.*?</row>)', re.S)
+_ROW_NUMBER = re.compile(rb'\sr="(\d+)"')
+_SHARED_CELL = re.compile(rb'<c(?=\s)([^>]*?)\st="s"([^>]*)>\s*<v>(\d+)</v>\s*</c>')
+_CALC_CHAIN_TYPE = b'application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml'
+_STYLE = re.compile(rb'(<(?:c|row)\s[^>]*?\ss=")(\d+)(")')
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_DEFAULTS = {("patternFill", "patternType"): "none"}
+
+
+# Shard of a supplier (cleaned NIP) - the same NIP always goes to the same shard
+def shard_of(nip, shards):
+    return zlib.crc32(nip.encode()) % shards
+
+
+# Sharded master file: the suppliers of data1/data2 are split into K workbooks by the hash of their NIP.
+# Every shard is a copy of the master file (macros, other sheets, styles) with only its suppliers' rows of
+# data1/data2 - at the same row numbers as in the master file, so formulas, tables and data validations stay
+# right, rows are unique across the shards, and merging is putting the rows back together.
+# The layout is kept in "<master file>.shards.json" next to the master file, the shards in "<master file> shards".
+class ShardLayout:
+    def __init__(self, master_path):
+        self.master_path = master_path
+        self.layout_path = master_path + ".shards.json"
+        self.folder = os.path.splitext(master_path)[0] + " shards"
+        self.files = []
+
+    def exists(self):
+        return os.path.exists(self.layout_path)
+
+    def load(self):
+        with open(self.layout_path, "r", encoding="utf-8") as f:
+            self.files = json.load(f)["shards"]
+        return self
+
+    def save(self):
+        with open(self.layout_path, "w", encoding="utf-8") as f:
+            json.dump({"method": "crc32", "shards": self.files}, f, indent=1)
+
+    @property
+    def paths(self):
+        return [os.path.join(self.folder, name) for name in self.files]
+
+    def __len__(self):
+        return len(self.files)
+
+
+# Splits the master file into `shards` workbooks and saves the layout. Rows of data1/data2 without a NIP go
+# to the first shard, the rows above the NIPs (headers) to every shard. The master file itself is not changed.
+def split_master(master_path, shards):
+    layout = ShardLayout(master_path)
+    os.makedirs(layout.folder, exist_ok=True)
+    stem, ext = os.path.splitext(os.path.basename(master_path))
+    layout.files = [f"{stem}.shard{i + 1:02d}{ext}" for i in range(shards)]
+
+    with zipfile.ZipFile(master_path) as src:
+        parts = sheet_parts(src)
+        routes = {}  # sheet part -> {row: shard}
+        for sheet, (column, start_row) in NIP_COLUMNS.items():
+            nips = read_columns(master_path, sheet, [column], start_row)[column]
+            routes[parts[sheet]] = (start_row, {row: shard_of(nip, shards) if (nip := clean_nip(value)) else 0
+                                                for row, value in nips.items()})
+        writers = [zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) for path in layout.paths]
+        try:
+            for info in src.infolist():
+                if info.filename == "xl/calcChain.xml":
+                    continue  # cells of the other shards are gone - Excel rebuilds the chain
+                data = _without_calc_chain(info.filename, src.read(info))
+                if info.filename not in routes:
+                    for dst in writers:
+                        dst.writestr(_copy_info(info), data)
+                    continue
+                start_row, shard_rows = routes[info.filename]
+                start, end = _sheet_data(data)
+                kept = [[] for _ in writers]
+                for match in _ROW.finditer(data, start, end):
+                    row = _row_number(match.group(0))
+                    if row < start_row:
+                        for rows in kept:
+                            rows.append(match.group(0))
+                    else:
+                        kept[shard_rows.get(row, 0)].append(match.group(0))
+                for dst, rows in zip(writers, kept):
+                    dst.writestr(_copy_info(info), data[:start] + b"".join(rows) + data[end:])
+        finally:
+            for dst in writers:
+                dst.close()
+    layout.save()
+    return layout
+
+
+# Puts the rows of all the shards back into one workbook (everything else comes from the first shard) - written
+# to target (the master file by default) through a temporary file. A row is taken from the shard that has a NIP
+# in it (rows without a NIP are in the first shard). Shared strings of the other shards are written as inline
+# strings and their cell styles are given the numbers of the same styles in the first shard (openpyxl numbers
+# them again when it saves a shard) - a style the first shard doesn't have is an error.
+def merge_shards(layout, target=None):
+    target = target or layout.master_path
+    paths = layout.paths
+    with zipfile.ZipFile(paths[0]) as zf:
+        first_styles = {}
+        for index, style in enumerate(cell_styles(zf)):
+            first_styles.setdefault(style, index)
+    sheet_rows = {sheet: {} for sheet in NIP_COLUMNS}  # sheet -> {row: row XML} of the shards after the first
+    for path in paths[1:]:
+        with zipfile.ZipFile(path) as zf:
+            styles = {}  # style number in the shard -> in the first shard
+            for index, style in enumerate(cell_styles(zf)):
+                styles[index] = first_styles.get(style)
+            parts = sheet_parts(zf)
+            for sheet, (column, start_row) in NIP_COLUMNS.items():
+                owned = {row for row, value in read_columns(path, sheet, [column], start_row)[column].items()
+                         if clean_nip(value)}
+                data = zf.read(parts[sheet])
+                start, end = _sheet_data(data)
+                rows = [(row, match.group(0)) for match in _ROW.finditer(data, start, end)
+                        if (row := _row_number(match.group(0))) in owned]
+                needed = {int(index) for _, xml in rows for index in re.findall(rb'\st="s"[^>]*>\s*<v>(\d+)</v>', xml)}
+                strings = shared_strings(zf, needed)
+                for row, xml in rows:
+                    sheet_rows[sheet][row] = _inline_strings(_renumber_styles(xml, styles, path, paths[0]), strings)
+
+    def write(out):
+        with zipfile.ZipFile(paths[0]) as src, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as dst:
+            parts = {part: sheet for sheet, part in sheet_parts(src).items() if sheet in sheet_rows}
+            for info in src.infolist():
+                data = src.read(info)
+                if info.filename in parts:
+                    start, end = _sheet_data(data)
+                    rows = {_row_number(match.group(0)): match.group(0) for match in _ROW.finditer(data, start, end)}
+                    rows.update(sheet_rows[parts[info.filename]])
+                    data = data[:start] + b"".join(rows[row] for row in sorted(rows)) + data[end:]
+                dst.writestr(_copy_info(info), data)
+    replace_file(target, write)
+    return target
+
+
+# Start and end of the rows inside <sheetData> (data1/data2 always have rows - at least the headers)
+def _sheet_data(data):
+    tag = re.search(rb'<sheetData(?=[\s/>])[^>]*?(/?)>', data)
+    if tag.group(1):
+        raise ValueError("sheet without rows")
+    return tag.end(), data.index(b'</sheetData>', tag.end())
+
+def _row_number(xml):
+    return int(_ROW_NUMBER.search(xml[:xml.find(b'>')]).group(1))
+
+def _inline_strings(xml, strings):
+    def inline(match):
+        text = escape(strings.get(int(match.group(3)), "")).encode("utf-8")
+        return b'<c' + match.group(1) + b' t="inlineStr"' + match.group(2) + b'><is><t xml:space="preserve">' + text + b'</t></is></c>'
+    return _SHARED_CELL.sub(inline, xml)
+
+def _renumber_styles(xml, styles, path, first_path):
+    def renumber(match):
+        index = styles.get(int(match.group(2)))
+        if index is None:
+            raise ValueError(f"{os.path.basename(path)} has a cell style (s=\"{match.group(2).decode()}\") that is not in "
+                             f"{os.path.basename(first_path)} - the shards can't be merged without changing formats")
+        return match.group(1) + str(index).encode() + match.group(3)
+    return _STYLE.sub(renumber, xml)
+
+# What every cell style (cellXfs entry) of a workbook looks like, with the fonts, fills, borders, number formats and
+# named styles it points to written out - the same for a style whether Excel or openpyxl saved the file
+def cell_styles(zf):
+    root = fromstring(zf.read("xl/styles.xml"))
+    formats = {item.get("numFmtId"): item.get("formatCode") for item in root.iter(_MAIN + "numFmt")}
+    tables = {}
+    for attr, name in (("fontId", "fonts"), ("fillId", "fills"), ("borderId", "borders")):
+        parent = root.find(_MAIN + name)
+        tables[attr] = [_canonical(item) for item in parent] if parent is not None else []
+
+    def style(xf, named):
+        attrs = dict(xf.attrib)
+        key = [formats.get(attrs.get("numFmtId", "0"), attrs.get("numFmtId", "0"))]
+        for attr, table in tables.items():
+            index = int(attrs.get(attr, 0))
+            key.append(table[index] if index < len(table) else None)
+        key.append(named[int(attrs.get("xfId", 0))] if named else None)
+        key.append(tuple(sorted((name, value) for name, value in attrs.items()
+                                if name not in ("numFmtId", "xfId", *tables) and not name.startswith("apply")
+                                and value not in ("0", "false"))))
+        key.append(tuple(sorted(_canonical(child) for child in xf)))
+        return tuple(key)
+    parent = root.find(_MAIN + "cellStyleXfs")
+    named = [style(xf, None) for xf in parent] if parent is not None else []
+    parent = root.find(_MAIN + "cellXfs")
+    return [style(xf, named) for xf in parent] if parent is not None else []
+
+# An element with its attributes and children in a set order, without the attributes that only repeat a default
+# (<b/> and <b val="1"/>, <u/> and <u val="single"/>, <patternFill/> and <patternFill patternType="none"/>)
+# and with numbers written one way
+def _canonical(element):
+    tag = element.tag.replace(_MAIN, "")
+    attrs = {name: _number(value) for name, value in element.attrib.items()
+             if not (name == "val" and value in ("1", "true", "single"))
+             and _DEFAULTS.get((tag, name)) != value}
+    return tag, tuple(sorted(attrs.items())), tuple(sorted(_canonical(child) for child in element))
+
+# Numbers as the same text however many digits were written (tint="0.79998168889431442" / "0.7999816888943144")
+def _number(value):
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+def _copy_info(info):
+    new = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    new.compress_type = zipfile.ZIP_DEFLATED
+    new.external_attr = info.external_attr
+    return new
+
+def _without_calc_chain(name, data):
+    if name == "[Content_Types].xml":
+        return re.sub(rb'<Override[^>]*?' + re.escape(_CALC_CHAIN_TYPE) + rb'[^>]*?/>', b'', data)
+    if name == "xl/_rels/workbook.xml.rels":
+        return re.sub(rb'<Relationship[^>]*?Target="(?:/xl/)?calcChain\.xml"[^>]*?/>', b'', data)
+    return data
+
+
+# NIP -> row maps of all the shards (each kept in "<shard>.nip_index.json" like the one of a single master file).
+# Rows are unique across the shards, so the maps are merged and shard_rows says which shard a row is in.
+# A shard whose index is outdated has only its NIP columns read again (from the sheet XML, the shard isn't loaded).
+class ShardedNipIndex:
+    def __init__(self, layout):
+        self.layout = layout
+        self.indexes = [NipIndex(path) for path in layout.paths]
+        self.keys = [None] * len(layout)
+        self.maps = {}
+        self.duplicates = {}
+        self.shard_rows = {}
+
+    # Returns True if every shard had a valid index
+    def load(self):
+        all_cached = True
+        for shard, (path, index) in enumerate(zip(self.layout.paths, self.indexes)):
+            if index.load():
+                self.keys[shard] = file_key(path, digest=False)
+            else:
+                all_cached = False
+                index.build(open_master(path, "patch", {sheet: [column] for sheet, (column, _) in NIP_COLUMNS.items()}))
+        self.maps = {sheet: {} for sheet in NIP_COLUMNS}
+        self.shard_rows = {sheet: {} for sheet in NIP_COLUMNS}
+        self.duplicates = {}
+        for shard, index in enumerate(self.indexes):
+            for sheet, mapping in index.maps.items():
+                self.maps[sheet].update(mapping)
+                self.shard_rows[sheet].update(dict.fromkeys(mapping.values(), shard))
+            for sheet, duplicates in index.duplicates.items():
+                self.duplicates.setdefault(sheet, {}).update(duplicates)
+        return all_cached
+
+    def duplicate_messages(self):
+        for index in self.indexes:
+            yield from index.duplicate_messages()
+
+    # Saves the index of every shard that changed since it was loaded (or saved). Returns the keys of the shards.
+    def save(self):
+        for shard, (path, index) in enumerate(zip(self.layout.paths, self.indexes)):
+            if self.keys[shard] != file_key(path, digest=False):
+                index.save()
+                self.keys[shard] = file_key(path, digest=False)
+        return self.keys
+
+
+# Master file made of shards, with the interface of pipeline.master: rows are sent to the shard they are in
+# (nip_index.shard_rows). A shard is only loaded when one of its rows is used, and only the shards with changes
+# are saved - one after another (loading and saving with openpyxl holds the GIL, threads don't make it faster).
+class ShardedMaster:
+    def __init__(self, layout, writer, columns, nip_index):
+        self.layout = layout
+        self.writer = writer
+        self.columns = columns
+        self.nip_index = nip_index
+        self.shards = {}  # shard -> loaded master
+        self.dirty = set()
+
+    def _open(self, shard):
+        return open_master(self.layout.paths[shard], self.writer, self.columns)
+
+    def _shard(self, sheet, row):
+        shard = self.nip_index.shard_rows[sheet].get(row, 0)
+        if shard not in self.shards:
+            self.shards[shard] = self._open(shard)
+        return shard, self.shards[shard]
+
+    # Loads the shards that are not loaded yet
+    def _open_shards(self, shards):
+        for shard in sorted(set(shards) - set(self.shards)):
+            self.shards[shard] = self._open(shard)
+
+    # Loads the shards of these rows (e.g. the rows a batch of files will write)
+    def open_rows(self, sheet, rows):
+        self._open_shards({self.nip_index.shard_rows[sheet].get(row, 0) for row in rows})
+
+    # {row: value} of one column of every shard (loads all of them)
+    def column(self, sheet, col, start_row=1):
+        self._open_shards(range(len(self.layout)))
+        values = {}
+        for shard in range(len(self.layout)):
+            values.update(self.shards[shard].column(sheet, col, start_row))
+        return dict(sorted(values.items()))
+
+    def get(self, sheet, row, col):
+        return self._shard(sheet, row)[1].get(sheet, row, col)
+
+    def set(self, sheet, row, col, value):
+        shard, master = self._shard(sheet, row)
+        master.set(sheet, row, col, value)
+        self.dirty.add(shard)
+
+    def row(self, sheet, row, cols):
+        return self._shard(sheet, row)[1].row(sheet, row, cols)
+
+    def prefetch(self, sheet, rows, cols):
+        self.open_rows(sheet, rows)
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(self.nip_index.shard_rows[sheet].get(row, 0), []).append(row)
+        for shard, shard_rows in by_shard.items():
+            self.shards[shard].prefetch(sheet, shard_rows, cols)
+
+    # Saves the shards written to since the last save. Returns their numbers.
+    def save(self):
+        dirty = sorted(self.dirty)
+        for shard in dirty:
+            self.shards[shard].save()
+        self.dirty = set()
+        return dirty
@@ -0,0 +1,132 @@
+import os #for file names of the profiles
+import json #for the metrics lines
+import time #for the timers
+import atexit #for writing what is still buffered when the script ends
+import cProfile #for the optional profile of one file
+import tracemalloc #for the optional peak memory
+from datetime import datetime
+from contextlib import contextmanager
+
+# Lines appended to a text file in batches: the file is opened once per flush instead of once per line.
+# Flushed when max_lines are waiting, on flush() and when the script ends.
+class BufferedLog:
+    def __init__(self, path, max_lines=200):
+        self.path = path
+        self.max_lines = max_lines
+        self.lines = []
+        atexit.register(self.flush)
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.max_lines:
+            self.flush()
+
+    def flush(self):
+        if self.lines and self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(self.lines) + "\n")
+        self.lines = []
+
+
+# Timers and counters of one run, per phase and per file, written as JSON lines (buffered):
+#   {"type": "file", "run": ..., "file": ..., "status": ..., "phases": {phase: seconds}, "counters": {...}}
+#   {"type": "run", "run": ..., "seconds": ..., "files": ..., "phases": {...}, "counters": {...}, "peak_memory": ...}
+# trace_memory - peak memory of the run with tracemalloc (makes the script noticeably slower)
+# profile - name of one file to profile with cProfile, or "slowest" (every file is profiled,
+#           only the slowest one is kept); the profile is saved as "profile_<file>.prof" in profile_folder
+class Metrics:
+    def __init__(self, path=None, trace_memory=False, profile=None, profile_folder=None):
+        self.out = BufferedLog(path) if path else None
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.profile_folder = profile_folder or (os.path.dirname(path) if path else ".")
+        self.reset()
+
+    def reset(self):
+        self.run = None
+        self.started = None
+        self.phases = {}
+        self.counters = {}
+        self.files = {}
+        self.profiles = {}
+        self.slowest = (None, -1.0, None)
+
+    def start(self, run):
+        self.reset()
+        self.run = f"{run}-{datetime.now():%Y%m%d-%H%M%S}"
+        self.started = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _file(self, file):
+        return self.files.setdefault(file, {"phases": {}, "counters": {}})
+
+    def add_time(self, phase, seconds, file=None):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if file is not None:
+            phases = self._file(file)["phases"]
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def add(self, counter, value=1, file=None):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+        if file is not None:
+            counters = self._file(file)["counters"]
+            counters[counter] = counters.get(counter, 0) + value
+
+    @contextmanager
+    def phase(self, phase, file=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start, file)
+
+    # Runs the block under cProfile if the file is the one to profile (can be entered more than once per file)
+    @contextmanager
+    def profiled(self, file):
+        if self.profile not in (file, "slowest"):
+            yield
+            return
+        profiler = self.profiles.setdefault(file, cProfile.Profile())
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    def file_done(self, file, status, **fields):
+        entry = self.files.pop(file, {"phases": {}, "counters": {}})
+        seconds = sum(entry["phases"].values())
+        profiler = self.profiles.pop(file, None)
+        if profiler is not None and seconds > self.slowest[1]:
+            self.slowest = (file, seconds, profiler)
+        if self.out:
+            self.out.write(json.dumps({
+                "type": "file", "run": self.run, "file": file, "status": status, "seconds": round(seconds, 6),
+                "phases": {phase: round(value, 6) for phase, value in entry["phases"].items()},
+                "counters": entry["counters"], **fields,
+            }, ensure_ascii=False, default=str))
+
+    # Writes the run summary (and the profile), returns the summary
+    def finish(self, **fields):
+        summary = {
+            "type": "run", "run": self.run, "seconds": round(time.perf_counter() - self.started, 6),
+            "phases": {phase: round(value, 6) for phase, value in self.phases.items()},
+            "counters": self.counters, **fields,
+        }
+        if tracemalloc.is_tracing():
+            summary["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+ - on 3.8 the peak is the peak of the whole run
+                tracemalloc.reset_peak()
+        file, seconds, profiler = self.slowest
+        if profiler is not None:
+            summary["profile"] = os.path.join(self.profile_folder, f"profile_{os.path.splitext(file)[0]}.prof")
+            profiler.dump_stats(summary["profile"])
+        if self.out:
+            self.out.write(json.dumps(summary, ensure_ascii=False, default=str))
+            self.out.flush()
+        return summary
+
+    def flush(self):
+        if self.out:
+            self.out.flush()
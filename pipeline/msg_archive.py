@@ -0,0 +1,179 @@
+import os #for creating file paths
+import zlib #for comparing files with members written by an interrupted run
+import sqlite3 #for the index of the archived files
+import zipfile #for the compressed daily containers
+from datetime import datetime #for the name of the container of the day
+
+# Where the saved message (or attachment) is: waiting in "To_process" with its xlsx file,
+# or already handled by script 3 (the xlsx file went to "Processed" / "Invalid_files")
+TO_PROCESS = "to_process"
+PROCESSED = "processed"
+INVALID = "invalid"
+
+
+# Archive of the .msg files (and of the attachments that never go to "To_process") shared by both scripts.
+# Every file is written once, compressed, into a container of the day ("<folder>/<YYYY-MM-DD>.zip", then
+# "<YYYY-MM-DD>_1.zip"... once a container holds max_members files, so adding to one stays cheap),
+# instead of being saved to "To_process" and moved again to "Processed_msg" / "Invalid_files".
+# "index.db" (SQLite) maps every member name to its container, the xlsx file it came with, the NIP and its status,
+# so unique names are found with an index lookup instead of probing folders, and the files of a supplier
+# are found without opening the containers (see archive_lookup.py).
+# Every member is appended in its own ZipFile "a" session, inside the transaction that indexes it, so the container
+# is complete after each one. A member left without its index entry by an interrupted run is found when the container
+# is first used, and taken over by the same file added again (no second member with the same name).
+class MsgArchive:
+    def __init__(self, folder, max_members=500):
+        self.folder = folder
+        self.max_members = max_members
+        self.day = None
+        self.archive = None  # container files are added to
+        self.names = set()  # members of that container
+        self.orphans = {}  # members of that container that are not in the index -> (CRC, size)
+        os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(folder, "index.db"), timeout=30)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS members ("
+                "name TEXT PRIMARY KEY, archive TEXT NOT NULL, file TEXT, nip TEXT, "
+                "status TEXT NOT NULL, added TEXT NOT NULL, size INTEGER, message TEXT)"
+            )
+            # Indexes made before "message" (the msg file an archived attachment came with) was added
+            if "message" not in {column[1] for column in self.conn.execute("PRAGMA table_info(members)")}:
+                self.conn.execute("ALTER TABLE members ADD COLUMN message TEXT")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS members_file ON members (file)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS members_nip ON members (nip)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS members_message ON members (message)")
+
+    # filename, or filename with _1, _2... added if that name is taken (same suffixes as unique_filename())
+    # others - other names to avoid besides the ones in the index
+    def unique_name(self, filename, others=()):
+        base, ext = os.path.splitext(filename)
+        taken = {name for (name,) in self.conn.execute(
+            "SELECT name FROM members WHERE name = ? OR (name LIKE ? ESCAPE '\\' AND name LIKE ? ESCAPE '\\')",
+            (filename, _like(base) + "\\_%", "%" + _like(ext)))}
+        unique = filename
+        counter = 1
+        while unique in taken or unique in others:
+            unique = f"{base}_{counter}{ext}"
+            counter += 1
+        return unique
+
+    # Writes the file at path into the container of the day under a unique name (the file itself is left in place).
+    # file - the xlsx file it belongs to (its name in "To_process"/"Invalid_files"), the member name if None.
+    # message - member name of the msg file an archived attachment came with. Returns the member name.
+    def add(self, path, filename, file=None, nip=None, status=TO_PROCESS, message=None):
+        now = datetime.now()
+        archive = self.container(f"{now:%Y-%m-%d}")
+        size = os.path.getsize(path)
+        name = self.unique_name(filename)
+        # Written by an interrupted run, but not indexed - the same file is only indexed now
+        written = self.orphans.get(name) == (_crc(path), size)
+        if not written:
+            name = self.unique_name(filename, self.names)
+        with self.conn:
+            self.conn.execute("INSERT INTO members (name, archive, file, nip, status, added, size, message) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (name, archive, file or name, nip or None, status, now.strftime("%Y-%m-%d %H:%M:%S"),
+                               size, message))
+            if written:
+                del self.orphans[name]
+            else:
+                with zipfile.ZipFile(os.path.join(self.folder, archive), "a", zipfile.ZIP_DEFLATED) as zf:
+                    zf.write(path, name)
+                self.names.add(name)
+        return name
+
+    # Name of the container of the day to add to: the last one, or a new one once it holds max_members files
+    def container(self, day):
+        if day != self.day:
+            self.day = day
+            numbers = [_container_number(day, name) for name in os.listdir(self.folder)]
+            self.use_container(_container_name(day, max([n for n in numbers if n is not None], default=0)))
+        if len(self.names) >= self.max_members:
+            self.use_container(_container_name(day, _container_number(day, self.archive) + 1))
+        return self.archive
+
+    # Notes the members of a container, and those without an index entry
+    def use_container(self, archive):
+        self.archive = archive
+        self.names, self.orphans = set(), {}
+        path = os.path.join(self.folder, archive)
+        if not os.path.exists(path):
+            return
+        indexed = {name for (name,) in self.conn.execute("SELECT name FROM members WHERE archive = ?", (archive,))}
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                self.names.add(info.filename)
+                if info.filename not in indexed:
+                    self.orphans[info.filename] = (info.CRC, info.file_size)
+
+    # Script 3 handled the xlsx file: the latest member still waiting with it gets the new status
+    # (instead of the msg file being moved). Returns the member name, None if there is none.
+    # current - status of the member to change (INVALID when a rejected file is taken back by the invalid recheck)
+    def mark(self, file, status, current=TO_PROCESS):
+        row = self.conn.execute("SELECT name FROM members WHERE file = ? AND status = ? ORDER BY rowid DESC LIMIT 1",
+                                (file, current)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE members SET status = ? WHERE name = ?", (status, row[0]))
+        return row[0]
+
+    # Members by member name, xlsx file name (either with or without the extension) or NIP, with the msg file
+    # an archived attachment came with and the attachments archived with a msg file, oldest first:
+    # dicts with name, archive, file, nip, status, added, size, message
+    def find(self, name=None, nip=None):
+        conditions, params = [], []
+        if name:
+            stem = os.path.splitext(name)[0]
+            conditions.append("(name = ? OR file = ? OR file LIKE ? ESCAPE '\\')")
+            params += [name, name, _like(stem) + ".%"]
+        if nip:
+            conditions.append("nip = ?")
+            params.append(nip)
+        where = " AND ".join(conditions) or "1"
+        cursor = self.conn.execute(
+            f"SELECT * FROM members WHERE {where} OR name IN (SELECT message FROM members WHERE {where}) "
+            f"OR message IN (SELECT name FROM members WHERE {where}) ORDER BY rowid", params * 3)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    # Copies a member out of its container into folder; returns the path
+    def extract(self, member, folder):
+        with zipfile.ZipFile(os.path.join(self.folder, member['archive'])) as zf:
+            return zf.extract(member['name'], folder)
+
+    def close(self):
+        self.conn.close()
+
+
+def _crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+# "<day>.zip", "<day>_1.zip", "<day>_2.zip"...
+def _container_name(day, number):
+    return f"{day}_{number}.zip" if number else f"{day}.zip"
+
+# Number of a container of the day (None for other files)
+def _container_number(day, name):
+    if name == f"{day}.zip":
+        return 0
+    number = name[len(day) + 1:-4]
+    if name.startswith(day + "_") and name.endswith(".zip") and number.isdigit():
+        return int(number)
+    return None
+
+# name as a LIKE pattern matching only itself
+def _like(name):
+    return name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# "msg_archive": true in config.json turns the archive on ("<processing_location>/Archive")
+def open_msg_archive(config):
+    if not config.get("msg_archive", False):
+        return None
+    return MsgArchive(os.path.join(config.get("processing_location"), "Archive"),
+                      int(config.get("msg_archive_members", 500)))
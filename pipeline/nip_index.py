@@ -0,0 +1,94 @@
+import os #for file stats and paths
+import json #for the index file
+import hashlib #for the content hash of the master file
+from pipeline.supplier_file import clean_nip
+
+# Columns with NIPs (in this case - primary keys) and starting rows in each sheet of the master file
+NIP_COLUMNS = {'data1': ('F', 3), 'data2': ('H', 3)}
+
+
+def file_key(path, digest=True):
+    st = os.stat(path)
+    key = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    if digest:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        key["sha256"] = sha.hexdigest()
+    return key
+
+# True if the master file is still the one described by key (a file_key saved with an index):
+# the same size and modification time - or, if those changed, the same SHA-256 of its content
+def master_unchanged(master_path, key):
+    current = file_key(master_path, digest=False)
+    if (key.get("size"), key.get("mtime")) != (current["size"], current["mtime"]):
+        return key.get("sha256") == file_key(master_path)["sha256"]
+    return True
+
+# Creates map of NIPs to rows from {row: value} of the NIP column.
+# The last row wins (as before), other rows with the same cleaned NIP are reported as duplicates.
+def build_nip_map(values):
+    mapping = {}
+    duplicates = {}
+    for row, val in sorted(values.items()):
+        if val:
+            nip_clean = clean_nip(val)
+            if nip_clean:
+                if nip_clean in mapping:
+                    duplicates.setdefault(nip_clean, [mapping[nip_clean]]).append(row)
+                mapping[nip_clean] = row
+    return mapping, duplicates
+
+
+# NIP -> row maps of data1/data2 saved next to the master file ("<master>.nip_index.json").
+# The index is valid while the master file has the same size and modification time - or, if those changed,
+# the same SHA-256 of its content. Any other change of the master means a rebuild.
+class NipIndex:
+    def __init__(self, master_path, index_path=None):
+        self.master_path = master_path
+        self.index_path = index_path or master_path + ".nip_index.json"
+        self.maps = {}
+        self.duplicates = {}
+
+    # Returns True if a valid index was loaded
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not master_unchanged(self.master_path, stored.get("master", {})):
+            return False
+        self.maps = {sheet: {nip: int(row) for nip, row in rows.items()} for sheet, rows in stored["maps"].items()}
+        self.duplicates = stored.get("duplicates", {})
+        return set(self.maps) == set(NIP_COLUMNS)
+
+    # Scans the NIP columns of the master (an object from pipeline.master)
+    def build(self, master):
+        self.maps = {}
+        self.duplicates = {}
+        for sheet, (column, start_row) in NIP_COLUMNS.items():
+            mapping, duplicates = build_nip_map(master.column(sheet, column, start_row))
+            self.maps[sheet] = mapping
+            if duplicates:
+                self.duplicates[sheet] = duplicates
+
+    def duplicate_messages(self):
+        for sheet, duplicates in self.duplicates.items():
+            for nip, rows in duplicates.items():
+                yield (f"⚠️ NIP {nip} is in rows {', '.join(map(str, rows))} of {sheet} - "
+                       f"only row {rows[-1]} is updated")
+
+    # Saves the index for the current state of the master file (call it after the master is saved -
+    # the processing doesn't change the NIP columns, so the maps stay valid). Returns the key of the master file.
+    def save(self):
+        key = file_key(self.master_path)
+        stored = {"master": key, "maps": self.maps, "duplicates": self.duplicates}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, self.index_path)
+        return key
@@ -0,0 +1,48 @@
+import numpy as np #for working on the whole offer sheet at once
+
+# Layout of the master file: "x" marks start in column 25 (Y) of data1, three service columns per category
+START_COL = 25
+SERVICE_COLUMNS = [(2, 3), (4, 5), (6, 7)]  # (service name, "x") pairs - C/D, E/F, G/H
+FIRST_ROW = 2  # categories start in row 3 of the "offer" sheet
+MAX_CATEGORIES = 190
+
+_SERVICE_IDX = [service for service, _ in SERVICE_COLUMNS]
+_X_IDX = [x for _, x in SERVICE_COLUMNS]
+_SERVICE_OFFSETS = np.arange(len(SERVICE_COLUMNS))
+
+
+def _stripped(cells):
+    # str(value).strip() for every cell of an object array
+    return np.char.strip(cells.astype(str))
+
+# Checks the whole "offer" sheet in one go. Rows are equal-length tuples of values from column A to H.
+# Returns:
+#   missing_x       - no "x" anywhere in D/F/H (supplier chose no services)
+#   empty_category  - an "x" next to an empty ("-") category
+#   marks           - data1 column numbers that get an "x" for rows 3-192, in the order
+#                     D column first, then F, then H (start_col + i + idx * 3)
+# Gives exactly the same answers as checking str(value).strip().lower() cell by cell:
+# only "x" and "X" lower-case to "x", so the (slow) lower-casing is skipped, and only
+# filled cells are turned into text.
+def evaluate_offer(rows):
+    if not rows:
+        return True, False, np.empty(0, dtype=np.int64)
+    columns = list(zip(*rows))
+    x_cells = np.array([columns[i] for i in _X_IDX], dtype=object)
+    filled = x_cells != None # elementwise on object arrays
+    x = np.zeros(x_cells.shape, dtype=bool)
+    if filled.any():
+        text = _stripped(x_cells[filled])
+        x[filled] = (text == 'x') | (text == 'X')
+
+    missing_x = not x.any()
+    empty_category = False
+    if not missing_x:
+        # The service name only matters next to an "x"
+        services = np.array([columns[i] for i in _SERVICE_IDX], dtype=object)
+        empty_category = bool((_stripped(services[x]) == '-').any())
+
+    # Rows of x are the service columns, so np.nonzero lists the marks column after column like the original loop
+    service, idx = np.nonzero(x[:, FIRST_ROW:FIRST_ROW + MAX_CATEGORIES])
+    marks = START_COL + _SERVICE_OFFSETS[service] + idx * 3
+    return missing_x, empty_category, marks
@@ -0,0 +1,170 @@
+import os #for the index file
+import json #for the header of the index file
+import struct #for the header length
+import numpy as np #for the bitsets
+from pipeline.offer_engine import START_COL, SERVICE_COLUMNS #for the layout of the "x" columns
+from pipeline.nip_index import NIP_COLUMNS, build_nip_map, file_key, master_unchanged #for the rows of data1
+from pipeline.xlsx_probe import read_columns #for building the index from the saved master file
+
+# "x" columns of data1 (25-804): three service columns per category, category after category
+LAST_COL = 804
+BITS = LAST_COL - START_COL + 1
+CATEGORIES = BITS // len(SERVICE_COLUMNS)
+ROW_BYTES = (BITS + 7) // 8
+# Services are named after their "x" column in the "offer" sheet (D, F, H)
+SERVICES = tuple(chr(ord('A') + x) for _, x in SERVICE_COLUMNS)
+FILE_COLUMN = 805  # name of the file each row was last filled from
+MAGIC = b"OFFIDX1\n"
+
+
+# data1 column of category k (1 = the first category, row 3 of the "offer" sheet) in service column D/F/H
+def offer_column(category, service):
+    if not 1 <= category <= CATEGORIES:
+        raise ValueError(f"category {category} is not in 1-{CATEGORIES}")
+    return START_COL + (category - 1) * len(SERVICE_COLUMNS) + SERVICES.index(service.upper())
+
+# ...and back: "12F" for a data1 column
+def offer_term(col):
+    bit = col - START_COL
+    return f"{bit // len(SERVICES) + 1}{SERVICES[bit % len(SERVICES)]}"
+
+# "12F" - category 12 in service column F, "12" - category 12 in any service column.
+# Returns the data1 columns of the term (a supplier matches it if any of them has an "x").
+def parse_term(term):
+    term = term.strip().upper()
+    if term[-1:] in SERVICES:
+        return [offer_column(int(term[:-1]), term[-1])]
+    return [offer_column(int(term), service) for service in SERVICES]
+
+
+# The "x" marks of data1 as one bitset per supplier row (bit i = column 25 + i), keyed by cleaned NIP and saved
+# next to the master file ("<master>.offer_index.bin"): a JSON header (master file key, NIPs, rows, file names)
+# followed by the bitsets, ROW_BYTES per row. Like the NIP index, it's valid while the master file doesn't change -
+# script 3 updates it as it writes rows and saves it with the master file; otherwise it's built again from
+# the saved master file (only the NIP column and columns 25-805 of data1 are read).
+class OfferIndex:
+    def __init__(self, master_path, index_path=None):
+        self.master_path = master_path
+        self.index_path = index_path or master_path + ".offer_index.bin"
+        self.nips = []
+        self.rows = []
+        self.names = []
+        self.positions = {}
+        self.bits = np.zeros((0, ROW_BYTES), dtype=np.uint8)
+
+    # Returns True if a valid index was loaded
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return False
+                (length,) = struct.unpack("<I", f.read(4))
+                header = json.loads(f.read(length).decode("utf-8"))
+                bits = np.frombuffer(f.read(), dtype=np.uint8)
+        except (OSError, ValueError, struct.error):
+            return False
+        if not master_unchanged(self.master_path, header.get("master", {})):
+            return False
+        if bits.size != len(header["nips"]) * ROW_BYTES:
+            return False
+        self.nips, self.rows, self.names = header["nips"], header["rows"], header["names"]
+        self.positions = {nip: i for i, nip in enumerate(self.nips)}
+        self.bits = bits.reshape(len(self.nips), ROW_BYTES).copy()
+        return True
+
+    # Reads data1 of the saved master file
+    def build(self):
+        nip_column, start_row = NIP_COLUMNS['data1']
+        columns = read_columns(self.master_path, 'data1', [nip_column] + list(range(START_COL, FILE_COLUMN + 1)),
+                               min_row=start_row)
+        mapping, _ = build_nip_map(columns[nip_column])
+        self.nips = list(mapping)
+        self.rows = [mapping[nip] for nip in self.nips]
+        self.names = [str(columns[FILE_COLUMN].get(row) or "") for row in self.rows]
+        self.positions = {nip: i for i, nip in enumerate(self.nips)}
+        marks = np.zeros((len(self.nips), BITS), dtype=bool)
+        for col in range(START_COL, LAST_COL + 1):
+            values = columns[col]
+            for i, row in enumerate(self.rows):
+                value = values.get(row)
+                if value is not None and str(value).strip().lower() == 'x':
+                    marks[i, col - START_COL] = True
+        self.bits = np.packbits(marks, axis=1, bitorder='little')
+
+    # A row was written by script 3: its marks are replaced (like columns 25-804 of the row)
+    def set_row(self, nip, row, marks, name):
+        i = self.positions.get(nip)
+        if i is None:
+            i = len(self.nips)
+            self.positions[nip] = i
+            self.nips.append(nip)
+            self.rows.append(row)
+            self.names.append(name)
+            self.bits = np.vstack([self.bits, np.zeros((1, ROW_BYTES), dtype=np.uint8)])
+        row_marks = np.zeros(BITS, dtype=bool)
+        row_marks[np.asarray(marks, dtype=np.int64) - START_COL] = True
+        self.bits[i] = np.packbits(row_marks, bitorder='little')
+        self.rows[i] = row
+        self.names[i] = name
+
+    # Saves the index for the saved master file (key - its file_key, if it's already known)
+    def save(self, key=None):
+        header = {"master": key or file_key(self.master_path), "nips": self.nips, "rows": self.rows,
+                  "names": self.names}
+        header = json.dumps(header).encode("utf-8")
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+            f.write(np.ascontiguousarray(self.bits).tobytes())
+        os.replace(tmp_path, self.index_path)
+
+    # Suppliers with an "x" in data1 column col (boolean array, one value per supplier)
+    def _column(self, col):
+        bit = col - START_COL
+        return (self.bits[:, bit >> 3] >> (bit & 7)) & 1 == 1
+
+    def _term(self, columns):
+        found = self._column(columns[0])
+        for col in columns[1:]:
+            found |= self._column(col)
+        return found
+
+    # Suppliers matching every term of all_of and at least one term of any_of (terms - lists of data1 columns,
+    # see parse_term). Returns a boolean array, one value per supplier.
+    def match(self, all_of=(), any_of=()):
+        found = np.ones(len(self.nips), dtype=bool)
+        for columns in all_of:
+            found &= self._term(columns)
+        if any_of:
+            some = np.zeros(len(self.nips), dtype=bool)
+            for columns in any_of:
+                some |= self._term(columns)
+            found &= some
+        return found
+
+    def count(self, all_of=(), any_of=()):
+        return int(self.match(all_of, any_of).sum())
+
+    # (NIP, data1 row, file name) of the matching suppliers, in row order
+    def suppliers(self, all_of=(), any_of=()):
+        found = np.flatnonzero(self.match(all_of, any_of))
+        return sorted(((self.nips[i], self.rows[i], self.names[i]) for i in found), key=lambda supplier: supplier[1])
+
+    # Offer of one supplier as "12F"-style terms
+    def offers(self, nip):
+        i = self.positions.get(nip)
+        if i is None:
+            return None
+        bits = np.flatnonzero(np.unpackbits(self.bits[i], count=BITS, bitorder='little'))
+        return [offer_term(START_COL + bit) for bit in bits]
+
+
+# Loads the index, or builds it from the saved master file (and saves it) if the master file changed
+def open_offer_index(master_path):
+    offer_index = OfferIndex(master_path)
+    if not offer_index.load():
+        offer_index.build()
+        offer_index.save()
+    return offer_index
@@ -0,0 +1,757 @@
+import os #for creating file paths
+import time #for timing the parsing
+import json #for the change report
+import shutil #for moving files between folders
+import signal #for saving the last batch of the --watch mode without being stopped again
+import itertools #for reading the parsed records in batches
+from datetime import datetime #for timestamps
+from concurrent.futures import ProcessPoolExecutor #for parsing supplier files in parallel
+from pipeline.supplier_file import parse_supplier_file, record_content, record_for_file, DATA_MAPPING #for parsing and validating supplier files
+from pipeline.master import open_master, same_value #for reading and updating the master file
+from pipeline.nip_index import NipIndex, NIP_COLUMNS, file_key #for the saved NIP -> row maps of the master file
+from pipeline.watcher import DirectoryWatcher, StableFiles #for the --watch mode
+from pipeline.invalid_log import InvalidLog #for the invalid files journal shared with script 2
+from pipeline.verdict_cache import open_verdict_cache, file_digest, RECORD #for the parsed records of files seen before
+from pipeline.update_journal import UpdateJournal #for the updates not saved to the master file yet
+from pipeline.offer_index import OfferIndex, offer_term #for the "x" marks of data1 as bitsets (query_offers.py)
+from pipeline.msg_archive import open_msg_archive, TO_PROCESS, PROCESSED, INVALID #for the msg files kept in the archive by script 2
+from pipeline.master_shards import ShardLayout, ShardedMaster, ShardedNipIndex #for the master file split into shards
+from pipeline.master_db import DatabaseNipIndex, database_path #for the NIP maps and the file of the "sqlite" master writer
+
+MASTER_COLUMNS = {'data1': [805]}  # name of the file each row was last filled from
+OFFER_COLUMNS = range(25, 805)  # "x" columns of data1
+DATA_CELLS = {col: cell for cell, col in DATA_MAPPING.items()}  # data2 column -> "DATA" sheet cell
+
+
+# Parses one file and notes how long it took and how many bytes were read (also in worker processes)
+def parse_timed(path):
+    start = time.perf_counter()
+    record = parse_supplier_file(path)
+    record['parse_seconds'] = time.perf_counter() - start
+    record['bytes_read'] = os.path.getsize(path) if os.path.exists(path) else 0
+    return record
+
+
+# Once the --watch mode is stopping, SIGTERM is ignored (only possible in the main thread)
+def ignore_sigterm():
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    except (ValueError, AttributeError):
+        pass
+
+
+# The processing stage (script 3): writes the supplier files from "To_process" to the master file.
+# Valid files go to "Processed", invalid ones to "Invalid_files" (with their msg files).
+# run_log - where log_error() writes (log.txt), metrics - timers and counters of the run.
+class Processing:
+    def __init__(self, config, metrics, run_log):
+        self.config = config
+        self.metrics = metrics
+        self.run_log = run_log
+        folder_base = config.get("processing_location")
+        self.supplier_file = config.get("supplier_file_location")
+
+        self.folder_to_process = os.path.join(folder_base, 'To_process')
+        self.folder_invalid = os.path.join(folder_base, 'Invalid_files')
+        self.folder_processed = os.path.join(folder_base, 'Processed')
+        self.folder_processed_msg = os.path.join(self.folder_processed, 'Processed_msg')
+        self.invalid_db_path = os.path.join(folder_base, 'invalid_log.db')
+        self.invalid_xlsx_path = os.path.join(self.folder_invalid, '0.Invalid.xlsx') # A path to an xlsx file saving info about all the invalid files
+        self.verdict_cache_path = os.path.join(folder_base, 'verdict_cache.db')
+        self.journal_path = os.path.join(folder_base, 'update_journal.db')
+
+        # Number of processes parsing the supplier files - 1 keeps everything in this process.
+        # The master file is always written by this process only, file after file in name order.
+        self.workers = int(config.get("processing_workers", 1))
+
+        # How the master file is updated:
+        # "openpyxl" - loaded and saved as a whole (default)
+        # "patch" - only the columns below are read, and only the changed rows are rewritten on save
+        # "sqlite" - the supplier rows are kept in "<master file>.db" (see pipeline/master_db.py) and the master file
+        #            is only written by export_master.py, so the script never waits for Excel
+        self.master_writer = config.get("master_writer", "openpyxl")
+        self.uses_database = self.master_writer == "sqlite"
+
+        # With "sharded_master": true the suppliers are kept in the shards made by master_shards.py split
+        # (see pipeline/master_shards.py): only the shards with rows to write are loaded and saved.
+        # master_shards.py merge rebuilds the master file.
+        self.shard_layout = None
+        if config.get("sharded_master", False):
+            self.shard_layout = ShardLayout(self.supplier_file)
+            if not self.shard_layout.exists():
+                raise FileNotFoundError(f"{self.shard_layout.layout_path} not found - run master_shards.py split first")
+            self.shard_layout.load()
+
+        # The master file is saved (and the files written to it moved to "Processed") every "checkpoint_files" files
+        # or "checkpoint_seconds" after the last save, whichever comes first, and at the end of the run.
+        # Until then the updates are kept in "update_journal.db", so a crash loses nothing.
+        # With "master_writer": "sqlite" a save is one transaction, so by default every file is saved on its own.
+        self.checkpoint_files = int(config.get("checkpoint_files", 1 if self.uses_database else 500))
+        self.checkpoint_seconds = float(config.get("checkpoint_seconds", 300))
+
+        # --watch mode: the master file stays loaded and is saved after "watch_batch_size" processed files
+        # or "watch_flush_seconds" after the first unsaved one, whichever comes first.
+        # New files are picked up once they haven't changed for "watch_settle_seconds".
+        self.watch_batch_size = int(config.get("watch_batch_size", 50))
+        self.watch_flush_seconds = float(config.get("watch_flush_seconds", 30))
+        self.watch_settle_seconds = float(config.get("watch_settle_seconds", 2))
+
+        # "<master file>.offer_index.bin" (see query_offers.py) is kept up to date with the rows written here,
+        # as long as it was valid for the loaded master file ("offer_index": false turns it off).
+        # A missing or outdated index is not rebuilt here - query_offers.py does that when it's used.
+        self.use_offer_index = bool(config.get("offer_index", True))
+        self.offer_index = None
+
+        # What changed in the rows of suppliers sending their file again is appended to "change_report_file"
+        # (JSON lines, default "changes.jsonl", "" turns it off) when the master file is saved
+        change_report = config.get("change_report_file", "changes.jsonl")
+        self.change_report_path = os.path.join(folder_base, change_report) if change_report else None
+        self.changes = []
+
+        # With "msg_archive": true script 2 keeps the msg files in "Archive/<day>.zip" - they are not moved here,
+        # only their status in the archive index is changed (opened by process() and watch())
+        self.msg_archive = None
+
+        os.makedirs(self.folder_processed_msg, exist_ok=True)
+
+    # Possible errors are listed in pipeline/supplier_file.py - they are logged here.
+    # Lines are written to log.txt in batches (at the end of the run, before every prompt and when the script ends).
+    def log_error(self, msg):
+        self.run_log.write(msg)
+        print(msg)
+
+    # As the stakeholder requires both msg file and its attachments to be saved,
+    # we ensure that msg files are always following xlsx files with the same name
+    def move_msg(self, xlsx_name, target_folder):
+        if self.msg_archive:
+            status = INVALID if target_folder == self.folder_invalid else PROCESSED
+            msg_name = self.msg_archive.mark(xlsx_name, status)
+            if msg_name:
+                print(f"📬 MSG file {msg_name} marked as {status} in the archive")
+                return
+        msg_name = os.path.splitext(xlsx_name)[0] + ".msg"
+        msg_path = os.path.join(self.folder_to_process, msg_name)
+        if os.path.exists(msg_path):
+            try:
+                shutil.move(msg_path, os.path.join(target_folder, msg_name))
+                self.metrics.add('files_moved', file=xlsx_name)
+                print(f"📬 Moved MSG file: {msg_name}")
+            except Exception as e:
+                self.log_error(f"❗ Error moving MSG file {msg_name}: {e}")
+
+    def close_msg_archive(self):
+        if self.msg_archive:
+            self.msg_archive.close()
+            self.msg_archive = None
+
+    # Parses the files in worker processes if "processing_workers" > 1 (in name order either way)
+    def parse_paths(self, paths):
+        if self.workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                yield from executor.map(parse_timed, paths, chunksize=max(1, len(paths) // (self.workers * 4)))
+        else:
+            for path in paths:
+                with self.metrics.profiled(os.path.basename(path)):
+                    record = parse_timed(path)
+                yield record
+
+    # Parsed records come back in the same (name) order the files were given in, whatever the number of workers.
+    # A file with the same content (SHA-256) as one parsed before is not opened - its record comes from the
+    # verdict cache ("verdict_cache.db", shared with script 2; size in MB set by "verdict_cache_mb", 0 - off).
+    # records - {path: record} of files already parsed (handed over by the download stage in the pipeline runner)
+    def parse_files(self, paths, verdict_cache=None, records=None):
+        metrics = self.metrics
+        digests = {}
+        cached = {}
+        for path in paths:
+            if records and path in records:
+                cached[path] = records[path]
+                metrics.add('handed_over', file=cached[path]['file'])
+            elif verdict_cache:
+                file = os.path.basename(path)
+                with metrics.phase('cache_lookup', file):
+                    try:
+                        digests[path] = file_digest(path)
+                    except OSError:
+                        continue
+                    content = verdict_cache.get(digests[path], RECORD)
+                if content is not None:
+                    cached[path] = record_for_file(content, path)
+                    metrics.add('cache_hits', file=file)
+
+        parsed = self.parse_paths([path for path in paths if path not in cached])
+        for path in paths:
+            if path in cached:
+                record = cached[path]
+                metrics.add('files_parsed', file=record['file'])
+                yield record
+                continue
+            record = self.count_parse(next(parsed))
+            if path in digests:
+                verdict_cache.put(digests[path], RECORD, record_content(record))
+            yield record
+
+    def count_parse(self, record):
+        self.metrics.add_time('parse', record.pop('parse_seconds'), record['file'])
+        self.metrics.add('bytes_read', record.pop('bytes_read'), record['file'])
+        self.metrics.add('files_parsed', file=record['file'])
+        return record
+
+    # Opens the master file with its NIP -> row maps.
+    # The maps are saved next to the master file and reused while the master file doesn't change.
+    # Otherwise the NIP columns are read again (and NIPs found in more than one row are reported).
+    def load_master(self):
+        if self.shard_layout:
+            return self.load_shards()
+        # The database has its NIP columns indexed - the maps are built from it every time
+        nip_index = (DatabaseNipIndex if self.uses_database else NipIndex)(self.supplier_file)
+        index_cached = nip_index.load()
+        columns = dict(MASTER_COLUMNS)
+        if not index_cached:
+            for sheet, (nip_column, _) in NIP_COLUMNS.items():
+                columns[sheet] = columns.get(sheet, []) + [nip_column]
+
+        # Loads supplier workbook without removing existing macros
+        master = open_master(self.supplier_file, self.master_writer, columns)
+
+        if not index_cached:
+            nip_index.build(master)
+            for message in nip_index.duplicate_messages():
+                self.log_error(message)
+
+        self.offer_index = None
+        if self.use_offer_index and not self.uses_database:
+            offer_index = OfferIndex(self.supplier_file)
+            if offer_index.load():
+                self.offer_index = offer_index
+        return master, nip_index
+
+    # Sharded master: only the NIP maps of the shards are loaded here, the shards themselves when their rows are used.
+    # The offer index (query_offers.py) belongs to the merged master file - it is not kept up to date here.
+    def load_shards(self):
+        nip_index = ShardedNipIndex(self.shard_layout)
+        if not nip_index.load():
+            for message in nip_index.duplicate_messages():
+                self.log_error(message)
+        master = ShardedMaster(self.shard_layout, self.master_writer, MASTER_COLUMNS, nip_index)
+        self.offer_index = None
+        return master, nip_index
+
+    # Size and modification time of the master file (of every shard) - to notice changes made outside of the script
+    def master_key(self):
+        if self.shard_layout:
+            return [file_key(path, digest=False) for path in self.shard_layout.paths]
+        return file_key(self.supplier_file, digest=False)
+
+    # Invalid files are moved to "Invalid_files" folder (with their msg file) and an entry is appended to the invalid files journal.
+    # The record of the file, as parsed, is kept in the journal too (see recheck_invalid).
+    def reject(self, record, reason, message, invalid_log, timestamp):
+        file = record['file']
+        content = record_content(record)
+        record.update(status='invalid', reason=reason)
+        self.log_error(message)
+        with self.metrics.phase('invalid_log', file):
+            invalid_log.add(record['supplier_name'], reason, record['nip'], "Excel update", timestamp)
+            invalid_log.add_payload(file, record['nip'], reason, content, timestamp)
+        with self.metrics.phase('file_moves', file):
+            shutil.move(os.path.join(self.folder_to_process, file), os.path.join(self.folder_invalid, file))
+            self.metrics.add('files_moved', file=file)
+            self.move_msg(file, self.folder_invalid)
+
+    # Writes one parsed file to the master file. Returns True if it was written -
+    # otherwise the file was rejected (and already moved to "Invalid_files").
+    def apply_record(self, record, master, nip_index, invalid_log, timestamp):
+        metrics = self.metrics
+        file = record['file']
+        if record['status'] != 'ok':
+            self.reject(record, record['reason'], record['message'], invalid_log, timestamp)
+            return False
+
+        nip_clean = record['nip']
+        with metrics.phase('nip_lookup', file):
+            row_data = nip_index.maps['data1'].get(nip_clean)
+            row_suppliers = nip_index.maps['data2'].get(nip_clean)
+
+        if not row_data or not row_suppliers:
+            self.reject(record, 'Missing/invalid NIP', f"❌ {file} - error: Missing/invalid NIP", invalid_log, timestamp)
+            return False
+
+        # Checks if the row was already filled (based on entry in column 805 not being empty)
+        # Column 805 contains the name of the xlsx file from which data was extracted in the particular row.
+        # If the row was already filled, only the cells that changed are written (see update_row).
+        with metrics.phase('master_write', file):
+            prev_file = master.get('data1', row_data, 805)
+            if prev_file:
+                return self.update_row(record, master, row_data, row_suppliers, prev_file, timestamp)
+
+            # Copies "x" values to master file (each service column fills every 3rd cell)
+            for col_index in record['marks']:
+                master.set('data1', row_data, col_index, 'x')
+
+            # Fills in the "Suppliers DATA" sheet in the master file (from "DATA" sheet in processed files)
+            for dest_col, val in record['data'].items():
+                master.set('data2', row_suppliers, dest_col, val)
+
+            # Saves the name of the processed file in column 805
+            master.set('data1', row_data, 805, record['supplier_name'])
+            metrics.add('cells_written', len(record['marks']) + len(record['data']) + 1, file)
+            if self.offer_index is not None:
+                self.offer_index.set_row(nip_clean, row_data, record['marks'], record['supplier_name'])
+        return True
+
+    # A supplier sent the file again: the new offer and "DATA" values are compared with the row and only the changed
+    # cells are written ("x" cells that are not in the new offer are emptied, as before). If nothing changed,
+    # the row is not touched at all (column 805 keeps the name of the earlier file). Either way the changes are
+    # logged and added to the change report. Returns True (the file is moved to "Processed").
+    def update_row(self, record, master, row_data, row_suppliers, prev_file, timestamp):
+        file = record['file']
+        old_offer, offer_writes, old_data, data_writes = self.row_writes(record, master, row_data, row_suppliers)
+        new_marks = {int(col) for col in record['marks']}
+        old_marks = {col for col, old in old_offer.items() if old is not None and str(old).strip().lower() == 'x'}
+
+        added = [offer_term(col) for col in sorted(new_marks - old_marks)]
+        removed = [offer_term(col) for col in sorted(old_marks - new_marks)]
+        change = {"timestamp": timestamp, "file": record['supplier_name'], "nip": record['nip'], "row": row_data,
+                  "previous": prev_file, "added": added, "removed": removed,
+                  "changed": {col: {"cell": DATA_CELLS.get(col), "old": old_data[col], "new": val}
+                              for col, val in data_writes.items()}}
+
+        if not offer_writes and not data_writes:
+            change["unchanged"] = True
+            self.changes.append(change)
+            self.metrics.add('unchanged', file=file)
+            self.log_error(f"⏭️ {file} - no changes since {prev_file}, row {row_data} was not written")
+            return True
+
+        self.log_error(f"🔁 Row {row_data} was overwritten (previously: {prev_file})")
+        self.log_error(f"📝 {record['supplier_name']}: {self.describe_change(change)}")
+        for col, val in offer_writes.items():
+            master.set('data1', row_data, col, val)
+        for dest_col, val in data_writes.items():
+            master.set('data2', row_suppliers, dest_col, val)
+        master.set('data1', row_data, 805, record['supplier_name'])
+        self.changes.append(change)
+        self.metrics.add('cells_written', len(offer_writes) + len(data_writes) + 1, file)
+        if self.offer_index is not None:
+            self.offer_index.set_row(record['nip'], row_data, record['marks'], record['supplier_name'])
+        return True
+
+    # Compares a record with its rows of the master file: returns the current offer cells and the ones the record
+    # changes (column -> "x" or None), the current "DATA" values and the ones the record changes
+    @staticmethod
+    def row_writes(record, master, row_data, row_suppliers):
+        old_offer = master.row('data1', row_data, OFFER_COLUMNS)
+        new_marks = {int(col) for col in record['marks']}
+        offer_writes = {}
+        for col, old in old_offer.items():
+            new = 'x' if col in new_marks else None
+            if old != new:
+                offer_writes[col] = new
+        old_data = master.row('data2', row_suppliers, list(record['data']))
+        data_writes = {col: val for col, val in record['data'].items() if not same_value(old_data[col], val)}
+        return old_offer, offer_writes, old_data, data_writes
+
+    # True if the saved master file already has what the record writes (its name in column 805 and the same cells) -
+    # a run that crashed after saving the master file but before marking its journal entries as saved
+    def already_written(self, record, master, nip_index):
+        if record['status'] != 'ok':
+            return False
+        row_data = nip_index.maps['data1'].get(record['nip'])
+        row_suppliers = nip_index.maps['data2'].get(record['nip'])
+        if not row_data or not row_suppliers or master.get('data1', row_data, 805) != record['supplier_name']:
+            return False
+        _, offer_writes, _, data_writes = self.row_writes(record, master, row_data, row_suppliers)
+        return not offer_writes and not data_writes
+
+    # "+2 categories (12F, 30D), -1 (5H), 1 field changed (D - DATA!C3)" - at most 10 categories each
+    @staticmethod
+    def describe_change(change):
+        def terms(found):
+            listed = ", ".join(found[:10]) + (", ..." if len(found) > 10 else "")
+            return f" ({listed})" if found else ""
+        parts = []
+        if change["added"] or change["removed"]:
+            parts.append(f"+{len(change['added'])} categories{terms(change['added'])}, "
+                         f"-{len(change['removed'])}{terms(change['removed'])}")
+        if change["changed"]:
+            fields = ", ".join(f"{col} - DATA!{field['cell']}" for col, field in change["changed"].items())
+            parts.append(f"{len(change['changed'])} field(s) changed ({fields})")
+        return "; ".join(parts) or 'only the "x" cells were cleaned up'
+
+    # Reads the rows that the records (files sent again) will update in one go - with "master_writer": "patch"
+    # only a few columns of the master file are loaded, so the rows are read from the sheet XML.
+    # With a sharded master the shards of all the records are loaded first, at the same time.
+    def prefetch_rows(self, records, master, nip_index):
+        rows = [(nip_index.maps['data1'].get(record['nip']), nip_index.maps['data2'].get(record['nip']))
+                for record in records if record['status'] == 'ok']
+        rows = [(row_data, row_suppliers) for row_data, row_suppliers in rows if row_data and row_suppliers]
+        with self.metrics.phase('shard_load'):
+            master.open_rows('data1', [row_data for row_data, _ in rows])
+        rows_data, rows_suppliers = set(), set()
+        for row_data, row_suppliers in rows:
+            if master.get('data1', row_data, 805):
+                rows_data.add(row_data)
+                rows_suppliers.add(row_suppliers)
+        if rows_data:
+            with self.metrics.phase('row_read'):
+                master.prefetch('data1', rows_data, OFFER_COLUMNS)
+                master.prefetch('data2', rows_suppliers, DATA_CELLS)
+
+    # The change report of the rows in the saved master file
+    def write_changes(self):
+        if self.change_report_path and self.changes:
+            with open(self.change_report_path, "a", encoding="utf-8") as f:
+                for change in self.changes:
+                    f.write(json.dumps(change, ensure_ascii=False, default=str) + "\n")
+        self.changes = []
+
+    # Moves the processed xlsx file (and the msg file) to "Processed" folder.
+    def finish_processed(self, file):
+        with self.metrics.phase('file_moves', file):
+            shutil.move(os.path.join(self.folder_to_process, file), os.path.join(self.folder_processed, file))
+            self.metrics.add('files_moved', file=file)
+            self.move_msg(file, self.folder_processed_msg)
+        self.log_error(f"✅ {file} successfully processed and saved to Excel.")
+
+    # If there are any new entries about invalid files, "0.Invalid.xlsx" is regenerated from the journal
+    # (one row per file name - the latest entry - newest first).
+    # Info includes: Name of the file; Type of error; NIP; Script used (in case of this script it's "Excel update"); Timestamp.
+    def save_invalid_entries(self, invalid_log):
+        if invalid_log.added:
+            try:
+                invalid_log.export_xlsx()
+                self.log_error(f"✅ Saved data to {self.invalid_xlsx_path} and removed duplicates.")
+                return True
+            except Exception as e:
+                self.log_error(f"❌ Error saving to Excel (entries are kept in {self.invalid_db_path}): {e}")
+                return False
+        else:
+            self.log_error("ℹ️ No invalid entries to save to 0.Invalid.xlsx.")
+            return True
+
+    # Invalid files journal ("invalid_log.db") - an existing "0.Invalid.xlsx" is imported the first time
+    def open_invalid_log(self):
+        return InvalidLog(self.invalid_db_path, self.invalid_xlsx_path)
+
+    # Journal of the updates written to the loaded master file and not saved yet (see pipeline/update_journal.py)
+    def open_journal(self):
+        return UpdateJournal(self.journal_path)
+
+    # Adds a record written to the master file to the journal (committed before the next file)
+    def journal_record(self, record, journal, timestamp):
+        record['timestamp'] = timestamp
+        with self.metrics.phase('journal', record['file']):
+            record['seq'] = journal.add(record)
+
+    # After the master file was saved: the entries are marked as saved, the files are moved to "Processed"
+    # and the entries removed
+    # (a file that could not be moved keeps its entry - it's moved by the next run)
+    def finish_batch(self, journal, pending):
+        journal.mark_saved([record['seq'] for record in pending])
+        finished = []
+        for record in pending:
+            if os.path.exists(os.path.join(self.folder_to_process, record['file'])):
+                try:
+                    self.finish_processed(record['file'])
+                except OSError as e:
+                    self.log_error(f"❗ {record['file']} was saved to Excel but could not be moved (will retry): {e}")
+                    continue
+            self.metrics.file_done(record['file'], record['status'], reason=record['reason'])
+            finished.append(record['seq'])
+        journal.remove(finished)
+
+    # After the master file was saved: the NIP maps (the NIP columns were not changed, so they stay valid
+    # for the saved file) and the offer index are saved for it
+    def save_indexes(self, nip_index):
+        with self.metrics.phase('nip_index_save'):
+            key = nip_index.save()
+        if self.offer_index is not None:
+            with self.metrics.phase('offer_index_save'):
+                self.offer_index.save(key)
+        return key
+
+    # Saves the master file (and its indexes), then moves the files written to it
+    def checkpoint(self, master, nip_index, journal, pending):
+        with self.metrics.phase('master_save'):
+            master.save() # Saves the master file
+        self.save_indexes(nip_index)
+        self.write_changes()
+        self.finish_batch(journal, pending)
+        self.metrics.add('checkpoints')
+        if pending:
+            self.log_error(f"💾 Saved {len(pending)} file(s) to {self.supplier_file}")
+
+    # Finishes what an interrupted run left in the journal: files whose updates are in the saved master file are
+    # moved, the other updates are written to the loaded master file again - from the journal, the files are not
+    # parsed again. Returns the re-applied records (saved with the next checkpoint).
+    def resume(self, master, nip_index, journal, invalid_log):
+        entries = journal.unfinished()
+        if not entries:
+            return []
+        self.log_error(f"♻️ Resuming {len(entries)} file(s) left in {self.journal_path} by an interrupted run")
+        # Updates found in the saved master file are not written again (the run stopped between saving the master
+        # file and marking them as saved) - they would only be logged as "no changes" of the same file
+        self.prefetch_rows([record for record, is_saved in entries if not is_saved], master, nip_index)
+        entries = [(record, is_saved or self.already_written(record, master, nip_index)) for record, is_saved in entries]
+        saved = [record for record, is_saved in entries if is_saved]
+        if saved:
+            self.finish_batch(journal, saved)
+
+        pending = []
+        for record, is_saved in entries:
+            if is_saved:
+                continue
+            if not os.path.exists(os.path.join(self.folder_to_process, record['file'])):
+                self.log_error(f"❗ {record['file']} is not in 'To_process' any more - its update was not saved and is dropped")
+                journal.remove([record['seq']])
+            elif self.apply_record(record, master, nip_index, invalid_log, record['timestamp']):
+                pending.append(record)
+                self.metrics.add('resumed', file=record['file'])
+            else:
+                journal.remove([record['seq']])
+                self.metrics.file_done(record['file'], record['status'], reason=record['reason'])
+        return pending
+
+    # Last message of a run - with "master_writer": "sqlite" the run updates the database, not the master file
+    def completion_message(self):
+        if self.uses_database:
+            return (f"✅ Processing complete. Database updated: {database_path(self.supplier_file)} "
+                    f"(export_master.py writes the changes to {self.supplier_file})")
+        return f"✅ Processing complete. File updated: {self.supplier_file}"
+
+    # Peak memory and the profile (if they were asked for in config.json) go to log.txt as well
+    def log_summary(self, summary):
+        if 'peak_memory' in summary:
+            self.log_error(f"📈 Peak memory: {summary['peak_memory'] / 2 ** 20:.1f} MB")
+        if 'profile' in summary:
+            self.log_error(f"🔬 Profile saved to {summary['profile']}")
+
+    # xlsx files waiting in "To_process", in name order
+    def files_to_process(self):
+        return sorted(file for file in os.listdir(self.folder_to_process) if file.endswith('.xlsx'))
+
+    # Processes every file in "To_process" with the loaded master file and saves it. Returns the number of files.
+    # records - parsed records of some of the files (by path), they are not parsed again.
+    # only_journal - only finishes the files left in the journal by an interrupted run.
+    def process(self, master, nip_index, timestamp, records=None, only_journal=False):
+        metrics = self.metrics
+
+        # Invalid files are appended to "invalid_log.db" (shared with script 2) as they are found
+        invalid_log = self.open_invalid_log()
+        verdict_cache = open_verdict_cache(self.config, self.verdict_cache_path)
+        self.msg_archive = open_msg_archive(self.config)
+        journal = self.open_journal()
+        pending = self.resume(master, nip_index, journal, invalid_log)
+        resumed = {record['file'] for record in pending}
+
+        # Every xlsx file in the "To_process" folder is set to be processed.
+        # Each file is opened and checked (NIP in C7 of "DATA", errors in the "offer" sheet) by parse_supplier_file,
+        # in worker processes if "processing_workers" > 1 - only the results are written to the master file here.
+        # Files are only moved to "Processed" after the master file with their updates was saved.
+        files = [] if only_journal else [file for file in self.files_to_process() if file not in resumed]
+        paths = [os.path.join(self.folder_to_process, file) for file in files]
+
+        # Records are taken in batches, so the rows of suppliers sending their file again are read in one go
+        last_checkpoint = time.monotonic()
+        parsed = self.parse_files(paths, verdict_cache, records)
+        while True:
+            batch = list(itertools.islice(parsed, self.checkpoint_files))
+            if not batch:
+                break
+            self.prefetch_rows(batch, master, nip_index)
+            for record in batch:
+                file = record['file']
+                with metrics.profiled(file):
+                    if self.apply_record(record, master, nip_index, invalid_log, timestamp):
+                        self.journal_record(record, journal, timestamp)
+                        pending.append(record)
+                    else:
+                        metrics.file_done(file, record['status'], reason=record['reason'])
+                if pending and (len(pending) >= self.checkpoint_files
+                                or time.monotonic() - last_checkpoint >= self.checkpoint_seconds):
+                    self.checkpoint(master, nip_index, journal, pending)
+                    pending = []
+                    last_checkpoint = time.monotonic()
+
+        self.checkpoint(master, nip_index, journal, pending)
+
+        with metrics.phase('invalid_export'):
+            self.save_invalid_entries(invalid_log)
+        invalid_log.close()
+        journal.close()
+        if verdict_cache:
+            verdict_cache.close()
+        self.close_msg_archive()
+        return len(files) + len(resumed)
+
+    # Moves a rejected file back from "Invalid_files" to "To_process" (with its msg file, or its msg file in the
+    # archive is waiting again). Returns False if it can't be moved back.
+    def restore_invalid(self, file):
+        target = os.path.join(self.folder_to_process, file)
+        if os.path.exists(target):
+            self.log_error(f"❗ {file} is in 'To_process' already - it's left in 'Invalid_files'")
+            return False
+        shutil.move(os.path.join(self.folder_invalid, file), target)
+        self.metrics.add('files_moved', file=file)
+        if self.msg_archive and self.msg_archive.mark(file, TO_PROCESS, current=INVALID):
+            return True
+        msg_name = os.path.splitext(file)[0] + ".msg"
+        msg_path = os.path.join(self.folder_invalid, msg_name)
+        if os.path.exists(msg_path):
+            try:
+                shutil.move(msg_path, os.path.join(self.folder_to_process, msg_name))
+                self.metrics.add('files_moved', file=file)
+            except Exception as e:
+                self.log_error(f"❗ Error moving MSG file {msg_name}: {e}")
+        return True
+
+    # Invalid recheck (--recheck-invalid): the records kept for the files rejected with "Missing/invalid NIP" are
+    # matched against the NIP maps of the loaded master file all at once. Files whose NIP is now in both data1 and
+    # data2 are moved back to "To_process", taken out of 0.Invalid.xlsx and processed from their kept records -
+    # they are not opened again. Other files waiting in "To_process" are processed with them, as in process().
+    # Returns the number of files processed.
+    def recheck_invalid(self, master, nip_index, timestamp):
+        invalid_log = self.open_invalid_log()
+        self.msg_archive = open_msg_archive(self.config)
+        with self.metrics.phase('invalid_recheck'):
+            stored = invalid_log.payloads('Missing/invalid NIP')
+            known = nip_index.maps['data1'].keys() & nip_index.maps['data2'].keys()
+            found = {file: content for file, content in stored.items() if content['nip'] in known}
+
+            records, resolved, gone = {}, [], []
+            for file, content in found.items():
+                if not os.path.exists(os.path.join(self.folder_invalid, file)):
+                    gone.append(file)
+                elif self.restore_invalid(file):
+                    path = os.path.join(self.folder_to_process, file)
+                    records[path] = record_for_file(content, path)
+                    resolved.append((file, records[path]['supplier_name'], content['nip'], "Invalid recheck", timestamp))
+                    self.metrics.add('rechecked', file=file)
+            # Files no longer in "Invalid_files" (deleted or moved by hand) keep their entry, but not their record
+            invalid_log.remove_payloads(gone)
+            invalid_log.resolve(resolved)
+        invalid_log.close()
+        self.close_msg_archive()
+        self.log_error(f"🔁 {len(resolved)} of {len(stored)} file(s) with a missing NIP can be processed now")
+        return self.process(master, nip_index, timestamp, records)
+
+    # Headless mode (--watch): keeps the master file and the NIP maps loaded, picks up new files from "To_process"
+    # as they arrive and saves the master file in batches. Processed files are only moved to "Processed" after
+    # the batch they belong to was saved. Runs until stopped with KeyboardInterrupt (the last batch is saved first).
+    def watch(self):
+        metrics = self.metrics
+        log_error = self.log_error
+        supplier_file = self.supplier_file
+        log_error(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}👀 Watching 'To_process' folder")
+        metrics.start("watch")
+        with metrics.phase('master_load'):
+            master, nip_index = self.load_master()
+        master_key = self.master_key()
+
+        watcher = DirectoryWatcher(self.folder_to_process)
+        stable = StableFiles(self.folder_to_process, '.xlsx', self.watch_settle_seconds)
+        log_error(f"ℹ️ Waiting for files ({watcher.mode}), saving every {self.watch_batch_size} files or {self.watch_flush_seconds:g} sec")
+
+        invalid_log = self.open_invalid_log()
+        verdict_cache = open_verdict_cache(self.config, self.verdict_cache_path)
+        self.msg_archive = open_msg_archive(self.config)
+        journal = self.open_journal()
+        pending = self.resume(master, nip_index, journal, invalid_log)  # files written to the loaded master file, not saved yet
+        first_pending = time.monotonic() if pending else None
+
+        def flush():
+            nonlocal master, nip_index, master_key, pending, first_pending
+            if pending:
+                # Someone changed the master file in the meantime - it's loaded again and the batch is re-applied,
+                # so their changes are not overwritten
+                if self.master_key() != master_key:
+                    log_error("🔄 The master file was changed outside of the script - loading it again")
+                    with metrics.phase('master_load'):
+                        master, nip_index = self.load_master()
+                    self.changes = []
+                    self.prefetch_rows(pending, master, nip_index)
+                    reapplied = []
+                    for record in pending:
+                        if self.apply_record(record, master, nip_index, invalid_log, record['timestamp']):
+                            reapplied.append(record)
+                        else:
+                            journal.remove([record['seq']])
+                            metrics.file_done(record['file'], record['status'], reason=record['reason'])
+                    pending = reapplied
+                try:
+                    with metrics.phase('master_save'):
+                        master.save()
+                except OSError as e:
+                    log_error(f"❗ Could not save the master file (will retry): {e}")
+                    return
+                self.save_indexes(nip_index)
+                self.write_changes()
+                master_key = self.master_key()
+                self.finish_batch(journal, pending)
+                log_error(f"💾 Saved {len(pending)} file(s) to {supplier_file}")
+            if invalid_log.added:
+                with metrics.phase('invalid_export'):
+                    self.save_invalid_entries(invalid_log)
+            if verdict_cache:
+                verdict_cache.flush()
+            # One summary line per saved batch
+            if metrics.counters.get('files_parsed'):
+                self.log_summary(metrics.finish(files=metrics.counters['files_parsed'], writer=self.master_writer,
+                                                workers=self.workers))
+                metrics.start("watch")
+            pending = []
+            first_pending = None
+
+        try:
+            while True:
+                busy = {record['file'] for record in pending}
+                ready = stable.ready(skip=busy)
+                if ready:
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    records = list(self.parse_files([os.path.join(self.folder_to_process, file) for file in ready], verdict_cache))
+                    self.prefetch_rows(records, master, nip_index)
+                    for record in records:
+                        # One file that fails (e.g. can't be moved) is left in "To_process" until it changes -
+                        # the other files are processed
+                        try:
+                            with metrics.profiled(record['file']):
+                                applied = self.apply_record(record, master, nip_index, invalid_log, timestamp)
+                        except Exception as e:
+                            log_error(f"❌ {record['file']} could not be processed (left in 'To_process'): {e!r}")
+                            stable.hold(record['file'])
+                            metrics.file_done(record['file'], 'error', reason=str(e))
+                            continue
+                        if applied:
+                            self.journal_record(record, journal, timestamp)
+                            pending.append(record)
+                            first_pending = first_pending or time.monotonic()
+                        else:
+                            metrics.file_done(record['file'], record['status'], reason=record['reason'])
+                    if not pending:
+                        flush() # only invalid entries to save
+
+                if pending and (len(pending) >= self.watch_batch_size
+                                or time.monotonic() - first_pending >= self.watch_flush_seconds):
+                    flush()
+
+                timeouts = [self.watch_flush_seconds]
+                if first_pending is not None:
+                    timeouts.append(max(0.0, first_pending + self.watch_flush_seconds - time.monotonic()))
+                waiting = stable.next_check(skip=busy)
+                if waiting is not None:
+                    timeouts.append(waiting)
+                self.run_log.flush()
+                watcher.wait(min(timeouts))
+        except KeyboardInterrupt:
+            # Another SIGTERM (e.g. from a service manager) must not stop the last save
+            ignore_sigterm()
+            log_error("⏹️ Stopping - saving the last batch")
+            flush()
+        finally:
+            watcher.close()
+            invalid_log.close()
+            journal.close()
+            if verdict_cache:
+                verdict_cache.close()
+            self.close_msg_archive()
+            self.run_log.flush()
@@ -0,0 +1,117 @@
+import os #for file names
+import re #for regular expressions - cleaning NIP (Company ID)
+import warnings #for supressing warnings from openpyxl
+import io #for files handed over in memory
+from pipeline.offer_engine import SERVICE_COLUMNS, evaluate_offer #for validating the offer and finding the "x" marks
+
+DATA_ROWS = 21  # DATA!C1:C21
+
+# "DATA" sheet cells copied to data2 columns. Columns A, H, J, K, L contain some prefilled data
+# (including NIP), so they are skipped.
+DATA_MAPPING = {
+    **{f'C{i}': col for i, col in zip(range(1, 7), 'BCDEFG')},
+    **{f'C{i}': col for i, col in zip(range(8, 10), 'IM')},
+    **{f'C{i}': col for i, col in zip(range(10, 22), 'NOPQRSTUVWXYZ')}
+}
+
+# Ensures company ID (NIP) in the database is digits only, but many companies would provide
+# their NIP "XXXXXX" in the form of "XXX XXX" or "ZZXXXXXX", etc.
+def clean_nip(nip):
+    return re.sub(r'\D', '', str(nip))
+
+# Messages logged for invalid files
+MESSAGES = {
+    'Missing DATA': "❌ {file} - missing 'DATA' sheet",
+    'Invalid NIP': "⚠️ {file} - invalid NIP",
+    'Missing offer sheet': "❌ {file} - missing 'offer' sheet",
+    'no x': "❌ {file} - error: no x",
+    'empty category': "❌ {file} - error: empty category",
+}
+
+def _invalid(record, reason, nip=''):
+    record.update(status='invalid', reason=reason, message=MESSAGES[reason].format(file=record['file']), nip=nip)
+    return record
+
+def _new_record(path):
+    file = os.path.basename(path)
+    return {
+        'file': file,
+        'supplier_name': os.path.splitext(file)[0].strip(),
+        'status': 'ok', 'reason': '', 'message': '', 'nip': '',
+        'marks': [], 'data': {},
+    }
+
+# The parts of a record that only depend on the file content (what the verdict cache keeps)...
+def record_content(record):
+    return {key: value for key, value in record.items() if key not in ('file', 'supplier_name', 'message')}
+
+# ...and a full record for a file with that content
+def record_for_file(content, path):
+    record = _new_record(path)
+    record.update(content)
+    if record['status'] != 'ok':
+        record['message'] = MESSAGES[record['reason']].format(file=record['file'])
+    return record
+
+# Reads everything the processing needs from a supplier file in one read-only pass:
+# the values of DATA!C1:C21 (None if there is no "DATA" sheet) and the rows of the "offer" sheet,
+# columns A-H (None if there is no "offer" sheet). Raises if the file can't be opened at all.
+# data - content of the file, if it's already in memory (path is then only used for the name).
+def read_supplier_file(path, data=None):
+    import openpyxl #for reading supplier files (read-only, one pass) - only imported when a file is parsed
+    wb = openpyxl.load_workbook(io.BytesIO(data) if data is not None else path, read_only=True, data_only=True)
+    try:
+        data_cells = None
+        if 'DATA' in wb.sheetnames:
+            values = [row[0] for row in wb['DATA'].iter_rows(min_row=1, max_row=DATA_ROWS, min_col=3, max_col=3, values_only=True)]
+            values += [None] * (DATA_ROWS - len(values))
+            data_cells = {f'C{i}': value for i, value in enumerate(values, start=1)}
+
+        offer_rows = None
+        if 'offer' in wb.sheetnames:
+            width = SERVICE_COLUMNS[-1][1] + 1
+            offer_rows = [row + (None,) * (width - len(row))
+                          for row in wb['offer'].iter_rows(min_col=1, max_col=width, values_only=True)]
+        return data_cells, offer_rows
+    finally:
+        wb.close() # read-only workbooks keep the file open until closed
+
+# Parses and validates one supplier file without touching the master workbook.
+# Returns a small picklable record, so it can run in a worker process:
+#   status  - 'ok' or 'invalid' (reason/message say why)
+#   nip     - cleaned NIP from DATA!C7
+#   marks   - data1 column numbers that get an "x"
+#   data    - data2 column letter -> value from the DATA sheet
+def parse_supplier_file(path, data=None):
+    warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+    record = _new_record(path)
+
+    # Checks for clean NIP in C7 cell of the "DATA" sheet.
+    try:
+        data_cells, offer_rows = read_supplier_file(path, data)
+    except Exception:
+        data_cells, offer_rows = None, None
+    if data_cells is None:
+        return _invalid(record, 'Missing DATA')
+
+    nip_clean = clean_nip(data_cells['C7'])
+    if not nip_clean:
+        return _invalid(record, 'Invalid NIP')
+
+    # Checks the "offer" sheet for errors:
+    # 1. missing_x - supplier sending an Excel file with no services chosen
+    # 2. empty_category - supplier putting an "x" next to an empty ("-") category
+    # and collects the data1 columns of the "x" marks (each service column fills every 3rd cell of the master row).
+    if offer_rows is None:
+        return _invalid(record, 'Missing offer sheet', nip_clean)
+
+    missing_x, empty_category, marks = evaluate_offer(offer_rows)
+    if missing_x or empty_category:
+        reason = 'no x' if missing_x else 'empty category'
+        return _invalid(record, reason, nip_clean)
+
+    record['marks'] = marks.tolist()
+
+    record['data'] = {dest_col: data_cells[source_cell] for source_cell, dest_col in DATA_MAPPING.items()}
+    record['nip'] = nip_clean
+    return record
@@ -0,0 +1,51 @@
+import pickle #for the parsed records (they are picklable - they come back from the worker processes)
+import sqlite3 #for the journal file
+
+
+# Write-ahead journal of the updates of the master file. Every record written to the loaded master file is added
+# (and committed) here first; after the master file is saved, the entries are marked as saved, the files are moved
+# and the entries removed. Whatever is left after a crash is either not in the saved master file yet (replayed
+# from the journal - the files are not parsed again) or only waits for its files to be moved.
+class UpdateJournal:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        # WAL: a commit is one append to the -wal file, so committing after every file stays cheap
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS updates ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, file TEXT NOT NULL, record BLOB NOT NULL, "
+                "saved INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    # Returns the number of the entry
+    def add(self, record):
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO updates (file, record) VALUES (?, ?)",
+                                       (record['file'], pickle.dumps(record)))
+        return cursor.lastrowid
+
+    def mark_saved(self, seqs):
+        with self.conn:
+            self.conn.executemany("UPDATE updates SET saved = 1 WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def remove(self, seqs):
+        with self.conn:
+            self.conn.executemany("DELETE FROM updates WHERE seq = ?", [(seq,) for seq in seqs])
+
+    # Entries left by an earlier run, oldest first: (record with its "seq", saved)
+    def unfinished(self):
+        entries = []
+        for seq, record, saved in self.conn.execute("SELECT seq, record, saved FROM updates ORDER BY seq"):
+            record = pickle.loads(record)
+            record['seq'] = seq
+            entries.append((record, bool(saved)))
+        return entries
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM updates").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
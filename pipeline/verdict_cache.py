@@ -0,0 +1,122 @@
+import json #for storing the cached values
+import time #for the last use of an entry
+import hashlib #for the content hash of the attachments
+import sqlite3 #for the on-disk cache shared by both scripts
+from datetime import datetime, date, time as dtime #for cell values that are dates
+
+# Bump when probe_workbook() or parse_supplier_file() start returning something different for the same file -
+# entries of an older version are not used (and get evicted over time)
+VERSION = 1
+
+# Kinds of entries: the sheet check + C1/C7 of script 2 and the parsed record of script 3 (or of the pipeline runner)
+SCREENING = "probe:Supplier DATA:C1,C7"
+RECORD = "record"
+
+
+def data_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# Cell values are kept as JSON - dates and times are tagged so they come back as the same types
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, dtime):
+        return {"__time__": value.isoformat()}
+    raise TypeError(f"Can't cache {type(value).__name__}")
+
+def _decode(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+        if "__time__" in obj:
+            return dtime.fromisoformat(obj["__time__"])
+    return obj
+
+
+# Results of reading an attachment, keyed by the SHA-256 of its bytes - the same file sent again
+# (replies in the same thread, messages checked again) is never opened a second time.
+# kind says what was cached: the probe of script 2 ("probe:<sheet>:<cells>") or the parsed record of script 3.
+# Lookups read the SQLite file, new entries and the last use of the ones found are buffered and written
+# in one transaction by flush(), which also evicts the least recently used entries above max_bytes.
+class VerdictCache:
+    def __init__(self, db_path, max_bytes=32 * 2 ** 20):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.pending = {}
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "digest TEXT NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "used REAL NOT NULL, PRIMARY KEY (digest, kind))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    @staticmethod
+    def _kind(kind):
+        return f"{kind}:v{VERSION}"
+
+    # Returns the cached value or None
+    def get(self, digest, kind):
+        key = (digest, self._kind(kind))
+        if key in self.pending:
+            text = self.pending[key]
+        else:
+            row = self.conn.execute("SELECT value FROM cache WHERE digest = ? AND kind = ?", key).fetchone()
+            text = row[0] if row else None
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used[key] = time.time()
+        return json.loads(text, object_hook=_decode)
+
+    def put(self, digest, kind, value):
+        self.pending[(digest, self._kind(kind))] = json.dumps(value, ensure_ascii=False, default=_encode)
+
+    # Writes the buffered entries and drops the least recently used ones above max_bytes
+    def flush(self):
+        if not self.pending and not self.used:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                [(digest, kind, text, len(text.encode("utf-8")), now) for (digest, kind), text in self.pending.items()]
+            )
+            self.conn.executemany("UPDATE cache SET used = ? WHERE digest = ? AND kind = ?",
+                                  [(used, digest, kind) for (digest, kind), used in self.used.items()])
+            self.conn.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM ("
+                "SELECT rowid, SUM(size) OVER (ORDER BY used DESC, rowid DESC) AS total FROM cache) WHERE total > ?)",
+                (self.max_bytes,)
+            )
+        self.pending = {}
+        self.used = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+# Opens the cache from config.json ("verdict_cache_mb", default 32 - 0 turns the cache off)
+def open_verdict_cache(config, db_path):
+    size = float(config.get("verdict_cache_mb", 32))
+    if size <= 0:
+        return None
+    return VerdictCache(db_path, int(size * 2 ** 20))
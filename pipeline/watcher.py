@@ -0,0 +1,114 @@
+import os #for listing the watched folder
+import sys #for using inotify on Linux only
+import time #for polling
+import select #for waiting on inotify events with a timeout
+import ctypes #for calling inotify from libc (Linux only)
+
+# inotify flags (linux/inotify.h)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+
+# inotify file descriptor watching folder, or None where there is no inotify (Windows, macOS) - the watcher polls then
+def _inotify_fd(folder):
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+    fd = init(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd < 0:
+        return None
+    if add_watch(fd, os.fsencode(folder), _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+# Waits for changes in a folder - with inotify where available (Linux), otherwise by polling.
+# wait() returns True if something happened in the folder (always True when polling - the caller
+# rescans the folder either way) and False if the timeout passed quietly.
+class DirectoryWatcher:
+    def __init__(self, folder, poll_interval=2.0):
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.fd = _inotify_fd(folder)
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def wait(self, timeout):
+        if self.fd is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return True
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# Tells which files of a folder stopped changing: a file is ready once its size and modification time
+# stayed the same for settle_seconds (so half-written attachments are not picked up).
+# A held file (one that failed) is not ready again until it changes.
+class StableFiles:
+    def __init__(self, folder, suffix, settle_seconds=2.0):
+        self.folder = folder
+        self.suffix = suffix
+        self.settle_seconds = settle_seconds
+        self.seen = {}
+        self.held = {}
+
+    def ready(self, skip=()):
+        now = time.monotonic()
+        ready = []
+        current = {}
+        held = {}
+        for name in os.listdir(self.folder):
+            if not name.endswith(self.suffix) or name in skip:
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            state = (st.st_size, st.st_mtime_ns)
+            if self.held.get(name) == state:
+                held[name] = state
+                continue
+            previous = self.seen.get(name)
+            since = previous[1] if previous and previous[0] == state else now
+            current[name] = (state, since)
+            if now - since >= self.settle_seconds:
+                ready.append(name)
+        self.seen = current
+        self.held = held
+        return sorted(ready)
+
+    def hold(self, name):
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            return
+        self.held[name] = (st.st_size, st.st_mtime_ns)
+        self.seen.pop(name, None)
+
+    # Seconds until the next file could become ready (None if nothing is waiting)
+    def next_check(self, skip=()):
+        waiting = [since for name, (_, since) in self.seen.items() if name not in skip]
+        if not waiting:
+            return None
+        return max(0.0, min(waiting) + self.settle_seconds - time.monotonic())
@@ -0,0 +1,307 @@
+import os #for replacing the workbook once the new copy is written
+import re #for finding rows and cells in the sheet XML
+import shutil #for keeping the permissions of the replaced file
+import zipfile #for reading/writing the xlsx/xlsm package
+import tempfile #for writing the new package next to the old one
+from datetime import datetime, date
+from xml.sax.saxutils import escape, unescape
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+from pipeline.xlsx_probe import sheet_parts
+
+CHUNK = 1 << 20
+
+_ROW_START = re.compile(rb'<row(?=[\s/>])')
+_SHEETDATA = re.compile(rb'<sheetData(?=[\s/>])[^>]*?(/?)>')
+_SHEETDATA_END = b'</sheetData>'
+_ROW_NUMBER = re.compile(rb'\sr="(\d+)"')
+_SPANS = re.compile(rb'\sspans="[^"]*"')
+_CELL = re.compile(rb'<c(?=[\s/>])[^>]*?(?:/>|>.*?</c>)', re.S)
+_CELL_REF = re.compile(rb'\sr="([A-Z]+)(\d+)"')
+_CELL_STYLE = re.compile(rb'\ss="(\d+)"')
+_SHARED_FORMULA = re.compile(rb'<f(?=\s)([^>]*?\st="shared"[^>]*?)(?:/>|>(.*?)</f>)', re.S)
+_SHARED_INDEX = re.compile(rb'\ssi="(\d+)"')
+_SHARED_RANGE = re.compile(rb'\sref="([A-Z]+\d+)(?::[A-Z]+(\d+))?"')
+_ILLEGAL = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+_CALC_CHAIN = "xl/calcChain.xml"
+_CALC_CHAIN_TYPE = b'application/vnd.openxmlformats-officedocument.spreadsheetml.calcChain+xml'
+_CHAIN_REF = re.compile(rb'<c\s[^>]*?\br="([A-Z]+\d+)"')
+
+
+def _col(col):
+    return column_index_from_string(col) if isinstance(col, str) else col
+
+# Builds the XML of one cell, keeping its style. None gives an empty (styled) cell.
+def _cell_xml(ref, style, value):
+    s = f' s="{style.decode()}"' if style else ''
+    if value is None:
+        return f'<c r="{ref}"{s}/>' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{s}><v>{value!r}</v></c>'
+    if isinstance(value, (datetime, date)):
+        # Stored as an Excel serial number - shown as a date if the cell already has a date format
+        return f'<c r="{ref}"{s}><v>{to_excel(value)!r}</v></c>'
+    text = escape(_ILLEGAL.sub('', str(value)))
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+# Writes a new version of target with write(file) into a temporary file in the same folder, flushed to the disk,
+# which then replaces target in one step - a save that is interrupted leaves the old file as it was
+def replace_file(target, write):
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(target):
+            shutil.copymode(target, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Collects cell edits of a workbook and writes them by streaming a new copy of the package, parts in their
+# original order: every part except the edited sheets is streamed through as it is (macros, data validations,
+# tables, styles...), and in the edited sheets only the <row> elements with changed cells are rebuilt.
+# Memory use depends on the size of one row and of CHUNK, not of the workbook.
+class WorkbookPatch:
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            self.parts = sheet_parts(zf)
+        self.edits = {}  # sheet part -> {row: {column: value}}
+        self.formulas_replaced = False
+
+    def __bool__(self):
+        return any(self.edits.values())
+
+    def set(self, sheet, row, col, value):
+        part = self.parts[sheet]
+        self.edits.setdefault(part, {}).setdefault(row, {})[_col(col)] = value
+
+    def clear(self):
+        self.edits = {}
+
+    # Writes the patched workbook (over the original file by default) and forgets the edits
+    def save(self, target=None):
+        target = target or self.path
+
+        def write(out):
+            with zipfile.ZipFile(self.path) as src, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as dst:
+                self.formulas_replaced = self._replaces_formulas(src)
+                for info in src.infolist():
+                    if info.filename in self.edits:
+                        self._patch_part(src, dst, info)
+                    else:
+                        self._copy_part(src, dst, info)
+        replace_file(target, write)
+        self.path = target
+        self.clear()
+
+    # True if an edited cell is in the calculation chain (a formula cell is overwritten). Found before anything is
+    # written, as [Content_Types].xml comes before the sheets. Cell references are compared for all the edited
+    # sheets together - at worst the chain is dropped when it didn't have to be.
+    def _replaces_formulas(self, src):
+        if _CALC_CHAIN not in src.NameToInfo:
+            return False
+        refs = {f'{get_column_letter(col)}{row}'.encode()
+                for rows in self.edits.values() for row, values in rows.items() for col in values}
+        with src.open(_CALC_CHAIN) as f:
+            tail = b''
+            while True:
+                chunk = f.read(CHUNK)
+                data = tail + chunk
+                cut = data.rfind(b'>') + 1 if chunk else len(data)
+                if any(match.group(1) in refs for match in _CHAIN_REF.finditer(data, 0, cut)):
+                    return True
+                tail = data[cut:]
+                if not chunk:
+                    return False
+
+    # Streams a part through unchanged. If a formula cell was overwritten, the calculation chain is dropped
+    # (Excel rebuilds it) - a stale one makes Excel report the file as damaged.
+    def _copy_part(self, src, dst, info):
+        if self.formulas_replaced:
+            if info.filename == _CALC_CHAIN:
+                return
+            if info.filename == "[Content_Types].xml":
+                data = re.sub(rb'<Override[^>]*?' + re.escape(_CALC_CHAIN_TYPE) + rb'[^>]*?/>', b'', src.read(info))
+                dst.writestr(_copy_info(info), data)
+                return
+            if info.filename == "xl/_rels/workbook.xml.rels":
+                data = re.sub(rb'<Relationship[^>]*?Target="(?:/xl/)?calcChain\.xml"[^>]*?/>', b'', src.read(info))
+                dst.writestr(_copy_info(info), data)
+                return
+        copy = _copy_info(info)
+        copy.file_size = info.file_size  # zipfile decides about ZIP64 from it
+        with src.open(info) as reader, dst.open(copy, "w") as writer:
+            shutil.copyfileobj(reader, writer, CHUNK)
+
+    def _patch_part(self, src, dst, info):
+        rows = self.edits[info.filename]
+        with src.open(info) as reader, dst.open(_copy_info(info), "w", force_zip64=True) as writer:
+            _patch_sheet(reader, writer, rows, self)
+
+
+def _copy_info(info):
+    new = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    new.compress_type = zipfile.ZIP_DEFLATED
+    new.external_attr = info.external_attr
+    return new
+
+# Streams one sheet part from reader to writer, rebuilding the rows listed in edits
+# and adding the rows that don't exist yet (in row order).
+# A shared formula keeps its text only in its first cell - if that cell is overwritten, the formula is written out
+# into every other cell of the shared range (those rows are rebuilt too, up to the last row of the range).
+def _patch_sheet(reader, writer, edits, patch):
+    pending = sorted(edits)
+    shared = {}  # si -> (formula, first cell, last row) of shared formulas whose first cell was overwritten
+    buf = b''
+    pos = 0
+    eof = False
+
+    # Drops what was already written and reads the next chunk
+    def more():
+        nonlocal buf, pos, eof
+        chunk = reader.read(CHUNK)
+        if not chunk:
+            if eof:
+                raise ValueError("unexpected end of sheet part")
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def new_rows(upto=None):
+        while pending and (upto is None or pending[0] < upto):
+            row = pending.pop(0)
+            if any(value is not None for value in edits[row].values()):
+                writer.write(_row_xml(f'<row r="{row}">'.encode(), b'', row, edits[row], patch, shared))
+
+    # 1. Everything before <sheetData> is copied
+    while True:
+        match = _SHEETDATA.search(buf, pos)
+        if match:
+            break
+        keep = max(pos, len(buf) - 64)
+        writer.write(buf[pos:keep])
+        pos = keep
+        more()
+
+    writer.write(buf[pos:match.start()])
+    pos = match.end()
+    if match.group(1):  # <sheetData/> - empty sheet
+        writer.write(b'<sheetData>')
+        new_rows()
+        writer.write(_SHEETDATA_END)
+    else:
+        writer.write(match.group(0))
+
+        # 2. Rows are copied one by one, edited ones are rebuilt
+        last_row = 0
+        while True:
+            start = _ROW_START.search(buf, pos)
+            end_data = buf.find(_SHEETDATA_END, pos, start.start() if start else len(buf))
+            if end_data != -1:
+                writer.write(buf[pos:end_data])
+                pos = end_data
+                new_rows()
+                break
+            if start is None:
+                more()
+                continue
+
+            tag_end = buf.find(b'>', start.start())
+            if tag_end == -1:
+                more()
+                continue
+            if buf[tag_end - 1:tag_end] == b'/':
+                row_end = tag_end + 1
+            else:
+                close = buf.find(b'</row>', tag_end)
+                if close == -1:
+                    more()
+                    continue
+                row_end = close + len(b'</row>')
+
+            start_tag = buf[start.start():tag_end + 1]
+            number = _ROW_NUMBER.search(start_tag)
+            row = int(number.group(1)) if number else last_row + 1
+            last_row = row
+
+            writer.write(buf[pos:start.start()])
+            new_rows(upto=row)
+            for si in [si for si, (_, _, last) in shared.items() if last < row]:
+                del shared[si]
+            if pending and pending[0] == row:
+                pending.pop(0)
+                if start_tag.endswith(b'/>'):
+                    start_tag, body = start_tag[:-2] + b'>', b''
+                else:
+                    body = buf[tag_end + 1:row_end - len(b'</row>')]
+                writer.write(_row_xml(start_tag, body, row, edits[row], patch, shared))
+            elif shared:
+                writer.write(_CELL.sub(lambda match: _expand_shared(match.group(0), shared), buf[start.start():row_end]))
+            else:
+                writer.write(buf[start.start():row_end])
+            pos = row_end
+
+    # 3. Everything after </sheetData> is copied
+    writer.write(buf[pos:])
+    while True:
+        chunk = reader.read(CHUNK)
+        if not chunk:
+            break
+        writer.write(chunk)
+
+# Rebuilds one <row>: edited cells are replaced (keeping their style), new ones are inserted in column order.
+# shared - see _patch_sheet (first cells of shared formulas overwritten here are added to it)
+def _row_xml(start_tag, body, row, values, patch, shared):
+    cells = {}
+    pos = 0
+    for match in _CELL.finditer(body):
+        cell = match.group(0)
+        ref = _CELL_REF.search(cell[:cell.find(b'>') + 1])
+        col = column_index_from_string(ref.group(1).decode()) if ref else (max(cells) + 1 if cells else 1)
+        cells[col] = cell
+        pos = match.end()
+    tail = body[pos:]  # e.g. <extLst> after the cells
+
+    for col, value in values.items():
+        old = cells.get(col, b'')
+        head = old[:old.find(b'>') + 1] if old else b''
+        style = _CELL_STYLE.search(head)
+        ref = f'{get_column_letter(col)}{row}'
+        formula = _SHARED_FORMULA.search(old)
+        if formula and formula.group(2):
+            si = _SHARED_INDEX.search(formula.group(1))
+            area = _SHARED_RANGE.search(formula.group(1))
+            if si and area:
+                text = unescape(formula.group(2).decode("utf-8"), {"&quot;": '"', "&apos;": "'"})
+                shared[si.group(1)] = (text, area.group(1).decode(), int(area.group(2) or row))
+        cells[col] = _cell_xml(ref, style.group(1) if style else None, value).encode()
+    if shared:
+        for col, cell in cells.items():
+            if col not in values:
+                cells[col] = _expand_shared(cell, shared)
+
+    start_tag = _SPANS.sub(b'', start_tag)  # spans are only a hint and may no longer be right
+    return start_tag + b''.join(cells[col] for col in sorted(cells)) + tail + b'</row>'
+
+# A cell using a shared formula whose first cell was overwritten gets the formula written out for its own position
+def _expand_shared(cell, shared):
+    formula = _SHARED_FORMULA.search(cell)
+    if not formula or formula.group(2):
+        return cell
+    si = _SHARED_INDEX.search(formula.group(1))
+    ref = _CELL_REF.search(cell[:cell.find(b'>') + 1])
+    if not si or si.group(1) not in shared or not ref:
+        return cell
+    text, origin, _ = shared[si.group(1)]
+    translated = Translator("=" + text, origin=origin).translate_formula(ref.group(1).decode() + ref.group(2).decode())
+    return cell[:formula.start()] + b'<f>' + escape(translated[1:]).encode("utf-8") + b'</f>' + cell[formula.end():]
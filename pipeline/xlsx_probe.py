@@ -0,0 +1,291 @@
+import os #for file stats used as the cache key
+import re #for splitting cell references
+import zipfile #for opening the xlsx package without openpyxl
+import posixpath #for resolving paths inside the package
+from collections import namedtuple
+from functools import lru_cache
+from xml.etree.ElementTree import iterparse
+from html import unescape
+
+# Result of a probe: sheet names in workbook order and the requested cell values (None if empty/missing)
+Probe = namedtuple("Probe", ["sheetnames", "values"])
+
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+def _col_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - 64
+    return index
+
+def _number(text):
+    # Same rule openpyxl uses - integers stay integers
+    if "." in text or "E" in text or "e" in text:
+        return float(text)
+    return int(text)
+
+# Sheet names and "name -> part path" from xl/workbook.xml and its relationships
+def _sheets(zf):
+    sheets = []
+    with zf.open("xl/workbook.xml") as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) == "sheet":
+                sheets.append((el.get("name"), el.get(_REL_NS)))
+            elif _local(el.tag) == "sheets":
+                break
+    targets = {}
+    with zf.open("xl/_rels/workbook.xml.rels") as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) == "Relationship":
+                target = el.get("Target")
+                if target.startswith("/"):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join("xl", target))
+                targets[el.get("Id")] = target
+    return [name for name, _ in sheets], {name: targets.get(rid) for name, rid in sheets}
+
+# Reads shared strings only up to the highest index needed
+def _shared_strings(zf, needed):
+    if not needed or "xl/sharedStrings.xml" not in zf.namelist():
+        return {}
+    last = max(needed)
+    strings = {}
+    index = 0
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) != "si":
+                continue
+            if index in needed:
+                # Text runs (<r><t>) are joined, phonetic hints (<rPh>) are skipped
+                phonetic = _phonetic_texts(el)
+                strings[index] = "".join(
+                    t.text or "" for t in el.iter() if _local(t.tag) == "t" and t not in phonetic
+                )
+            el.clear()
+            if index >= last:
+                break
+            index += 1
+    return strings
+
+# {index: text} of the shared strings with the given indexes (e.g. for copying cells to another workbook)
+def shared_strings(zf, needed):
+    return _shared_strings(zf, set(needed))
+
+def _phonetic_texts(si):
+    return {t for rph in si if _local(rph.tag) == "rPh" for t in rph.iter()}
+
+# Reads the chosen cells of one sheet part, stopping after the last row needed
+def _cells(zf, part, refs):
+    wanted = {}
+    for ref in refs:
+        col, row = _CELL_REF.fullmatch(ref).groups()
+        wanted[(int(row), _col_index(col))] = ref
+    last_row = max(row for row, _ in wanted)
+
+    raw = {}
+    row_no = 0
+    col_no = 0
+    with zf.open(part) as f:
+        for event, el in iterparse(f, events=("start", "end")):
+            tag = _local(el.tag)
+            if event == "start":
+                if tag == "row":
+                    row_no = int(el.get("r") or row_no + 1)
+                    col_no = 0
+                    if row_no > last_row:
+                        break
+                continue
+            if tag == "c":
+                ref = el.get("r")
+                if ref:
+                    col, row = _CELL_REF.fullmatch(ref).groups()
+                    col_no = _col_index(col)
+                else:
+                    col_no += 1
+                key = (row_no, col_no)
+                if key in wanted:
+                    raw[wanted[key]] = _raw_value(el)
+                el.clear()
+            elif tag == "row":
+                el.clear()
+    return raw
+
+def _raw_value(cell):
+    kind = cell.get("t", "n")
+    text = None
+    for child in cell:
+        name = _local(child.tag)
+        if name == "v":
+            text = child.text
+        elif name == "is":
+            text = "".join(t.text or "" for t in child.iter() if _local(t.tag) == "t")
+    return kind, text
+
+def _convert(kind, text, strings):
+    if text is None:
+        return None
+    if kind == "s":
+        return strings.get(int(text))
+    if kind in ("str", "inlineStr", "e"):
+        return text
+    if kind == "b":
+        return text == "1"
+    try:
+        return _number(text)
+    except ValueError:
+        return text
+
+# Sheet name -> path of its part inside the package (e.g. "xl/worksheets/sheet1.xml")
+def sheet_parts(zf):
+    return _sheets(zf)[1]
+
+@lru_cache(maxsize=256)
+def _probe(path, size, mtime, sheet, cells):
+    with zipfile.ZipFile(path) as zf:
+        sheetnames, parts = _sheets(zf)
+        values = dict.fromkeys(cells)
+        if sheet in parts and parts[sheet] and cells:
+            raw = _cells(zf, parts[sheet], cells)
+            needed = {int(text) for kind, text in raw.values() if kind == "s" and text is not None}
+            strings = _shared_strings(zf, needed)
+            for ref, (kind, text) in raw.items():
+                values[ref] = _convert(kind, text, strings)
+    return Probe(tuple(sheetnames), values)
+
+# Lists the sheets of an xlsx/xlsm file and reads a handful of cells of one sheet straight from the zip
+# (cached values, like openpyxl with data_only=True - number formats are not applied, so dates stay numbers).
+# Results are cached per file path, size and modification time.
+def probe_workbook(path, sheet=None, cells=()):
+    st = os.stat(path)
+    result = _probe(os.path.abspath(path), st.st_size, st.st_mtime_ns, sheet, tuple(cells))
+    return Probe(result.sheetnames, dict(result.values))
+
+
+_CHUNK = 1 << 20
+_ROW_END = b'</row>'
+_TYPE = re.compile(rb'\st="(\w+)"')
+_VALUE = re.compile(rb'<v>(.*?)</v>', re.S)
+_INLINE = re.compile(rb'<t(?:\s[^>]*)?>(.*?)</t>', re.S)
+
+def _letters(col):
+    if isinstance(col, str):
+        return col
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+# Many columns (e.g. all the "x" columns of data1) are faster to find with one pattern for any cell,
+# filtered by the column letters
+_WIDE = 16
+_ANY_COLUMN = re.compile(rb'<c((?:\s[^>]*?)?)\sr="([A-Z]+)(\d+)"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+
+def _column_pattern(letters):
+    if len(letters) > _WIDE:
+        return _ANY_COLUMN
+    names = b"|".join(letter.encode() for letter in letters)
+    return re.compile(rb'<c((?:\s[^>]*?)?)\sr="(' + names + rb')(\d+)"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+
+# (type, text) of a cell found with a column pattern - the type can come before or after the reference
+def _cell_text(match):
+    kind = _TYPE.search(match.group(1) + match.group(4))
+    kind = kind.group(1).decode() if kind else "n"
+    body = match.group(5) or b""
+    if kind == "inlineStr":
+        text = b"".join(_INLINE.findall(body))
+    else:
+        value = _VALUE.search(body)
+        text = value.group(1) if value else None
+    if text is None:
+        return kind, None
+    # Line breaks are normalized the way an XML parser does it (before the references are decoded)
+    return kind, unescape(text.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n"))
+
+# Reads whole columns of one sheet (e.g. the NIP column of the master file) without loading the workbook.
+# The sheet part is scanned in chunks, so memory use doesn't grow with the sheet.
+# Returns {column: {row: value}} with only non-empty cells; columns are given as letters or numbers.
+def read_columns(path, sheet, columns, min_row=1):
+    letters = {_letters(col): col for col in columns}
+    pattern = _column_pattern(letters)
+    raw = {col: {} for col in columns}
+    with zipfile.ZipFile(path) as zf:
+        part = sheet_parts(zf)[sheet]
+        with zf.open(part) as f:
+            tail = b""
+            while True:
+                chunk = f.read(_CHUNK)
+                data = tail + chunk
+                # Only complete rows are scanned, the rest waits for the next chunk
+                cut = data.rfind(_ROW_END) + len(_ROW_END) if chunk else len(data)
+                if cut < len(_ROW_END):
+                    cut = 0 if chunk else len(data)
+                for match in pattern.finditer(data, 0, cut):
+                    col = letters.get(match.group(2).decode())
+                    row = int(match.group(3))
+                    if col is None or row < min_row:
+                        continue
+                    kind, text = _cell_text(match)
+                    if text is not None:
+                        raw[col][row] = (kind, text)
+                tail = data[cut:]
+                if not chunk:
+                    break
+
+        needed = {int(text) for cells in raw.values() for kind, text in cells.values() if kind == "s"}
+        strings = _shared_strings(zf, needed)
+    return {col: {row: value for row, (kind, text) in cells.items()
+                  if (value := _convert(kind, text, strings)) is not None}
+            for col, cells in raw.items()}
+
+_ROW = re.compile(rb'<row(?=[\s/>])[^>]*?\sr="(\d+)"[^>]*?(?:/>|>(.*?)</row>)', re.S)
+
+# Reads some rows of one sheet (e.g. the rows of the master file a batch of files will overwrite),
+# columns given as letters or numbers. Only the wanted rows are searched for cells, the scan stops after the last one.
+# Returns {row: {column: value}} with only non-empty cells (every wanted row is in it).
+def read_rows(path, sheet, rows, columns):
+    letters = {_letters(col): col for col in columns}
+    rows = set(rows)
+    raw = {row: {} for row in rows}
+    if not rows:
+        return raw
+    last_row = max(rows)
+    with zipfile.ZipFile(path) as zf:
+        part = sheet_parts(zf)[sheet]
+        with zf.open(part) as f:
+            tail = b""
+            done = False
+            while not done:
+                chunk = f.read(_CHUNK)
+                data = tail + chunk
+                cut = data.rfind(_ROW_END) + len(_ROW_END) if chunk else len(data)
+                if cut < len(_ROW_END):
+                    cut = 0 if chunk else len(data)
+                for row_match in _ROW.finditer(data, 0, cut):
+                    row = int(row_match.group(1))
+                    if row > last_row:
+                        done = True
+                        break
+                    if row not in rows or not row_match.group(2):
+                        continue
+                    for match in _ANY_COLUMN.finditer(row_match.group(2)):
+                        col = letters.get(match.group(2).decode())
+                        if col is not None:
+                            kind, text = _cell_text(match)
+                            if text is not None:
+                                raw[row][col] = (kind, text)
+                tail = data[cut:]
+                if not chunk:
+                    break
+
+        needed = {int(text) for cells in raw.values() for kind, text in cells.values() if kind == "s"}
+        strings = _shared_strings(zf, needed)
+    return {row: {col: value for col, (kind, text) in cells.items()
+                  if (value := _convert(kind, text, strings)) is not None}
+            for row, cells in raw.items()}
@@ -0,0 +1,70 @@
+import time #for the query time
+import os #for creating file paths
+import sys #for checking if script is being used as exe and the exit code
+import json #for loading paths from config.json file
+import argparse #for the query options
+from pipeline.offer_index import open_offer_index, parse_term, CATEGORIES, SERVICES #for the "x" marks of data1 as bitsets
+from pipeline.supplier_file import clean_nip #NIPs are kept digits only
+
+# Answers "which suppliers offer category k in service column F?" without opening the master file in Excel.
+# Terms: "12F" - category 12 (row 14 of the "offer" sheet) in service column F (D, F or H), "12" - in any of them.
+#   python query_offers.py --all 12F 30D      suppliers offering both
+#   python query_offers.py --any 12 13 --count number of suppliers offering category 12 or 13
+#   python query_offers.py --nip 1234567890   what one supplier offers
+# The index (<master file>.offer_index.bin) is built from the saved master file if it's missing or outdated.
+
+if getattr(sys, 'frozen', False):
+    base_path = os.path.dirname(sys.executable)  # Folder of the .exe
+else:
+    base_path = os.path.dirname(os.path.abspath(__file__))  # Folder of the .py
+
+CONFIG_FILE = os.path.join(base_path, "config.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finds suppliers by the categories they offer (data1 of the master file).")
+    parser.add_argument("--all", nargs="+", default=[], metavar="TERM", help="every term has to match (AND)")
+    parser.add_argument("--any", nargs="+", default=[], metavar="TERM", help="at least one term has to match (OR)")
+    parser.add_argument("--count", action="store_true", help="only print the number of matching suppliers")
+    parser.add_argument("--nip", help="list the offer of one supplier")
+    args = parser.parse_args()
+    if not (args.all or args.any or args.nip):
+        parser.error(f"give --all, --any or --nip (categories 1-{CATEGORIES}, service columns {', '.join(SERVICES)})")
+
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    supplier_file = config.get("supplier_file_location")
+
+    try:
+        all_of = [parse_term(term) for term in args.all]
+        any_of = [parse_term(term) for term in args.any]
+    except ValueError as e:
+        print(f"❌ Invalid term: {e}")
+        return 1
+
+    start = time.perf_counter()
+    offer_index = open_offer_index(supplier_file)
+    loaded = time.perf_counter() - start
+
+    if args.nip:
+        offers = offer_index.offers(clean_nip(args.nip))
+        if offers is None:
+            print(f"❌ NIP {args.nip} is not in data1")
+            return 1
+        print(" ".join(offers) if offers else "ℹ️ No categories offered")
+        return 0
+
+    start = time.perf_counter()
+    found = offer_index.count(all_of, any_of) if args.count else offer_index.suppliers(all_of, any_of)
+    took = time.perf_counter() - start
+    if args.count:
+        print(found)
+    else:
+        for nip, row, name in found:
+            print(f"{nip}\t{row}\t{name}")
+        print(f"🔚 Suppliers found: {len(found)}")
+    print(f"⏱️ Index loaded in {loaded * 1000:.1f} ms, query took {took * 1e6:.0f} µs", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
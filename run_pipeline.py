@@ -0,0 +1,88 @@
+import time #for the start-up time
+STARTED = time.perf_counter()
+
+import os #for creating file paths
+import sys #for checking if script is being used as exe and the exit code
+import json #for loading paths from config.json file
+import argparse #for the options replacing the prompts of scripts 2 and 3
+import warnings #for supressing warnings from openpyxl
+import multiprocessing #for freeze_support when running as exe
+from datetime import datetime #for timestamps
+from pipeline.metrics import Metrics, BufferedLog #for timers/counters of the run and the buffered log.txt
+
+# Runs the download stage (script 2) and the processing stage (script 3) in one process, without prompts -
+# e.g. from the Task Scheduler. Files accepted by the download stage are handed over to the processing stage
+# with their parsed records, so they are not opened again. The processing stage (and openpyxl) is only loaded
+# when there is something in "To_process"; the master file is not opened in Excel at the end.
+# Exit code 1 if the master file couldn't be opened.
+
+if getattr(sys, 'frozen', False):
+    base_path = os.path.dirname(sys.executable)  # Folder of the .exe
+else:
+    base_path = os.path.dirname(os.path.abspath(__file__))  # Folder of the .py
+
+CONFIG_FILE = os.path.join(base_path, "config.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Downloads supplier files from Outlook and processes them, without prompts.")
+    parser.add_argument("--hours", type=int,
+                        help="number of hours to check emails from (default: only the emails received since the last run)")
+    parser.add_argument("--all", action="store_true", help="check emails already processed again (skipped by default)")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    folder_base = config.get("processing_location")
+    supplier_file = config.get("supplier_file_location")
+    to_process = os.path.join(folder_base, 'To_process')
+
+    # Same metrics and log.txt settings as script 3 - the run is written as one "pipeline" line
+    metrics_file = config.get("metrics_file", "metrics.jsonl")
+    metrics = Metrics(os.path.join(folder_base, metrics_file) if metrics_file else None,
+                      bool(config.get("trace_memory", False)), config.get("profile_file"), folder_base)
+    run_log = BufferedLog(os.path.join(folder_base, 'log.txt'))
+    metrics.start("pipeline")
+
+    from pipeline.download import Download
+    metrics.add_time('startup', time.perf_counter() - STARTED)
+
+    handed = {}  # path in "To_process" -> parsed record
+    summary = Download(config, metrics, handed.__setitem__).run(args.hours, not args.all)
+    print(f"\n🔚 Emails matching criteria: {summary['matching']}\n❌ Invalid messages: {summary['invalid']}")
+
+    files = 0
+    writer = workers = None
+    if handed or any(file.endswith('.xlsx') for file in os.listdir(to_process)):
+        from pipeline.processing import Processing
+        processing = Processing(config, metrics, run_log)
+        writer, workers = processing.master_writer, processing.workers
+        start_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        processing.log_error(f"{start_timestamp}▶️ Started processing files from 'To_process' folder")
+
+        # The master file can't be open in Excel (see script 3) - unless it's only written by export_master.py
+        try:
+            if not processing.uses_database:
+                os.rename(supplier_file, supplier_file)
+            with metrics.phase('master_load'):
+                master, nip_index = processing.load_master()
+        except Exception as e:
+            processing.log_error(f"❌ Could not open the master supplier file (is it open in Excel?): {e}")
+            run_log.flush()
+            return 1
+
+        files = processing.process(master, nip_index, start_timestamp, handed)
+        processing.log_error(processing.completion_message())
+        processing.log_summary(metrics.finish(**summary, files=files, writer=writer, workers=workers))
+    else:
+        print("ℹ️ Nothing to process.")
+        metrics.finish(**summary, files=files, writer=writer, workers=workers)
+
+    print(f"⏱️ Time taken: {time.perf_counter() - STARTED:.2f} sec")
+    run_log.flush()
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # Needed for worker processes when running as exe
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import os
+import sys
+import random
+import warnings
+
+import openpyxl
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from synthetic_data import make_nips, generate_master, generate_suppliers  # noqa: E402
+from pipeline.processing import Processing  # noqa: E402
+from pipeline.metrics import Metrics, BufferedLog  # noqa: E402
+
+warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+
+# A processing location with its folders, a master file with the first `known` NIPs of `nips`
+# and one supplier file per NIP in To_process (see benchmarks/synthetic_data.py)
+class Workspace:
+    def __init__(self, folder, nips, known, writer="openpyxl", **config):
+        self.folder = folder
+        self.nips = nips
+        for name in ("To_process", "Invalid_files", "Processed"):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+        self.master = os.path.join(folder, "Supplier Database.xlsm")
+        generate_master(self.master, nips[:known])
+        self.manifest = generate_suppliers(self.to_process, len(nips), nips, 0, 0, 0, 0, msg_bytes=8)
+        self.config = {"processing_location": folder, "supplier_file_location": self.master,
+                       "master_writer": writer, "metrics_file": "", **config}
+
+    @property
+    def to_process(self):
+        return os.path.join(self.folder, "To_process")
+
+    def files(self, name):
+        return sorted(os.listdir(os.path.join(self.folder, name)))
+
+    # Supplier files in a folder (not 0.Invalid.xlsx)
+    def supplier_files(self, name):
+        return [file for file in self.files(name) if file.endswith(".xlsx") and file != "0.Invalid.xlsx"]
+
+    # Suppliers added to the master file in Excel, below the existing rows
+    def add_suppliers(self, nips):
+        wb = openpyxl.load_workbook(self.master, keep_vba=True)
+        for sheet, column in (('data1', 'F'), ('data2', 'H')):
+            ws = wb[sheet]
+            start = ws.max_row + 1
+            for i, nip in enumerate(nips):
+                ws[f"{column}{start + i}"] = nip
+        wb.save(self.master)
+
+    def processing(self):
+        return Processing(self.config, Metrics(None), BufferedLog(os.path.join(self.folder, "log.txt")))
+
+    # One run of script 3 (or of its invalid recheck) - returns the Processing object
+    def run(self, recheck=False, timestamp="2026-01-01 00:00:00"):
+        processing = self.processing()
+        processing.metrics.start("process")
+        master, nip_index = processing.load_master()
+        if recheck:
+            processing.recheck_invalid(master, nip_index, timestamp)
+        else:
+            processing.process(master, nip_index, timestamp)
+        return processing
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    def make(count=6, known=3, **config):
+        return Workspace(str(tmp_path), make_nips(random.Random(0), count), known, **config)
+    return make
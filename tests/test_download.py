@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import pytest
+
+from pipeline.download import Download
+from pipeline.msg_archive import MsgArchive
+from pipeline.metrics import Metrics
+from synthetic_data import make_nips, generate_suppliers
+
+XLSX_TYPE = ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+SHEETS = ('DATA', 'offer', 'Supplier DATA', 'categories')
+
+
+# A "mailbox_directory" stand-in with one supplier file per message
+class Mailbox:
+    def __init__(self, folder):
+        self.folder = folder
+        self.mail = os.path.join(folder, "mail")
+        self.attachments = os.path.join(folder, "attachments")
+        self.data = os.path.join(folder, "Data")
+        os.makedirs(self.mail)
+        os.makedirs(self.data)
+        self.manifest = generate_suppliers(self.attachments, 8, make_nips(random.Random(0), 8), 0, 0, 0, 0, 0, SHEETS)
+        self.sent = 0
+        self.config = {"processing_location": self.data, "mailbox_directory": self.mail, "metrics_file": ""}
+
+    # A message received `minutes` ago with the next supplier file (or the next `files` supplier files)
+    def send(self, minutes, files=1):
+        entries = self.manifest[self.sent:self.sent + files]
+        self.sent += files
+        message = EmailMessage()
+        message["From"] = f"Supplier {self.sent} <supplier{self.sent}@example.com>"
+        message["Subject"] = f"Offer {self.sent}"
+        message["Date"] = format_datetime(datetime.now().astimezone() - timedelta(minutes=minutes))
+        message.set_content("Please find the filled form attached.")
+        for entry in entries:
+            with open(os.path.join(self.attachments, entry['file']), "rb") as f:
+                message.add_attachment(f.read(), maintype=XLSX_TYPE[0], subtype=XLSX_TYPE[1], filename=entry['file'])
+        with open(os.path.join(self.mail, f"{self.sent:05d}.eml"), "wb") as f:
+            f.write(bytes(message))
+
+    def run(self, hours=None, skip_logged=True):
+        metrics = Metrics(None)
+        metrics.start("download")
+        return Download(self.config, metrics).run(hours, skip_logged)
+
+    def watermark(self):
+        conn = sqlite3.connect(os.path.join(self.data, "mail_log.db"))
+        try:
+            row = conn.execute("SELECT received FROM watermarks").fetchone()
+        finally:
+            conn.close()
+        return row and datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+
+
+@pytest.fixture
+def mailbox(tmp_path):
+    return Mailbox(str(tmp_path))
+
+
+def test_only_new_messages_are_checked_after_the_watermark(mailbox):
+    mailbox.send(10)
+    mailbox.send(5)
+    assert mailbox.run()['matching'] == 2
+    # Nothing new - the overlap is fetched but all of it was checked
+    assert mailbox.run()['matching'] == 0
+    mailbox.send(0)
+    assert mailbox.run()['matching'] == 1
+
+
+def test_late_mail_in_the_overlap_is_checked(mailbox):
+    mailbox.send(0)
+    assert mailbox.run()['matching'] == 1
+    mailbox.send(30)  # shows up after the run, received before the watermark
+    assert mailbox.run()['matching'] == 1
+    assert mailbox.run()['matching'] == 0
+    mailbox.send(120)  # older than the overlap (60 minutes by default)
+    assert mailbox.run()['matching'] == 0
+
+
+def test_first_run_checks_the_first_sync_hours(mailbox):
+    mailbox.config["mail_first_sync_hours"] = 1
+    mailbox.send(120)
+    mailbox.send(10)
+    assert mailbox.run()['matching'] == 1
+
+
+def test_overlap_is_skipped_even_without_skipping_logged_messages(mailbox):
+    mailbox.send(5)
+    assert mailbox.run(skip_logged=False)['matching'] == 1
+    assert mailbox.run(skip_logged=False)['matching'] == 0
+
+
+def test_run_over_recent_hours_doesnt_skip_a_gap(mailbox):
+    mailbox.config["mail_first_sync_hours"] = 4 * 24
+    mailbox.send(3 * 24 * 60)
+    assert mailbox.run()['matching'] == 1
+    watermark = mailbox.watermark()
+
+    # Mail of the gap, then a run over the last hour only
+    mailbox.send(2 * 24 * 60)
+    mailbox.send(5)
+    assert mailbox.run(hours=1)['matching'] == 1
+    assert mailbox.watermark() == watermark
+
+    # The next run from the watermark still finds the mail of the gap
+    assert mailbox.run()['matching'] == 1
+    assert mailbox.watermark() > watermark
+
+
+def test_archived_attachments_are_found_by_their_invalid_names(mailbox):
+    mailbox.config["msg_archive"] = True
+    mailbox.send(10, files=2)
+    mailbox.send(5, files=2)
+    mailbox.run(hours=1)
+
+    archive = MsgArchive(os.path.join(mailbox.data, "Archive"))
+    try:
+        # A name listed in 0.Invalid.xlsx finds the attachment and the msg file it came with
+        found = archive.find("Supplier 2_multiple_1")
+        assert [member['name'] for member in found] == ["Supplier 2_multiple.msg", "Supplier 2_multiple_1.xlsx"]
+        # ...and the msg file finds every attachment that came with it
+        found = archive.find("Supplier 4_multiple.msg")
+        assert [member['name'] for member in found] == ["Supplier 4_multiple.msg", "Supplier 4_multiple.xlsx",
+                                                        "Supplier 4_multiple_1.xlsx"]
+    finally:
+        archive.close()
+
+
+# Messages are screened by several threads, but finished one by one in the order of the messages -
+# the files get the same names as when the messages are handled one at a time
+def test_overlapped_screening_finishes_messages_in_order(tmp_path, monkeypatch):
+    finished = []
+    screen_message, finish_message = Download.screen_message, Download.finish_message
+
+    def slow_screen(self, msg, saved):
+        time.sleep(0.02 * (int(os.path.basename(msg.id)[:5]) % 3))
+        return screen_message(self, msg, saved)
+
+    def record_finish(self, screened):
+        finished.append(os.path.basename(screened[0].id))
+        return finish_message(self, screened)
+
+    monkeypatch.setattr(Download, "screen_message", slow_screen)
+    monkeypatch.setattr(Download, "finish_message", record_finish)
+    results = {}
+    for workers in (1, 4):
+        mailbox = Mailbox(str(tmp_path / str(workers)))
+        mailbox.config.update(download_workers=workers, download_queue_size=2)
+        for minutes, files in ((40, 2), (30, 1), (20, 2), (10, 1), (5, 2)):
+            mailbox.send(minutes, files)
+        finished.clear()
+        assert mailbox.run(hours=1)['matching'] == 5
+        # newest first, like the table of messages
+        assert finished == sorted(os.listdir(mailbox.mail), reverse=True)
+        results[workers] = {folder: sorted(os.listdir(os.path.join(mailbox.data, folder)))
+                            for folder in ("To_process", "Invalid_files")}
+    assert results[4] == results[1]
+    assert len(results[4]["To_process"]) == 4  # 2 messages with one file (and their msg files)
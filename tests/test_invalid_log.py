@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+
+from pipeline.invalid_log import COLUMNS, InvalidLog
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "invalid_log.db"), str(tmp_path / "0.Invalid.xlsx")
+
+
+def exported(xlsx_path):
+    df = pd.read_excel(xlsx_path, dtype={'NIP': str}).fillna("")
+    df['Timestamp'] = df['Timestamp'].astype(str)
+    return list(df.itertuples(index=False, name=None))
+
+
+def test_export_keeps_the_newest_entry_of_each_file(paths):
+    log = InvalidLog(*paths)
+    log.add("a.xlsx", "❌ a.xlsx - error: no x", "111", "Processing", "2026-01-01 10:00:00")
+    log.add_many([("b.xlsx", "⚠️ b.xlsx - invalid NIP", "", "Downloading", "2026-01-01 11:00:00"),
+                  ("a.xlsx", "❌ a.xlsx - error: empty category", "111", "Processing", "2026-01-02 10:00:00"),
+                  # an older entry (e.g. from the other script) doesn't replace a newer one
+                  ("a.xlsx", "❌ a.xlsx - missing 'DATA' sheet", "", "Downloading", "2026-01-01 09:00:00")])
+    assert log.added == 4 and log.last_seq() == 4
+    log.export_xlsx()
+    assert log.added == 0
+    assert exported(paths[1]) == [
+        ("a.xlsx", "❌ a.xlsx - error: empty category", "111", "Processing", "2026-01-02 10:00:00"),
+        ("b.xlsx", "⚠️ b.xlsx - invalid NIP", "", "Downloading", "2026-01-01 11:00:00"),
+    ]
+    log.close()
+
+
+def test_entries_of_an_interrupted_run_are_exported_by_the_next_one(paths):
+    log = InvalidLog(*paths)
+    log.add("a.xlsx", "❌ a.xlsx - error: no x", "1", "Processing", "2026-01-01 10:00:00")
+    log.export_xlsx()
+    log.add("b.xlsx", "❌ b.xlsx - error: no x", "2", "Processing", "2026-01-01 11:00:00")
+    log.close()  # no export
+
+    log = InvalidLog(*paths)
+    assert log.added == 1
+    log.close()
+
+
+def test_both_scripts_append_to_the_same_journal(paths):
+    download, processing = InvalidLog(*paths), InvalidLog(*paths)
+    download.add("a.xlsx", "⚠️ a.xlsx - invalid NIP", "", "Downloading", "2026-01-01 10:00:00")
+    processing.add("b.xlsx", "❌ b.xlsx - error: no x", "2", "Processing", "2026-01-01 10:00:01")
+    download.add("c.xlsx", "⚠️ c.xlsx - invalid NIP", "", "Downloading", "2026-01-01 10:00:02")
+    processing.export_xlsx()
+    assert [row[0] for row in exported(paths[1])] == ["c.xlsx", "b.xlsx", "a.xlsx"]
+    download.close()
+    processing.close()
+
+
+def test_old_xlsx_is_imported_into_a_new_journal(paths):
+    db_path, xlsx_path = paths
+    pd.DataFrame([["a.xlsx", "❌ old", "1", "Processing", "2025-12-01 10:00:00"],
+                  ["a.xlsx", "❌ older", "1", "Processing", "2025-11-01 10:00:00"],
+                  ["b.xlsx", "❌ b", "2", "Downloading", "2025-12-02 10:00:00"]],
+                 columns=['File name', 'Message', 'NIP', 'Source', 'Execution time']).to_excel(xlsx_path, index=False)
+    log = InvalidLog(db_path, xlsx_path)
+    assert log.added == 0 and log.last_seq() == 3
+    log.export_xlsx()
+    assert [row[:2] for row in exported(xlsx_path)] == [("b.xlsx", "❌ b"), ("a.xlsx", "❌ old")]
+    assert list(pd.read_excel(xlsx_path).columns) == COLUMNS
+    log.close()
+
+
+def test_resolved_files_leave_the_export_with_their_payload(paths):
+    log = InvalidLog(*paths)
+    log.add("a.xlsx", "⚠️ a.xlsx - NIP not in the master file", "1", "Processing", "2026-01-01 10:00:00")
+    log.add("b.xlsx", "⚠️ b.xlsx - NIP not in the master file", "2", "Processing", "2026-01-01 10:00:00")
+    log.add_payload("a.xlsx", "1", "unknown NIP", {"nip": "1", "marks": [25]}, "2026-01-01 10:00:00")
+    log.add_payload("b.xlsx", "2", "unknown NIP", {"nip": "2", "marks": [26]}, "2026-01-01 10:00:00")
+    assert log.payloads("unknown NIP") == {"a.xlsx": {"nip": "1", "marks": [25]}, "b.xlsx": {"nip": "2", "marks": [26]}}
+
+    log.resolve([("a.xlsx", "a.xlsx", "1", "Recheck", "2026-01-02 10:00:00")])
+    assert log.payloads("unknown NIP") == {"b.xlsx": {"nip": "2", "marks": [26]}}
+    log.export_xlsx()
+    assert [row[0] for row in exported(paths[1])] == ["b.xlsx"]
+    # The journal keeps the whole history
+    messages = [row[0] for row in log.conn.execute("SELECT message FROM journal WHERE file_name = 'a.xlsx' ORDER BY seq")]
+    assert messages[-1] == "Resolved"
+    log.close()
@@ -0,0 +1,105 @@
+import os
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from pipeline.mail_log import COLUMNS, MailLog
+
+
+def keys(n, start=0):
+    return [(f"supplier{i}@example.com", f"Offer {i}", f"2024-05-{1 + i % 28:02d} 10:00:00") for i in range(start, start + n)]
+
+
+def xlsx_rows(path):
+    ws = openpyxl.load_workbook(path).active
+    return [tuple(row) for row in ws.iter_rows(values_only=True)]
+
+
+@pytest.fixture
+def mail_log(tmp_path):
+    log = MailLog(str(tmp_path / "mail_log.db"), str(tmp_path / "mail_log.xlsx"))
+    yield log
+    log.close()
+
+
+def test_new_keys_are_appended_to_the_export(mail_log, monkeypatch):
+    for key in keys(3):
+        mail_log.add(*key)
+    assert mail_log.update_xlsx() == 3
+    assert xlsx_rows(mail_log.xlsx_path) == [tuple(COLUMNS)] + keys(3)
+
+    # Later runs only append - the file is never exported again while it's unchanged
+    monkeypatch.setattr(pd.DataFrame, "to_excel", lambda *args, **kwargs: pytest.fail("mail_log.xlsx exported again"))
+    assert mail_log.update_xlsx() == 0
+    for key in keys(2, start=3) + keys(1):  # a key already logged isn't added twice
+        mail_log.add(*key)
+    assert mail_log.update_xlsx() == 2
+    assert mail_log.update_xlsx() == 0
+    assert xlsx_rows(mail_log.xlsx_path) == [tuple(COLUMNS)] + keys(5)
+    assert pd.read_excel(mail_log.xlsx_path).shape == (5, 3)
+
+
+def test_changed_or_missing_export_is_regenerated(mail_log):
+    for key in keys(2):
+        mail_log.add(*key)
+    mail_log.update_xlsx()
+
+    # Sorted in Excel - appending after its last row could mix up the rows, so it's written again from the store
+    wb = openpyxl.load_workbook(mail_log.xlsx_path)
+    wb.active.delete_rows(2)
+    wb.save(mail_log.xlsx_path)
+    mail_log.add(*keys(1, start=2)[0])
+    assert mail_log.update_xlsx() == 3
+    assert xlsx_rows(mail_log.xlsx_path) == [tuple(COLUMNS)] + keys(3)
+
+    os.remove(mail_log.xlsx_path)
+    assert mail_log.update_xlsx() == 3
+    assert xlsx_rows(mail_log.xlsx_path) == [tuple(COLUMNS)] + keys(3)
+
+
+def test_keys_not_exported_are_appended_by_the_next_run(tmp_path, monkeypatch):
+    db_path, xlsx_path = str(tmp_path / "mail_log.db"), str(tmp_path / "mail_log.xlsx")
+    log = MailLog(db_path, xlsx_path)
+    log.add(*keys(1)[0])
+    log.update_xlsx()
+    log.add(*keys(1, start=1)[0])
+    with monkeypatch.context() as m:
+        m.setattr("pipeline.mail_log.WorkbookPatch.save", lambda self: (_ for _ in ()).throw(PermissionError("open in Excel")))
+        with pytest.raises(PermissionError):
+            log.update_xlsx()
+    log.close()
+
+    log = MailLog(db_path, xlsx_path)
+    log.add(*keys(1, start=2)[0])
+    assert log.update_xlsx() == 2
+    log.close()
+    assert xlsx_rows(xlsx_path) == [tuple(COLUMNS)] + keys(3)
+
+
+def test_old_xlsx_is_imported_into_a_new_store(tmp_path):
+    xlsx_path = str(tmp_path / "mail_log.xlsx")
+    pd.DataFrame(keys(2), columns=COLUMNS).to_excel(xlsx_path, index=False)
+    log = MailLog(str(tmp_path / "mail_log.db"), xlsx_path)
+    assert len(log) == 2 and log.is_logged(*keys(1)[0])
+    log.add(*keys(1, start=2)[0])
+    assert log.update_xlsx() == 3
+    log.close()
+    assert xlsx_rows(xlsx_path) == [tuple(COLUMNS)] + keys(3)
+
+
+def test_watermark_only_moves_forward(mail_log):
+    assert mail_log.watermark("directory:a") is None
+    mail_log.set_watermark("directory:a", datetime(2026, 1, 2, 10, 0, 0), "msg-2")
+    mail_log.set_watermark("directory:a", datetime(2026, 1, 1, 10, 0, 0), "msg-1")
+    mail_log.set_watermark("directory:b", datetime(2026, 1, 1, 9, 0, 0), "other")
+    assert mail_log.watermark("directory:a") == (datetime(2026, 1, 2, 10, 0, 0), "msg-2")
+    assert mail_log.watermark("directory:b") == (datetime(2026, 1, 1, 9, 0, 0), "other")
+
+    # The same time with another message (several messages received in the same second) - the last one checked
+    mail_log.set_watermark("directory:a", datetime(2026, 1, 2, 10, 0, 0), "msg-3")
+    mail_log.close()
+    reopened = MailLog(mail_log.db_path)
+    assert reopened.watermark("directory:a") == (datetime(2026, 1, 2, 10, 0, 0), "msg-3")
+    reopened.close()
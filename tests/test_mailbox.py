@@ -0,0 +1,76 @@
+import os
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+from pipeline.mailbox import COLUMNS, DirectorySource, open_mailbox
+
+
+def write_eml(folder, name, received, sender="Supplier <supplier@example.com>", subject="Offer", attachments=()):
+    message = EmailMessage()
+    message["From"] = sender
+    message["Subject"] = subject
+    if received is not None:
+        message["Date"] = format_datetime(received)
+    message.set_content("Offer attached")
+    for filename, data in attachments:
+        message.add_attachment(data, maintype="application", subtype="octet-stream", filename=filename)
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(bytes(message))
+    return path
+
+
+def test_messages_are_listed_newest_first_in_one_table(tmp_path):
+    folder = str(tmp_path)
+    now = datetime.now().replace(microsecond=0)
+    old = write_eml(folder, "old.eml", (now - timedelta(hours=30)).astimezone())
+    first = write_eml(folder, "first.eml", (now - timedelta(hours=2)).astimezone(), attachments=[("a.xlsx", b"1")])
+    # Dates in another time zone are turned into local time like Outlook does
+    second = write_eml(folder, "second.eml", (now - timedelta(hours=1)).astimezone(timezone(timedelta(hours=-7))),
+                       sender="Other Supplier <other@example.com>", subject="Re: Offer")
+    (tmp_path / "notes.txt").write_text("not a message")
+
+    source = DirectorySource(folder)
+    assert source.source == "directory:" + os.path.abspath(folder)
+    messages = source.fetch(now - timedelta(hours=24))
+    assert list(messages.columns) == COLUMNS
+    assert list(messages["id"]) == [second, first]
+    assert list(messages["sender_email"]) == ["other@example.com", "supplier@example.com"]
+    assert list(messages["sender_name"]) == ["Other Supplier", "Supplier"]
+    assert list(messages["subject"]) == ["Re: Offer", "Offer"]
+    assert list(messages["received"]) == [now - timedelta(hours=1), now - timedelta(hours=2)]
+    assert list(messages["has_attachments"]) == [False, True]
+
+    assert list(source.fetch(now - timedelta(hours=48), until=now - timedelta(hours=2))["id"]) == [old]
+    assert source.fetch(now).empty
+
+
+def test_message_without_date_uses_the_file_time(tmp_path):
+    path = write_eml(str(tmp_path), "undated.eml", None)
+    stamp = datetime(2024, 5, 1, 12, 0).timestamp()
+    os.utime(path, (stamp, stamp))
+    messages = DirectorySource(str(tmp_path)).fetch(datetime(2024, 5, 1))
+    assert list(messages["received"]) == [datetime(2024, 5, 1, 12, 0)]
+
+
+def test_attachments_and_message_are_saved(tmp_path):
+    folder = tmp_path / "mailbox"
+    folder.mkdir()
+    path = write_eml(str(folder), "msg.eml", datetime.now().astimezone(),
+                     attachments=[("offer.xlsx", b"offer bytes"), ("photo.jpg", b"jpg bytes")])
+    source = DirectorySource(str(folder))
+    assert source.attachment_names(path) == ["offer.xlsx", "photo.jpg"]
+
+    source.save_attachment(path, 1, str(tmp_path / "photo.jpg"))
+    source.save_attachment(path, 0, str(tmp_path / "offer.xlsx"))
+    assert (tmp_path / "offer.xlsx").read_bytes() == b"offer bytes"
+    assert (tmp_path / "photo.jpg").read_bytes() == b"jpg bytes"
+
+    source.save_message(path, str(tmp_path / "msg.msg"))
+    assert (tmp_path / "msg.msg").read_bytes() == (folder / "msg.eml").read_bytes()
+
+
+def test_mailbox_directory_switches_to_the_local_backend(tmp_path):
+    source = open_mailbox({"mailbox_directory": str(tmp_path)})
+    assert isinstance(source, DirectorySource) and source.folder == str(tmp_path)
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from pipeline.master import OpenpyxlMaster, PatchedMaster
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("master_class", [OpenpyxlMaster, PatchedMaster])
+def test_interrupted_save_leaves_the_master_file_readable(workspace, monkeypatch, master_class):
+    ws = workspace(count=2, known=2)
+    before = _read(ws.master)
+    master = master_class(ws.master, {'data1': [805]})
+    master.set('data1', 3, 805, "Supplier00001_cat_ok")
+
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt
+    # The new copy is cut off in the middle of being written
+    monkeypatch.setattr(os, "fsync", crash)
+    with pytest.raises(KeyboardInterrupt):
+        master.save()
+
+    assert _read(ws.master) == before
+    assert not [file for file in os.listdir(ws.folder) if file.endswith(".tmp")]
+
+
+def test_save_replaces_the_master_file(workspace):
+    ws = workspace(count=2, known=2)
+    master = OpenpyxlMaster(ws.master)
+    master.set('data1', 3, 805, "Supplier00001_cat_ok")
+    master.save()
+    assert OpenpyxlMaster(ws.master).get('data1', 3, 805) == "Supplier00001_cat_ok"
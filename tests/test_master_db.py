@@ -0,0 +1,82 @@
+import os
+
+import openpyxl
+
+from pipeline.master_db import MasterDatabase, database_path
+from pipeline.xlsx_probe import read_columns
+
+
+def test_nips_added_in_excel_reach_the_database(workspace):
+    ws = workspace(count=6, known=3, writer="sqlite")
+    ws.run()
+    assert len(ws.supplier_files("Invalid_files")) == 3
+
+    ws.add_suppliers(ws.nips[3:])
+    ws.run(recheck=True, timestamp="2026-01-02 00:00:00")
+
+    assert ws.supplier_files("Invalid_files") == []
+    assert len(ws.supplier_files("Processed")) == 6
+
+    db = MasterDatabase(database_path(ws.master), ws.master)
+    try:
+        assert db.export() > 0
+    finally:
+        db.close()
+    data1 = read_columns(ws.master, 'data1', [805], 3)[805]
+    assert sorted(data1.values()) == sorted(entry['file'][:-5] for entry in ws.manifest)
+
+
+def test_rows_filled_by_the_script_are_kept_on_sync(workspace):
+    ws = workspace(count=4, known=4, writer="sqlite")
+    ws.run()
+    db_path = database_path(ws.master)
+    db = MasterDatabase(db_path, ws.master)
+    before = db.conn.execute("SELECT row, file, marks FROM data1 ORDER BY row").fetchall()
+    db.close()
+
+    # The master file was not exported yet - the sync only adds the new rows
+    ws.add_suppliers(["1111111111"])
+    db = MasterDatabase(db_path, ws.master)
+    try:
+        rows = db.conn.execute("SELECT row, file, marks FROM data1 ORDER BY row").fetchall()
+        assert rows[:len(before)] == before
+        assert db.conn.execute("SELECT nip FROM data1 ORDER BY row DESC LIMIT 1").fetchone()[0] == "1111111111"
+    finally:
+        db.close()
+    assert os.path.exists(db_path)
+
+
+def test_export_everything_leaves_rows_never_written_alone(workspace):
+    ws = workspace(count=4, known=4, writer="sqlite")
+    os.remove(os.path.join(ws.to_process, ws.manifest[-1]['file']))  # the last supplier sends nothing
+    ws.run()
+    db_path = database_path(ws.master)
+    db = MasterDatabase(db_path, ws.master)
+    assert db.export() == 6
+    assert db.master_exported()
+    db.close()
+
+    # A cell of the row the script never wrote is edited by hand
+    wb = openpyxl.load_workbook(ws.master, keep_vba=True)
+    wb['data1'].cell(6, 25).value = 'x'
+    wb.save(ws.master)
+
+    db = MasterDatabase(db_path, ws.master)
+    try:
+        assert not db.master_exported()
+        assert db.pending_export(everything=True) == 6
+        assert db.export(everything=True) == 6
+        assert db.master_exported()
+    finally:
+        db.close()
+    assert read_columns(ws.master, 'data1', [25], 6)[25].get(6) == 'x'
+
+
+# The run only updates the database - the message says so instead of naming the master file as updated
+def test_completion_message_names_what_was_updated(workspace):
+    ws = workspace(count=2, known=2, writer="sqlite")
+    assert ws.run().completion_message() == (
+        f"✅ Processing complete. Database updated: {database_path(ws.master)} "
+        f"(export_master.py writes the changes to {ws.master})")
+    ws.config["master_writer"] = "patch"
+    assert ws.processing().completion_message() == f"✅ Processing complete. File updated: {ws.master}"
@@ -0,0 +1,110 @@
+import os
+import re
+import zipfile
+
+import pytest
+
+from pipeline.master_shards import split_master, merge_shards, shard_of
+from pipeline.nip_index import NIP_COLUMNS
+from pipeline.supplier_file import clean_nip
+from pipeline.xlsx_probe import read_columns, sheet_parts
+
+
+def _nips(path, sheet):
+    col, start_row = NIP_COLUMNS[sheet]
+    return {row: value for row, value in read_columns(path, sheet, [col], start_row)[col].items() if value}
+
+
+@pytest.mark.parametrize("writer", ["openpyxl", "patch"])
+def test_files_written_to_the_shards_are_in_the_merged_master(workspace, writer):
+    ws = workspace(count=6, known=6, writer=writer, sharded_master=True)
+    layout = split_master(ws.master, 3)
+    original = {sheet: _nips(ws.master, sheet) for sheet in NIP_COLUMNS}
+    # Each shard has only its own suppliers, at the rows they have in the master file
+    for shard, path in enumerate(layout.paths):
+        for sheet in NIP_COLUMNS:
+            rows = _nips(path, sheet)
+            assert rows == {row: nip for row, nip in original[sheet].items() if shard_of(clean_nip(nip), 3) == shard}
+
+    with open(ws.master, "rb") as f:
+        before = f.read()
+    ws.run()
+    with open(ws.master, "rb") as f:
+        assert f.read() == before  # only the shards are written
+    merged = os.path.join(ws.folder, "merged.xlsm")
+    merge_shards(layout, merged)
+
+    assert {sheet: _nips(merged, sheet) for sheet in NIP_COLUMNS} == original
+    rows = {clean_nip(nip): row for row, nip in original['data1'].items()}
+    filled = read_columns(merged, 'data1', [805], 3)[805]
+    assert filled == {rows[entry['nip']]: entry['file'][:-5] for entry in ws.manifest}
+
+
+_XF = re.compile(rb'<xf\b[^>]*?(?:/>|>.*?</xf>)', re.S)
+
+
+# Rewrites some parts of a workbook
+def rewrite(path, change):
+    with zipfile.ZipFile(path) as zf:
+        parts = [(info, zf.read(info)) for info in zf.infolist()]
+        sheets = {part: sheet for sheet, part in sheet_parts(zf).items()}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for info, data in parts:
+            zf.writestr(info, change(info.filename, sheets.get(info.filename), data))
+
+
+# Style numbers of the cells of every row of data1
+def row_styles(path):
+    with zipfile.ZipFile(path) as zf:
+        xml = zf.read(sheet_parts(zf)['data1'])
+    return {int(row): re.findall(rb'<c [^>]*?\ss="(\d+)"', cells)
+            for row, cells in re.findall(rb'<row [^>]*?r="(\d+)"[^>]*>(.*?)</row>', xml, re.S)}
+
+
+# The cell styles of a shard: the xf elements of cellXfs and the rest of styles.xml around them
+def split_styles(data):
+    start, end = re.search(rb'<cellXfs[^>]*>(.*?)</cellXfs>', data, re.S).span(1)
+    return data[:start], _XF.findall(data, start, end), data[end:]
+
+
+def test_styles_numbered_again_in_a_shard_are_merged_as_the_same_styles(workspace):
+    ws = workspace(count=6, known=6, writer="patch", sharded_master=True)
+    layout = split_master(ws.master, 2)
+    used = {int(s) for row, styles in row_styles(layout.paths[1]).items() if row >= 3 for s in styles}
+    a, b = sorted(used)[0], 0
+
+    # Shard 2 saved by a program that swapped two of its cell styles
+    def swap(name, sheet, data):
+        if name == "xl/styles.xml":
+            head, xfs, tail = split_styles(data)
+            xfs[a], xfs[b] = xfs[b], xfs[a]
+            return head + b"".join(xfs) + tail
+        if sheet:
+            numbers = {str(a).encode(): str(b).encode(), str(b).encode(): str(a).encode()}
+            return re.sub(rb'(\ss=")(\d+)(")', lambda m: m.group(1) + numbers.get(m.group(2), m.group(2)) + m.group(3), data)
+        return data
+    rewrite(layout.paths[1], swap)
+
+    merged = os.path.join(ws.folder, "merged.xlsm")
+    merge_shards(layout, merged)
+    assert row_styles(merged) == row_styles(ws.master)
+
+
+def test_a_style_missing_from_the_first_shard_stops_the_merge(workspace):
+    ws = workspace(count=6, known=6, writer="patch", sharded_master=True)
+    layout = split_master(ws.master, 2)
+    used = {int(s) for row, styles in row_styles(layout.paths[1]).items() if row >= 3 for s in styles}
+
+    # Shard 2 got a font the first shard doesn't have
+    def new_font(name, sheet, data):
+        if name != "xl/styles.xml":
+            return data
+        fonts = int(re.search(rb'<fonts count="(\d+)"', data).group(1))
+        data = data.replace(b"</fonts>", b'<font><sz val="99"/><name val="Impact"/></font></fonts>')
+        head, xfs, tail = split_styles(data)
+        xfs[min(used)] = re.sub(rb'fontId="\d+"', b'fontId="%d"' % fonts, xfs[min(used)])
+        return head + b"".join(xfs) + tail
+    rewrite(layout.paths[1], new_font)
+
+    with pytest.raises(ValueError, match="cell style"):
+        merge_shards(layout, os.path.join(ws.folder, "merged.xlsm"))
@@ -0,0 +1,55 @@
+import zipfile
+
+from pipeline.msg_archive import MsgArchive
+
+
+def write_msg(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_container_is_readable_after_every_add(tmp_path):
+    archive = MsgArchive(str(tmp_path / "Archive"))
+    names = [archive.add(str(write_msg(tmp_path, "a.msg", bytes([i]) * 100)), "a.msg", "a.xlsx") for i in range(3)]
+    assert names == ["a.msg", "a_1.msg", "a_2.msg"]
+    member = archive.find("a_1.msg")[0]
+    with zipfile.ZipFile(tmp_path / "Archive" / member["archive"]) as zf:
+        assert zf.namelist() == names
+        assert zf.read("a_1.msg") == bytes([1]) * 100
+    archive.close()
+
+
+def test_member_without_index_entry_is_taken_over(tmp_path):
+    archive = MsgArchive(str(tmp_path / "Archive"))
+    archive.add(str(write_msg(tmp_path, "a.msg", b"first")), "a.msg", "a.xlsx")
+    day = archive.archive
+    archive.close()
+    # Interrupted run: the member was written but the index entry was not
+    with zipfile.ZipFile(tmp_path / "Archive" / day, "a") as zf:
+        zf.writestr("a_1.msg", b"second")
+        zf.writestr("b.msg", b"other")
+
+    archive = MsgArchive(str(tmp_path / "Archive"))
+    assert archive.add(str(write_msg(tmp_path, "a.msg", b"second")), "a.msg", "a.xlsx") == "a_1.msg"
+    # A different file with the name of an unindexed member gets the next name
+    assert archive.add(str(write_msg(tmp_path, "b.msg", b"changed")), "b.msg", "b.xlsx") == "b_1.msg"
+    archive.close()
+    with zipfile.ZipFile(tmp_path / "Archive" / day) as zf:
+        assert sorted(zf.namelist()) == ["a.msg", "a_1.msg", "b.msg", "b_1.msg"]
+
+
+def test_a_full_container_is_followed_by_the_next_one(tmp_path):
+    archive = MsgArchive(str(tmp_path / "Archive"), max_members=2)
+    for i in range(5):
+        archive.add(str(write_msg(tmp_path, "a.msg", bytes([i]))), "a.msg", "a.xlsx")
+    archive.close()
+    # A later run goes on with the last container of the day
+    archive = MsgArchive(str(tmp_path / "Archive"), max_members=2)
+    archive.add(str(write_msg(tmp_path, "a.msg", b"late")), "a.msg", "a.xlsx")
+    containers = [member['archive'] for member in archive.find("a.xlsx")]
+    archive.close()
+    day = containers[0][:-4]
+    assert containers == [f"{day}.zip"] * 2 + [f"{day}_1.zip"] * 2 + [f"{day}_2.zip"] * 2
+    with zipfile.ZipFile(tmp_path / "Archive" / f"{day}_2.zip") as zf:
+        assert zf.namelist() == ["a_4.msg", "a_5.msg"]
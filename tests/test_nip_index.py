@@ -0,0 +1,70 @@
+import os
+import json
+
+from synthetic_data import generate_suppliers
+from pipeline.offer_index import FILE_COLUMN
+from pipeline.xlsx_probe import read_columns
+from pipeline.nip_index import NIP_COLUMNS, NipIndex, build_nip_map, master_unchanged, file_key
+
+
+def test_last_row_of_a_nip_wins():
+    mapping, duplicates = build_nip_map({3: "PL 111-222", 4: None, 5: "abc", 6: "111222", 7: 333, 8: "PL111222"})
+    assert mapping == {"111222": 8, "333": 7}
+    assert duplicates == {"111222": [3, 6, 8]}
+
+
+def test_index_is_kept_while_the_master_file_is_the_same(workspace):
+    ws = workspace(count=4, known=4)
+    ws.run()
+    index = NipIndex(ws.master)
+    assert index.load()
+    assert set(index.maps) == set(NIP_COLUMNS)
+    assert index.maps['data1'] == {nip: 3 + i for i, nip in enumerate(ws.nips)}
+
+    # Copied or touched - another modification time, the same content
+    stamp = os.stat(ws.master).st_mtime + 60
+    os.utime(ws.master, (stamp, stamp))
+    assert NipIndex(ws.master).load()
+
+    # Any change of the content
+    with open(ws.master, "ab") as f:
+        f.write(b"\0")
+    assert not NipIndex(ws.master).load()
+
+
+def test_broken_or_incomplete_index_is_not_loaded(workspace):
+    ws = workspace(count=2, known=2)
+    ws.run()
+    index_path = ws.master + ".nip_index.json"
+    with open(index_path, encoding="utf-8") as f:
+        stored = json.load(f)
+    assert master_unchanged(ws.master, stored["master"])
+    assert stored["master"] == file_key(ws.master)
+
+    del stored["maps"]["data2"]
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(stored, f)
+    assert not NipIndex(ws.master).load()
+
+    with open(index_path, "w", encoding="utf-8") as f:
+        f.write("{")
+    assert not NipIndex(ws.master).load()
+
+
+# Suppliers added to the master file in Excel are found by the next run
+def test_index_is_built_again_after_the_master_file_changed(workspace):
+    ws = workspace(count=5, known=3)
+    ws.run()
+    assert len(ws.supplier_files("Invalid_files")) == 2
+
+    ws.add_suppliers(ws.nips[3:])
+    assert not NipIndex(ws.master).load()
+    generate_suppliers(ws.to_process, 2, ws.nips[3:], seed=1, no_x_rate=0, empty_category_rate=0, bad_nip_rate=0)
+    ws.run(timestamp="2026-01-02 00:00:00")
+    assert ws.files("To_process") == []
+    names = read_columns(ws.master, 'data1', [FILE_COLUMN], 3)[FILE_COLUMN]
+    assert [names[row] for row in (6, 7)] == ["Supplier00001_cat_ok", "Supplier00002_cat_ok"]
+
+    index = NipIndex(ws.master)
+    assert index.load()
+    assert index.maps['data1'] == {nip: 3 + i for i, nip in enumerate(ws.nips)}
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from pipeline.offer_engine import START_COL, SERVICE_COLUMNS, MAX_CATEGORIES, evaluate_offer
+
+WIDTH = SERVICE_COLUMNS[-1][1] + 1  # columns A-H, as read_supplier_file() gives them
+
+
+# The row-by-row checks script 3 made before the engine - the engine has to give the same answers
+def reference(rows):
+    missing_x = True
+    empty_category = False
+    for row in rows:
+        for i_service, i_x in SERVICE_COLUMNS:
+            if str(row[i_x]).strip().lower() == 'x':
+                missing_x = False
+                if str(row[i_service]).strip() == '-':
+                    empty_category = True
+    marks = []
+    for i, (_, column) in enumerate(SERVICE_COLUMNS):
+        for idx in range(min(MAX_CATEGORIES, len(rows) - 2)):
+            if str(rows[idx + 2][column]).strip().lower() == 'x':
+                marks.append(START_COL + i + idx * 3)
+    return missing_x, empty_category, marks
+
+
+def evaluated(rows):
+    missing_x, empty_category, marks = evaluate_offer(rows)
+    return missing_x, empty_category, marks.tolist()
+
+
+# Offer sheet like the supplier form: 2 header rows + categories, with "x" marks in D/F/H
+def make_offer(rng, x_rate=0.1, dash_rate=0.05, rows=MAX_CATEGORIES + 2, marks=("x", "X", " x ")):
+    offer = [("LP", "Category", "Service type A", "Offer", "Service type B", "Offer", "Service type C", "Offer"),
+             ("Info", "Info", "Info", 'Please enter "x"', "Info", 'Please enter "x"', "Info", 'Please enter "x"')]
+    for n in range(rows - 2):
+        row = [n + 1, f"Category{n + 1}"]
+        for _ in SERVICE_COLUMNS:
+            row.append("-" if rng.random() < dash_rate else f"Service {n}")
+            row.append(rng.choice(marks) if rng.random() < x_rate else None)
+        offer.append(tuple(row))
+    return offer
+
+
+@pytest.mark.parametrize("x_rate", [0.0, 0.02, 0.1, 0.5])
+@pytest.mark.parametrize("dash_rate", [0.0, 0.05])
+def test_engine_matches_the_row_by_row_checks(x_rate, dash_rate):
+    offer = make_offer(random.Random(0), x_rate, dash_rate)
+    assert evaluated(offer) == reference(offer)
+
+
+# Sheets with no categories, only the headers, and more rows than the master file has categories
+@pytest.mark.parametrize("rows", [0, 1, 2, 3, 50, MAX_CATEGORIES + 2, 400])
+def test_engine_matches_for_any_number_of_rows(rows):
+    offer = make_offer(random.Random(rows), x_rate=0.3, rows=rows)
+    assert evaluated(offer) == reference(offer)
+
+
+def test_empty_sheet_has_no_x():
+    assert evaluated([]) == (True, False, [])
+
+
+# A sheet narrower than column H comes padded with empty cells from read_supplier_file()
+def test_narrow_sheet():
+    offer = [("LP", "Category", "Service", "Offer"), ("Info", "Info", "Info", "x")]
+    offer += [(n, f"Category{n}", "-" if n == 3 else f"Service {n}", "x" if n % 2 else None) for n in range(1, 6)]
+    padded = [row + (None,) * (WIDTH - len(row)) for row in offer]
+    assert evaluated(padded) == reference(padded) == (False, True, [START_COL, START_COL + 6, START_COL + 12])
+
+
+# Only "x" (any case, any spaces around it) is a mark - other answers and numbers are not
+def test_other_answers_are_not_marks():
+    offer = make_offer(random.Random(1), x_rate=1.0, dash_rate=0.0, rows=12,
+                       marks=("no", "xx", "x.", "y", 0, 1.5, True, "", " ", "-"))
+    assert evaluated(offer) == reference(offer) == (True, False, [])
+    offer[5] = offer[5][:3] + (" X\t",) + offer[5][4:]
+    assert evaluated(offer) == reference(offer) == (False, False, [START_COL + 3 * 3])
@@ -0,0 +1,76 @@
+import openpyxl
+import pytest
+
+from pipeline.offer_index import (CATEGORIES, LAST_COL, OfferIndex, offer_column, offer_term, open_offer_index,
+                                  parse_term)
+from pipeline.offer_engine import START_COL
+
+
+# {NIP: sorted "x" columns} of data1, read cell by cell
+def marks_in_master(path, nips):
+    ws = openpyxl.load_workbook(path, read_only=True, data_only=True)['data1']
+    marks = {}
+    for row in ws.iter_rows(min_row=3, values_only=True):
+        if row[5] in nips:
+            marks[row[5]] = [col for col in range(START_COL, LAST_COL + 1)
+                             if len(row) >= col and str(row[col - 1] or "").strip().lower() == 'x']
+    return marks
+
+
+def test_terms():
+    assert offer_column(1, 'D') == START_COL and offer_column(1, 'h') == START_COL + 2
+    assert offer_column(CATEGORIES, 'H') == LAST_COL
+    assert [offer_term(col) for col in (START_COL, START_COL + 4, LAST_COL)] == ["1D", "2F", f"{CATEGORIES}H"]
+    assert parse_term(" 12f ") == [offer_column(12, 'F')]
+    assert parse_term("12") == [offer_column(12, service) for service in "DFH"]
+    with pytest.raises(ValueError):
+        parse_term(f"{CATEGORIES + 1}D")
+
+
+def test_index_follows_the_rows_written_by_script_3(workspace):
+    ws = workspace(count=8, known=5)
+    open_offer_index(ws.master)
+    ws.run()
+    assert ws.supplier_files("Processed")
+
+    # Updated row by row and saved with the master file - the same as an index built from the saved file
+    kept = OfferIndex(ws.master)
+    assert kept.load()
+    built = OfferIndex(ws.master)
+    built.build()
+    assert sorted(zip(kept.nips, kept.rows, kept.names)) == sorted(zip(built.nips, built.rows, built.names))
+    for nip in built.nips:
+        assert kept.offers(nip) == built.offers(nip)
+
+    marks = marks_in_master(ws.master, set(ws.nips[:5]))
+    for nip, columns in marks.items():
+        assert kept.offers(nip) == [offer_term(col) for col in columns]
+
+    # Queries give the suppliers with an "x" in the columns of the terms
+    col = next(columns[0] for columns in marks.values() if columns)
+    term = offer_term(col)
+    expected = {nip for nip, columns in marks.items() if col in columns}
+    assert {nip for nip, _, _ in kept.suppliers([parse_term(term)])} == expected
+    category = parse_term(term[:-1])
+    assert kept.count(any_of=[category]) == sum(any(c in columns for c in category) for columns in marks.values())
+    other = offer_term(LAST_COL)
+    assert kept.count([parse_term(term), parse_term(other)]) == sum(
+        col in columns and LAST_COL in columns for columns in marks.values())
+
+
+def test_index_is_built_again_after_the_master_file_changed(workspace):
+    ws = workspace(count=4, known=4)
+    offer_index = open_offer_index(ws.master)
+    nip = offer_index.nips[0]
+    assert offer_index.offers(nip) == []
+
+    # An "x" typed in Excel
+    wb = openpyxl.load_workbook(ws.master, keep_vba=True)
+    sheet = wb['data1']
+    row = offer_index.rows[0]
+    sheet.cell(row=row, column=offer_column(2, 'F'), value='X')
+    wb.save(ws.master)
+
+    assert not OfferIndex(ws.master).load()
+    assert open_offer_index(ws.master).offers(nip) == ["2F"]
+    assert OfferIndex(ws.master).load()
@@ -0,0 +1,34 @@
+import os
+
+import pandas as pd
+
+from pipeline.processing import Processing
+from pipeline.xlsx_probe import read_columns
+
+
+def test_recheck_processes_the_files_whose_nip_was_added(workspace, monkeypatch):
+    ws = workspace(count=5, known=3)
+    ws.run()
+    rejected = ws.supplier_files("Invalid_files")
+    assert len(rejected) == 2
+    added = ws.manifest[3]
+    ws.add_suppliers([added['nip']])
+
+    parse_paths = Processing.parse_paths
+    parsed = []
+
+    def recording(self, paths):
+        parsed.extend(paths)
+        return parse_paths(self, paths)
+    monkeypatch.setattr(Processing, "parse_paths", recording)
+    ws.run(recheck=True, timestamp="2026-01-02 00:00:00")
+
+    # Processed from the record kept when it was rejected - not opened again
+    assert not [path for path in parsed if path.endswith(added['file'])]
+    assert added['file'] in ws.supplier_files("Processed")
+    assert added['file'][:-5] + ".msg" in ws.files(os.path.join("Processed", "Processed_msg"))
+    assert ws.supplier_files("Invalid_files") == [ws.manifest[4]['file']]
+    filled = read_columns(ws.master, 'data1', [805], 3)[805]
+    assert added['file'][:-5] in filled.values()
+    invalid = pd.read_excel(os.path.join(ws.folder, "Invalid_files", "0.Invalid.xlsx"))
+    assert list(invalid['File name']) == [ws.manifest[4]['file'][:-5]]
@@ -0,0 +1,50 @@
+import os
+import json
+import shutil
+
+from synthetic_data import generate_suppliers
+from pipeline.processing import OFFER_COLUMNS
+from pipeline.offer_index import offer_term
+from pipeline.xlsx_probe import read_rows
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _changes(ws):
+    with open(os.path.join(ws.folder, "changes.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _marks(ws, row):
+    values = read_rows(ws.master, 'data1', [row], list(OFFER_COLUMNS))[row]
+    return {col for col, value in values.items() if value == 'x'}
+
+
+def test_resubmission_writes_only_the_changed_cells(workspace):
+    ws = workspace(count=1, known=1, writer="patch")
+    ws.run()
+    first = ws.manifest[0]['file']
+    row = 3
+    before = _marks(ws, row)
+
+    # The same file again: the master file is not touched
+    shutil.copy(os.path.join(ws.folder, "Processed", first), os.path.join(ws.to_process, "Resent.xlsx"))
+    saved = _read(ws.master)
+    processing = ws.run(timestamp="2026-01-02 00:00:00")
+    assert _read(ws.master) == saved
+    assert processing.metrics.counters['unchanged'] == 1
+    assert _changes(ws)[-1]['unchanged'] is True
+    assert _changes(ws)[-1]['previous'] == first[:-5]
+
+    # A new offer of the same supplier: only the cells that differ are written
+    generate_suppliers(ws.to_process, 1, ws.nips, seed=1, no_x_rate=0, empty_category_rate=0, bad_nip_rate=0)
+    processing = ws.run(timestamp="2026-01-03 00:00:00")
+    after = _marks(ws, row)
+    change = _changes(ws)[-1]
+    assert after != before
+    assert change['added'] == [offer_term(col) for col in sorted(after - before)]
+    assert change['removed'] == [offer_term(col) for col in sorted(before - after)]
+    assert processing.metrics.counters['cells_written'] == len(after ^ before) + len(change['changed']) + 1
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from pipeline.processing import Processing
+from pipeline.update_journal import UpdateJournal
+from pipeline.xlsx_probe import read_columns
+
+
+def test_run_interrupted_before_a_save_is_replayed_from_the_journal(workspace, monkeypatch):
+    ws = workspace(count=6, known=6, checkpoint_files=2)
+    checkpoint = Processing.checkpoint
+    calls = []
+
+    # Killed while the second batch is waiting to be saved
+    def crash_on_second(self, *args):
+        calls.append(len(args[-1]))
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return checkpoint(self, *args)
+    monkeypatch.setattr(Processing, "checkpoint", crash_on_second)
+    with pytest.raises(KeyboardInterrupt):
+        ws.run()
+    monkeypatch.setattr(Processing, "checkpoint", checkpoint)
+
+    saved = ws.supplier_files("Processed")
+    assert len(saved) == 2
+    journal = UpdateJournal(os.path.join(ws.folder, "update_journal.db"))
+    unsaved = sorted(record['file'] for record, is_saved in journal.unfinished() if not is_saved)
+    journal.close()
+    assert len(unsaved) == 2
+
+    # The unsaved updates are written again from the journal - the files are not parsed again
+    parse_paths = Processing.parse_paths
+    parsed = []
+
+    def recording(self, paths):
+        parsed.extend(paths)
+        return parse_paths(self, paths)
+    monkeypatch.setattr(Processing, "parse_paths", recording)
+    processing = ws.run(timestamp="2026-01-02 00:00:00")
+
+    assert processing.metrics.counters['resumed'] == 2
+    assert not {path for path in parsed if path.endswith(tuple(unsaved))}
+    assert ws.supplier_files("To_process") == []
+    valid = sorted(entry['file'] for entry in ws.manifest if entry['expected'] == 'ok')
+    assert ws.supplier_files("Processed") == valid
+    filled = read_columns(ws.master, 'data1', [805], 3)[805]
+    assert sorted(filled.values()) == [file[:-5] for file in valid]
+
+
+# Killed after the master file was saved, before its journal entries were marked as saved: the next run finds
+# the updates in the saved master file and only moves the files (no "no changes" entries of the same files)
+@pytest.mark.parametrize("writer", ["openpyxl", "patch", "sqlite"])
+def test_run_interrupted_after_a_save_doesnt_write_again(workspace, monkeypatch, writer):
+    ws = workspace(count=4, known=4, writer=writer, checkpoint_files=2)
+    finish_batch = Processing.finish_batch
+
+    def crash(self, journal, pending):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(Processing, "finish_batch", crash)
+    with pytest.raises(KeyboardInterrupt):
+        ws.run()
+    monkeypatch.setattr(Processing, "finish_batch", finish_batch)
+    assert ws.supplier_files("Processed") == []
+
+    processing = ws.run(timestamp="2026-01-02 00:00:00")
+    assert processing.metrics.counters.get('resumed', 0) == 0
+    assert processing.metrics.counters.get('unchanged', 0) == 0
+    assert ws.supplier_files("To_process") == []
+    assert ws.supplier_files("Processed") == sorted(entry['file'] for entry in ws.manifest)
+    changes = os.path.join(ws.folder, "changes.jsonl")
+    assert not os.path.exists(changes) or os.path.getsize(changes) == 0
+    processing.run_log.flush()
+    with open(os.path.join(ws.folder, "log.txt"), encoding="utf-8") as f:
+        assert "no changes since" not in f.read()
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import run_pipeline
+from pipeline.processing import Processing
+from pipeline.xlsx_probe import read_columns
+from synthetic_data import generate_suppliers
+
+XLSX_TYPE = ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+SHEETS = ('DATA', 'offer', 'Supplier DATA', 'categories')
+
+
+# One .eml message per supplier file, in a "mailbox_directory" stand-in
+def write_mailbox(folder, attachments, manifest):
+    os.makedirs(folder)
+    for i, entry in enumerate(manifest, 1):
+        message = EmailMessage()
+        message["From"] = f"Supplier {i} <supplier{i}@example.com>"
+        message["Subject"] = f"Offer {i}"
+        message["Date"] = format_datetime(datetime.now().astimezone() - timedelta(minutes=i))
+        message.set_content("Please find the filled form attached.")
+        with open(os.path.join(attachments, entry['file']), "rb") as f:
+            message.add_attachment(f.read(), maintype=XLSX_TYPE[0], subtype=XLSX_TYPE[1], filename=entry['file'])
+        with open(os.path.join(folder, f"{i:05d}.eml"), "wb") as f:
+            f.write(bytes(message))
+
+
+# Supplier file names without what the download stage adds ("<attachment>_<category>_<date>.xlsx")
+def stems(files):
+    return sorted(file.split("_cat_")[0] for file in files)
+
+
+def test_runner_downloads_and_processes_in_one_go(workspace, tmp_path, monkeypatch):
+    ws = workspace(count=4, known=3)
+    for file in os.listdir(ws.to_process):
+        os.remove(os.path.join(ws.to_process, file))
+    attachments = str(tmp_path / "attachments")
+    manifest = generate_suppliers(attachments, 4, ws.nips, 0, 0, 0, 0, 0, SHEETS)
+    write_mailbox(str(tmp_path / "mail"), attachments, manifest)
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({**ws.config, "mailbox_directory": str(tmp_path / "mail")}), encoding="utf-8")
+    monkeypatch.setattr(run_pipeline, "CONFIG_FILE", str(config))
+    monkeypatch.setattr(sys, "argv", ["run_pipeline.py", "--hours", "24"])
+
+    # The files accepted by the download stage are handed over with their records, not opened again
+    parse_paths = Processing.parse_paths
+    parsed = []
+
+    def recording(self, paths):
+        parsed.extend(paths)
+        return parse_paths(self, paths)
+    monkeypatch.setattr(Processing, "parse_paths", recording)
+
+    assert run_pipeline.main() == 0
+
+    assert parsed == []
+    known = [entry for entry in manifest if entry['nip'] in ws.nips[:3]]
+    assert ws.supplier_files("To_process") == []
+    assert stems(ws.supplier_files("Processed")) == stems(entry['file'] for entry in known)
+    assert stems(ws.supplier_files("Invalid_files")) == stems([manifest[3]['file']])
+    filled = read_columns(ws.master, 'data1', [805], 3)[805]
+    assert stems(filled.values()) == stems(entry['file'] for entry in known)
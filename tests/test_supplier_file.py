@@ -0,0 +1,129 @@
+import random
+
+import openpyxl
+import pytest
+from openpyxl import Workbook
+
+from synthetic_data import write_supplier_workbook
+from pipeline.supplier_file import DATA_MAPPING, parse_supplier_file, read_supplier_file, record_content, record_for_file
+
+HEADER = [["LP", "Category", "Service type A", "Offer", "Service type B", "Offer", "Service type C", "Offer"],
+          ["Info", "Info", "Info", "x?", "Info", "x?", "Info", "x?"]]
+
+
+def write_workbook(path, data=True, nip="PL 123-456 78", offer=None):
+    wb = Workbook()
+    wb.remove(wb.active)
+    if data:
+        ws = wb.create_sheet("DATA")
+        for i in range(1, 22):
+            ws.cell(row=i, column=3, value=nip if i == 7 else f"info {i}")
+    if offer is not None:
+        ws = wb.create_sheet("offer")
+        for row in offer:
+            ws.append(row)
+    if not wb.sheetnames:
+        wb.create_sheet("other")
+    wb.save(path)
+    return str(path)
+
+
+def offer(*rows):
+    return HEADER + [list(row) for row in rows]
+
+
+def test_valid_file(tmp_path):
+    path = write_workbook(tmp_path / "Supplier A.xlsx", offer=offer(
+        [1, "Category1", "Service 1", "x", "Service 2", None, "Service 3", " X "],
+        [2, "Category2", "Service 4", None, "Service 5", "x", "-", None]))
+    record = parse_supplier_file(path)
+    assert record['status'] == 'ok' and record['message'] == ''
+    assert record['supplier_name'] == "Supplier A"
+    assert record['nip'] == "12345678"
+    # D column first, then F, then H; three data1 columns per category
+    assert record['marks'] == [25, 29, 27]
+    assert record['data'] == {col: f"info {cell[1:]}" for cell, col in DATA_MAPPING.items()}
+
+    # The same file handed over in memory gives the same record
+    with open(path, 'rb') as f:
+        assert parse_supplier_file(path, f.read()) == record
+
+
+@pytest.mark.parametrize("kwargs, reason, nip", [
+    (dict(data=False, offer=offer([1, "C1", "S1", "x"])), 'Missing DATA', ''),
+    (dict(nip="none", offer=offer([1, "C1", "S1", "x"])), 'Invalid NIP', ''),
+    (dict(nip=None, offer=offer([1, "C1", "S1", "x"])), 'Invalid NIP', ''),
+    (dict(), 'Missing offer sheet', '12345678'),
+    (dict(offer=offer([1, "C1", "S1", "xx", "S2", "no"])), 'no x', '12345678'),
+    (dict(offer=HEADER), 'no x', '12345678'),
+    (dict(offer=offer([1, "C1", "S1", "x"], [2, "C2", " - ", "x"])), 'empty category', '12345678'),
+])
+def test_invalid_files(tmp_path, kwargs, reason, nip):
+    path = write_workbook(tmp_path / "Supplier B.xlsx", **kwargs)
+    record = parse_supplier_file(path)
+    assert (record['status'], record['reason'], record['nip']) == ('invalid', reason, nip)
+    assert record['message'].startswith(("❌ Supplier B.xlsx", "⚠️ Supplier B.xlsx"))
+    assert record['marks'] == [] and record['data'] == {}
+
+
+def test_file_that_is_not_a_workbook(tmp_path):
+    path = tmp_path / "Supplier C.xlsx"
+    path.write_bytes(b"not a zip")
+    assert parse_supplier_file(str(path))['reason'] == 'Missing DATA'
+
+
+# Offer sheets narrower than column H are padded with empty cells and checked like any other
+# (the scripts used to stop with an IndexError on them)
+def test_offer_sheet_narrower_than_column_h(tmp_path):
+    path = write_workbook(tmp_path / "Supplier D.xlsx", offer=[
+        *[row[:4] for row in HEADER],
+        [1, "Category1", "Service 1", None],
+        [2, "Category2", "Service 4", "x"]])
+    data_cells, offer_rows = read_supplier_file(path)
+    assert data_cells['C7'] == "PL 123-456 78"
+    assert [len(row) for row in offer_rows] == [8] * 4
+    assert offer_rows[3] == (2, "Category2", "Service 4", "x", None, None, None, None)
+
+    record = parse_supplier_file(path)
+    assert record['status'] == 'ok'
+    assert record['marks'] == [28]
+
+    path = write_workbook(tmp_path / "Supplier E.xlsx", offer=[["LP", "Category"], [1, "Category1"]])
+    assert parse_supplier_file(path)['reason'] == 'no x'
+
+
+def test_record_round_trip_through_its_content(tmp_path):
+    path = write_workbook(tmp_path / "Supplier F.xlsx", offer=offer([1, "C1", "-", "x"]))
+    record = parse_supplier_file(path)
+    renamed = record_for_file(record_content(record), str(tmp_path / "Supplier G.xlsx"))
+    assert renamed['supplier_name'] == "Supplier G"
+    assert renamed['message'] == "❌ Supplier G.xlsx - error: empty category"
+    assert record_content(renamed) == record_content(record)
+
+
+# The single read-only pass gives the cells a full openpyxl load of the file gives
+@pytest.mark.parametrize("kind", ['ok', 'no_x', 'empty_category'])
+def test_single_pass_reads_what_a_full_load_reads(tmp_path, kind, monkeypatch):
+    path = str(tmp_path / "Supplier H.xlsx")
+    write_supplier_workbook(path, random.Random(kind), "Supplier H", "PL1234567890", kind)
+    wb = openpyxl.load_workbook(path, data_only=True)
+    expected_data = {f'C{i}': wb['DATA'][f'C{i}'].value for i in range(1, 22)}
+    expected_rows = [tuple(cell.value for cell in row) for row in wb['offer'].iter_rows(min_col=1, max_col=8)]
+
+    loads = []
+    load_workbook = openpyxl.load_workbook
+    monkeypatch.setattr(openpyxl, "load_workbook", lambda *args, **kwargs: loads.append(kwargs) or load_workbook(*args, **kwargs))
+    assert read_supplier_file(path) == (expected_data, expected_rows)
+    assert loads == [{'read_only': True, 'data_only': True}]
+
+
+def test_data_sheet_shorter_than_c21(tmp_path):
+    path = str(tmp_path / "Supplier I.xlsx")
+    wb = Workbook()
+    wb.active.title = "DATA"
+    wb.active['C7'] = "1234567890"
+    wb.create_sheet("offer").append([1, "Category1", "Service 1", "x"])
+    wb.save(path)
+    data_cells, offer_rows = read_supplier_file(path)
+    assert data_cells == {f'C{i}': "1234567890" if i == 7 else None for i in range(1, 22)}
+    assert offer_rows == [(1, "Category1", "Service 1", "x", None, None, None, None)]
@@ -0,0 +1,82 @@
+import os
+import shutil
+from datetime import date, datetime, time
+
+import pytest
+
+from pipeline import verdict_cache
+from pipeline.verdict_cache import RECORD, SCREENING, VerdictCache, data_digest, open_verdict_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+
+    def tick():
+        now[0] += 1
+        return now[0]
+    monkeypatch.setattr(verdict_cache.time, "time", tick)
+
+
+def digests(cache):
+    return sorted(digest for digest, in cache.conn.execute("SELECT digest FROM cache"))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    value = {"valid": True, "values": {"C1": "x" * 80, "C7": "123"}}
+    size = len(verdict_cache.json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    cache = VerdictCache(str(tmp_path / "cache.db"), max_bytes=3 * size)
+    for digest in "abc":
+        cache.put(digest, SCREENING, value)
+    cache.flush()
+    assert digests(cache) == ["a", "b", "c"]
+
+    # "a" is used again, so "b" is now the least recently used one
+    assert cache.get("a", SCREENING) == value
+    cache.put("d", SCREENING, value)
+    cache.flush()
+    assert digests(cache) == ["a", "c", "d"]
+    assert cache.get("b", SCREENING) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+    # Kept on disk for the next run (and the other script)
+    cache = VerdictCache(str(tmp_path / "cache.db"), max_bytes=3 * size)
+    assert cache.get("c", SCREENING) == value
+    cache.close()
+
+
+def test_values_and_kinds(tmp_path, monkeypatch):
+    cache = VerdictCache(str(tmp_path / "cache.db"))
+    digest = data_digest(b"attachment")
+    record = {"nip": "123", "data": {"B": datetime(2026, 1, 2, 3, 4), "C": date(2026, 1, 2), "D": time(5, 6), "E": 1.5}}
+    cache.put(digest, RECORD, record)
+    assert cache.get(digest, RECORD) == record  # found before the flush too
+    assert cache.get(digest, SCREENING) is None
+    cache.flush()
+    assert cache.get(digest, RECORD) == record
+
+    # Entries of an older version of the parser are not used
+    monkeypatch.setattr(verdict_cache, "VERSION", verdict_cache.VERSION + 1)
+    assert cache.get(digest, RECORD) is None
+    cache.close()
+
+
+def test_cache_size_from_config(tmp_path):
+    assert open_verdict_cache({"verdict_cache_mb": 0}, str(tmp_path / "off.db")) is None
+    cache = open_verdict_cache({"verdict_cache_mb": 0.5}, str(tmp_path / "on.db"))
+    assert cache.max_bytes == 2 ** 19
+    cache.close()
+
+
+# The same file sent again is not parsed by script 3
+def test_file_sent_again_is_not_parsed_again(workspace):
+    ws = workspace(count=2, known=2)
+    processing = ws.run()
+    assert processing.metrics.counters['files_parsed'] == 2
+    first = ws.supplier_files("Processed")[0]
+    shutil.copy(os.path.join(ws.folder, "Processed", first), os.path.join(ws.to_process, "Sent again.xlsx"))
+    processing = ws.run(timestamp="2026-01-02 00:00:00")
+    assert processing.metrics.counters['cache_hits'] == 1
+    assert processing.metrics.counters.get('bytes_read', 0) == 0  # the file wasn't read
+    assert "Sent again.xlsx" in ws.supplier_files("Processed")
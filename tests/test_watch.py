@@ -0,0 +1,73 @@
+import os
+import shutil
+import signal
+
+import pytest
+
+import pipeline.processing
+import pipeline.watcher
+from pipeline.watcher import DirectoryWatcher, StableFiles
+
+
+# Stops watch() (as Ctrl+C would) the n-th time it waits for files
+def stop_after(monkeypatch, waits=1):
+    calls = []
+
+    def wait(self, timeout):
+        calls.append(timeout)
+        if len(calls) >= waits:
+            raise KeyboardInterrupt
+        return True
+    monkeypatch.setattr(DirectoryWatcher, "wait", wait)
+
+
+def test_a_file_that_fails_does_not_stop_the_watch(workspace, monkeypatch):
+    ws = workspace(count=4, known=2, watch_settle_seconds=0)
+    invalid = [entry['file'] for entry in ws.manifest if entry['nip'] not in ws.nips[:2]]
+    stuck = invalid[0]
+    move = shutil.move
+
+    def failing_move(src, dst):
+        if os.path.basename(src) == stuck:
+            raise PermissionError("file is open in another program")
+        return move(src, dst)
+    monkeypatch.setattr(pipeline.processing.shutil, "move", failing_move)
+    monkeypatch.setattr(signal, "signal", lambda *args: None)  # not the handlers of the test process
+    stop_after(monkeypatch, waits=2)
+
+    ws.processing().watch()
+
+    assert ws.supplier_files("To_process") == [stuck]
+    assert len(ws.supplier_files("Processed")) == 2
+    assert ws.supplier_files("Invalid_files") == sorted(invalid[1:])
+
+
+def test_held_file_is_ready_again_once_it_changes(tmp_path):
+    stable = StableFiles(str(tmp_path), ".xlsx", settle_seconds=0)
+    path = tmp_path / "a.xlsx"
+    path.write_bytes(b"1")
+    assert stable.ready() == ["a.xlsx"]
+    stable.hold("a.xlsx")
+    assert stable.ready() == []
+    assert stable.next_check() is None
+    path.write_bytes(b"22")
+    assert stable.ready() == ["a.xlsx"]
+
+
+def test_sigterm_is_ignored_once_stopping(monkeypatch):
+    handlers = {}
+    monkeypatch.setattr(signal, "signal", lambda signum, handler: handlers.__setitem__(signum, handler))
+    pipeline.processing.ignore_sigterm()
+    assert handlers == {signal.SIGTERM: signal.SIG_IGN}
+
+
+@pytest.mark.parametrize("platform", ["win32", "linux"])
+def test_watcher_polls_where_there_is_no_inotify(tmp_path, monkeypatch, platform):
+    def no_libc(name, use_errno=False):
+        raise TypeError("expected str, bytes or os.PathLike object, not NoneType")  # CDLL(None) on Windows
+    monkeypatch.setattr(pipeline.watcher.sys, "platform", platform)
+    monkeypatch.setattr(pipeline.watcher.ctypes, "CDLL", no_libc)
+    watcher = DirectoryWatcher(str(tmp_path), poll_interval=0.01)
+    assert watcher.mode == "polling"
+    assert watcher.wait(0.01) is True
+    watcher.close()
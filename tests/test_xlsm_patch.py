@@ -0,0 +1,101 @@
+import shutil
+import zipfile
+
+import openpyxl
+
+from pipeline.xlsm_patch import WorkbookPatch
+from pipeline.xlsx_probe import sheet_parts
+from synthetic_data import TEMPLATE
+
+
+def _names(path):
+    with zipfile.ZipFile(path) as zf:
+        return zf.namelist()
+
+
+def test_parts_keep_their_order_and_untouched_parts_their_bytes(tmp_path):
+    path = str(tmp_path / "master.xlsm")
+    shutil.copyfile(TEMPLATE, path)
+    patch = WorkbookPatch(path)
+    patch.set('data1', 3, 805, "Supplier00001_cat_ok")
+    patch.save()
+
+    assert _names(path) == _names(TEMPLATE)
+    with zipfile.ZipFile(TEMPLATE) as before, zipfile.ZipFile(path) as after:
+        edited = sheet_parts(before)['data1']
+        for name in before.namelist():
+            if name != edited:
+                assert before.read(name) == after.read(name), name
+    assert openpyxl.load_workbook(path, keep_vba=True)['data1'].cell(3, 805).value == "Supplier00001_cat_ok"
+
+
+def test_calc_chain_is_dropped_only_when_a_formula_cell_is_overwritten(tmp_path):
+    path = str(tmp_path / "master.xlsm")
+    shutil.copyfile(TEMPLATE, path)
+    with zipfile.ZipFile(path) as zf:
+        chain = zf.read("xl/calcChain.xml").decode()
+    formula_ref = chain.split('<c r="', 1)[1].split('"', 1)[0]  # e.g. W1226 of the first sheet
+    sheet = openpyxl.load_workbook(path, read_only=True).sheetnames[0]
+
+    patch = WorkbookPatch(path)
+    patch.set(sheet, 3, 805, "x")
+    patch.save()
+    assert "xl/calcChain.xml" in _names(path)
+
+    patch = WorkbookPatch(path)
+    patch.set(sheet, int(formula_ref.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ")), formula_ref.rstrip("0123456789"), 1)
+    patch.save()
+    assert "xl/calcChain.xml" not in _names(path)
+    with zipfile.ZipFile(path) as zf:
+        assert b"calcChain" not in zf.read("[Content_Types].xml")
+        assert b"calcChain" not in zf.read("xl/_rels/workbook.xml.rels")
+
+
+# A workbook whose B1:B4 share the formula of B1 (the way Excel saves a filled-down formula)
+def _shared_formula_workbook(path):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'data1'
+    for row in range(1, 6):
+        ws.cell(row, 1).value = row
+        ws.cell(row, 2).value = 0
+    wb.save(path)
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+        sheet = sheet_parts(zf)['data1']
+    xml = parts[sheet].decode()
+    xml = xml.replace('<c r="B1" t="n"><v>0</v></c>', '<c r="B1"><f t="shared" ref="B1:B4" si="0">A1*2</f><v>2</v></c>')
+    for row in range(2, 5):
+        xml = xml.replace(f'<c r="B{row}" t="n"><v>0</v></c>', f'<c r="B{row}"><f t="shared" si="0"/><v>{row * 2}</v></c>')
+    assert xml.count('t="shared"') == 4
+    parts[sheet] = xml.encode()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+
+def test_overwriting_the_first_cell_of_a_shared_formula_keeps_the_other_cells(tmp_path):
+    path = str(tmp_path / "shared.xlsx")
+    _shared_formula_workbook(path)
+    patch = WorkbookPatch(path)
+    patch.set('data1', 1, 'B', 7)
+    patch.set('data1', 3, 'A', 30)
+    patch.save()
+
+    ws = openpyxl.load_workbook(path)['data1']
+    assert ws['B1'].value == 7
+    assert [ws[f'B{row}'].value for row in range(2, 6)] == ['=A2*2', '=A3*2', '=A4*2', 0]
+    assert ws['A3'].value == 30
+    with zipfile.ZipFile(path) as zf:
+        assert b'si="0"' not in zf.read(sheet_parts(zf)['data1'])
+
+
+def test_shared_formula_is_kept_when_its_first_cell_is_not_overwritten(tmp_path):
+    path = str(tmp_path / "shared.xlsx")
+    _shared_formula_workbook(path)
+    patch = WorkbookPatch(path)
+    patch.set('data1', 3, 'B', 7)
+    patch.save()
+
+    ws = openpyxl.load_workbook(path)['data1']
+    assert [ws[f'B{row}'].value for row in range(1, 5)] == ['=A1*2', '=A2*2', 7, '=A4*2']
@@ -0,0 +1,105 @@
+import os
+import re
+import shutil
+import zipfile
+
+import openpyxl
+import pytest
+
+from pipeline.xlsx_probe import probe_workbook, read_columns, read_rows, sheet_parts
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data", "To_process")
+
+# Cells with character references - the way Excel (and other writers) may store quotes and line breaks
+CELLS = {
+    'A': '<c r="A{row}" t="inlineStr"><is><t>say &quot;hi&quot;&#10;it&apos;s &amp; done</t></is></c>',
+    'B': '<c r="B{row}" t="str"><f>"x"</f><v>line&#xA;two&#13;&lt;3&gt;</v></c>',
+}
+
+
+def _workbook(path):
+    wb = openpyxl.Workbook()
+    wb.active.title = 'data1'
+    wb.active['C2'] = 1
+    wb.save(path)
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+        sheet = sheet_parts(zf)['data1']
+    xml = parts[sheet].decode()
+    cells = "".join(cell.format(row=2) for cell in CELLS.values())
+    parts[sheet] = xml.replace('<c r="C2"', cells + '<c r="C2"').encode()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+
+def test_cell_text_is_decoded_like_openpyxl_does(tmp_path):
+    path = str(tmp_path / "book.xlsx")
+    _workbook(path)
+    ws = openpyxl.load_workbook(path, data_only=True)['data1']
+    expected = {'A': ws['A2'].value, 'B': ws['B2'].value}
+    assert expected == {'A': 'say "hi"\nit\'s & done', 'B': 'line\ntwo\r<3>'}
+
+    columns = read_columns(path, 'data1', ['A', 'B'])
+    assert {col: values[2] for col, values in columns.items()} == expected
+    assert read_rows(path, 'data1', [2], ['A', 'B'])[2] == expected
+
+
+# Attributes can be in any order - Excel writes r first, other writers may not
+def test_cell_type_before_the_reference(tmp_path):
+    path = str(tmp_path / "book.xlsx")
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'data1'
+    ws.append(['NIP', 'flag', 'count'])
+    ws.append(['0123', True, 5])
+    ws.append(['x', False, 2.5])
+    wb.save(path)
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+        sheet = sheet_parts(zf)['data1']
+    parts[sheet] = re.sub(rb'<c r="([A-Z]+\d+)"((?: [a-z]+="[^"]*")*)', rb'<c\2 r="\1"', parts[sheet])
+    assert b'<c t="inlineStr" r="A2"' in parts[sheet] and b'<c t="b" r="B2"' in parts[sheet]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+    expected = {'A': {1: 'NIP', 2: '0123', 3: 'x'}, 'B': {1: 'flag', 2: True, 3: False}, 'C': {1: 'count', 2: 5, 3: 2.5}}
+    assert read_columns(path, 'data1', ['A', 'B', 'C']) == expected
+    # Many columns are found with the pattern for any column
+    columns = read_columns(path, 'data1', list(range(1, 21)))
+    assert {col: columns[col] for col in (1, 2, 3)} == dict(zip((1, 2, 3), expected.values()))
+    assert read_rows(path, 'data1', [2], ['A', 'B', 'C']) == {2: {'A': '0123', 'B': True, 'C': 5}}
+
+
+# Sheet names and the C1/C7 cells checked by script 2 - the same as openpyxl gives for the sample files (saved by Excel)
+@pytest.mark.parametrize("name", sorted(name for name in os.listdir(SAMPLES) if name.endswith(".xlsx")))
+def test_probe_matches_openpyxl(name):
+    path = os.path.join(SAMPLES, name)
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in wb.sheetnames:
+            probe = probe_workbook(path, sheet, ('C1', 'C7', 'ZZ999'))
+            assert probe.sheetnames == tuple(wb.sheetnames)
+            assert probe.values == {'C1': wb[sheet]['C1'].value, 'C7': wb[sheet]['C7'].value, 'ZZ999': None}
+    finally:
+        wb.close()
+
+
+def test_probe_of_a_missing_sheet_and_a_changed_file(tmp_path):
+    path = str(tmp_path / "attachment.xlsx")
+    shutil.copyfile(os.path.join(SAMPLES, "Sup1.xlsx"), path)
+    assert probe_workbook(path, 'DATA', ('C1',)).values == {'C1': None}
+    assert probe_workbook(path, 'Supplier DATA', ('C1',)).values == {'C1': 'Sup1'}
+
+    # Results are cached by path, size and modification time - a new file under the same name is read again
+    shutil.copyfile(os.path.join(SAMPLES, "Sup2.xlsx"), path)
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    expected = wb['Supplier DATA']['C1'].value
+    wb.close()
+    assert probe_workbook(path, 'Supplier DATA', ('C1',)).values == {'C1': expected}
+
+    with open(path, "wb") as f:
+        f.write(b"not a workbook")
+    with pytest.raises(zipfile.BadZipFile):
+        probe_workbook(path, 'Supplier DATA', ('C1',))